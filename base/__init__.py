@@ -2,12 +2,49 @@ __version__ = '2.0.9'
 
 __all__ = [
     'Interface', 'BaseExport', 'BaseImport', 'BaseSync', 'Mysql', 'Csv', 'logger',
-    'BColors', 'config', 'exe_command', 'str2bool', 'dumps_folder', 'format_json'
+    'BColors', 'config', 'exe_command', 'str2bool', 'dumps_folder', 'format_json', 'null_column', 'IndexRestorer',
+    'BaseClear', 'TableVerifier', 'ReplicatedMysql', 'JobQueue', 'SyncCoordinator', 'SyncWorker'
 ]
 
-from base._export import *
-from base._import import *
-from base._interface import *
-from base._sink import *
-from base._sync import *
-from base._utils import *
+import importlib
+
+# 子模块按需加载, 只用到 Mysql/config 的轻量入口不需要导入 pandas 等重量级依赖
+_submodules = ['base._utils', 'base._interface', 'base._sink', 'base._index', 'base._export', 'base._import',
+               'base._sync', 'base._clear']
+_attr_modules = {
+    'Interface': 'base._interface',
+    'BaseExport': 'base._export',
+    'BaseImport': 'base._import',
+    'BaseSync': 'base._sync',
+    'Mysql': 'base._sink',
+    'Csv': 'base._sink',
+    'logger': 'base._utils',
+    'BColors': 'base._utils',
+    'config': 'base._utils',
+    'exe_command': 'base._utils',
+    'str2bool': 'base._utils',
+    'dumps_folder': 'base._utils',
+    'format_json': 'base._utils',
+    'null_column': 'base._utils',
+    'IndexRestorer': 'base._index',
+    'BaseClear': 'base._clear',
+    'TableVerifier': 'base._verify',
+    'ReplicatedMysql': 'base._replica',
+    'JobQueue': 'base._distributed',
+    'SyncCoordinator': 'base._distributed',
+    'SyncWorker': 'base._distributed',
+}
+
+
+def __getattr__(name):
+    if name in _attr_modules:
+        return getattr(importlib.import_module(_attr_modules[name]), name)
+    for submodule in _submodules:
+        module = importlib.import_module(submodule)
+        if hasattr(module, name) and not name.startswith('_'):
+            return getattr(module, name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
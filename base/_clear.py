@@ -0,0 +1,98 @@
+import concurrent
+import time
+from concurrent.futures import as_completed
+
+from base._sink import Mysql
+from base._utils import logger, tqdm
+
+
+class BaseClear:
+    """
+    清除目标库租户数据
+    """
+
+    def __init__(self, target: Mysql, databases: list, max_workers=8):
+        """
+        :param target: 要清除数据的目标库
+        :param databases: 数据库列表
+        :param max_workers: 并发清除的表数量
+        """
+        self.target = target
+        self.databases = databases
+        self.max_workers = max_workers
+
+    def list_tenant_tables(self) -> list[tuple]:
+        """
+        一次查询列出所有包含ent_code字段的租户表
+        :return: [(database, table, 估算行数)]
+        """
+        return self.target.list_tables_with_column(self.databases, 'ent_code')
+
+    def _clear_parallel(self, clear_table, desc):
+        """
+        并发清除所有租户表
+        :param clear_table: 清除单个表的方法 function(database, table) -> 删除的行数
+        :param desc: 进度条描述
+        :return: {(database, table): (删除的行数, 耗时秒数)}
+        """
+        s_time = time.time()
+        tables = self.list_tenant_tables()
+        logger.info(f'【待清除租户表】共 {len(tables)} 个')
+
+        results = {}
+        clear_bar = tqdm(total=len(tables), desc=desc)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+
+            def clear(database, table):
+                t_time = time.time()
+                rows = clear_table(database, table)
+                return rows, time.time() - t_time
+
+            # 大表先处理
+            futures = {pool.submit(clear, database, table): (database, table) for database, table, _ in tables}
+            for future in as_completed(futures):
+                database, table = futures[future]
+                try:
+                    results[(database, table)] = future.result()
+                except BaseException as e:
+                    logger.error(f'\r\t【{database}.{table} 清除失败】{repr(e)}')
+                clear_bar.update(1)
+
+        total_rows = sum(rows for rows, _ in results.values() if rows)
+        logger.info(f'【清除完成】成功 {len(results)}/{len(tables)} 个表，删除 {total_rows} 条，'
+                    f'耗时 {time.time() - s_time:.2f}秒')
+        for (database, table), (rows, cost) in sorted(results.items(), key=lambda x: x[1][1], reverse=True)[:10]:
+            logger.info(f'    {database}.{table}: {cost:.2f}秒')
+        return results
+
+    def truncate_parallel(self):
+        """
+        并发清空所有租户表
+        :return: {(database, table): (删除的行数, 耗时秒数)}
+        """
+
+        def truncate_table(database, table):
+            self.target.execute_update(f'truncate table `{database}`.`{table}`')
+            return None
+
+        return self._clear_parallel(truncate_table, '清空租户表。。。')
+
+    def delete_parallel(self, ent_codes, batch_size=5000):
+        """
+        并发分批删除指定账套的数据，不影响其他租户
+        :param ent_codes: 账套列表
+        :param batch_size: 每批删除数量，避免大事务和长时间锁表
+        :return: {(database, table): (删除的行数, 耗时秒数)}
+        """
+        ent_codes_in = ', '.join(f"'{ent_code}'" for ent_code in ent_codes)
+
+        def delete_table(database, table):
+            rows = 0
+            while True:
+                deleted = self.target.execute_update(
+                    f'delete from `{database}`.`{table}` where ent_code in ({ent_codes_in}) limit {batch_size}')
+                rows += deleted
+                if deleted < batch_size:
+                    return rows
+
+        return self._clear_parallel(delete_table, f'清除账套 {ent_codes} 的数据。。。')
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from threading import Lock
+
+from base._sink import Mysql
+from base._utils import logger
+
+# 自动生成的建表sql文件的首行标记, 没有标记的文件是手工维护的，不会被覆盖
+BUNDLE_MARKER = '-- generated by ddl cache, schema:'
+
+
+def rewrite_create_sql(create_sql) -> str:
+    """
+    源表的建表语句转换为目标库可以重复执行的建表语句
+    :param create_sql: show create table 的结果
+    :return: 建表语句
+    """
+    create_sql = create_sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS')
+    create_sql = create_sql.replace('utf8mb4_0900_ai_ci', 'utf8mb4_general_ci')
+    create_sql = create_sql.replace('ROW_FORMAT=COMPACT', '')
+    return create_sql
+
+
+def read_bundle_schema(bundle_file):
+    """
+    读取自动生成的建表sql文件记录的表结构指纹
+    :param bundle_file: sql文件
+    :return: 指纹, 文件不存在返回None, 手工维护的文件返回False
+    """
+    if not os.path.exists(bundle_file):
+        return None
+    with open(bundle_file, 'r', encoding='utf-8') as f:
+        first_line = f.readline().strip()
+    if not first_line.startswith(BUNDLE_MARKER):
+        return False
+    return first_line[len(BUNDLE_MARKER):].strip()
+
+
+class DdlCache:
+    """
+    建表语句缓存
+    按表结构指纹缓存转换后的建表语句到 {folder}/cache/{数据库}.json，只有结构变化的表重新 show create table，
+    并生成 {folder}/create/{数据库}.sql，目标库一次导入所有表
+    """
+
+    def __init__(self, source: Mysql, folder='sqls'):
+        """
+        :param source: 源库
+        :param folder: 缓存及建表sql文件的根目录
+        """
+        self.source = source
+        self.cache_folder = os.path.join(folder, 'cache')
+        self.bundle_folder = os.path.join(folder, 'create')
+        self._lock = Lock()
+
+    def get_bundle_file(self, database):
+        return os.path.join(self.bundle_folder, f'{database}.sql')
+
+    def _load(self, database) -> dict:
+        cache_file = os.path.join(self.cache_folder, f'{database}.json')
+        if not os.path.exists(cache_file):
+            return {}
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            # 缓存损坏时全部重新生成
+            return {}
+
+    def _save(self, database, cache):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        cache_file = os.path.join(self.cache_folder, f'{database}.json')
+        tmp_file = f'{cache_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, cache_file)
+
+    def get_create_sqls(self, database, tables) -> dict:
+        """
+        获取表的建表语句, 表结构未变化时使用缓存
+        :param database: 源数据库
+        :param tables: 表列表
+        :return: {table: (表结构指纹, 建表语句)}
+        """
+        with self._lock:
+            hashes = self.source.get_schema_hashes(database)
+            cache = self._load(database)
+            changed = [table for table in tables if table not in cache or cache[table]['hash'] != hashes.get(table)]
+            for table in changed:
+                cache[table] = {'hash': hashes.get(table),
+                                'sql': rewrite_create_sql(self.source.get_table_create_sql(table, database))}
+            # 去掉源库已删除的表
+            removed = [table for table in cache if table not in hashes]
+            for table in removed:
+                del cache[table]
+            if changed or removed:
+                logger.info(f'【{database}】建表语句缓存更新 {len(changed)} 个表，删除 {len(removed)} 个表')
+                self._save(database, cache)
+            return {table: (cache[table]['hash'], cache[table]['sql']) for table in tables}
+
+    def build_bundle(self, database, tables):
+        """
+        生成数据库的建表sql文件, 表结构未变化时不重写
+        :param database: 源数据库
+        :param tables: 需要创建的表
+        :return: 建表sql文件, 存在手工维护的文件时直接返回该文件
+        """
+        bundle_file = self.get_bundle_file(database)
+        bundle_schema = read_bundle_schema(bundle_file)
+        if bundle_schema is False:
+            return bundle_file
+        create_sqls = self.get_create_sqls(database, tables)
+        schema = hashlib.md5(''.join(f'{table}:{create_sqls[table][0]};'
+                                     for table in sorted(create_sqls)).encode('utf-8')).hexdigest()
+        if schema == bundle_schema:
+            return bundle_file
+        os.makedirs(self.bundle_folder, exist_ok=True)
+        tmp_file = f'{bundle_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(f'{BUNDLE_MARKER} {schema}\n')
+            for table in tables:
+                f.write(f'{create_sqls[table][1]};\n\n')
+        os.replace(tmp_file, bundle_file)
+        logger.info(f'【{database}】生成建表sql文件 {bundle_file}')
+        return bundle_file
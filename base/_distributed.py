@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from base._memory import get_memory_governor
+from base._utils import logger, get_config, lazy_import
+
+if TYPE_CHECKING:
+    from base._sync import BaseSync
+
+sa = lazy_import('sqlalchemy')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    持久化的同步任务队列, 任务保存在数据库表中(sqlite或者mysql)，多个主机上的多个进程共享
+    领取任务时写入租约到期时间，执行期间定时心跳续约，进程退出后租约过期的任务会被其他进程重新领取
+    """
+
+    def __init__(self, url=None, lease_seconds=None, max_attempts=None, table_name='sync_job'):
+        """
+        :param url: sqlalchemy连接串, 默认读取 config.ini 中 [distributed] queue_url，默认 sqlite:///sync_queue.db
+        :param lease_seconds: 租约时长(秒), 默认 [distributed] lease_seconds，默认120
+        :param max_attempts: 每个任务最多执行次数, 默认 [distributed] max_attempts，默认3
+        :param table_name: 任务表名
+        """
+        config = get_config()
+        url = url or config.get('distributed', 'queue_url', fallback='sqlite:///sync_queue.db')
+        self.lease_seconds = lease_seconds or config.getfloat('distributed', 'lease_seconds', fallback=120)
+        self.max_attempts = max_attempts or config.getint('distributed', 'max_attempts', fallback=3)
+        # sqlite多进程写入时等待锁释放
+        connect_args = {'timeout': 30} if url.startswith('sqlite') else {}
+        self.engine = sa.create_engine(url, connect_args=connect_args, pool_pre_ping=True)
+        metadata = sa.MetaData()
+        self.table = sa.Table(
+            table_name, metadata,
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('run_id', sa.String(64), nullable=False),
+            sa.Column('instance', sa.String(64), nullable=False),
+            sa.Column('database_name', sa.String(128), nullable=False),
+            sa.Column('table_name', sa.String(128), nullable=False),
+            sa.Column('status', sa.String(16), nullable=False, default=PENDING),
+            sa.Column('worker', sa.String(128)),
+            sa.Column('lease_until', sa.Float),
+            sa.Column('heartbeat_at', sa.Float),
+            sa.Column('attempts', sa.Integer, nullable=False, default=0),
+            sa.Column('error', sa.Text),
+            # 执行者删除目标表索引前保存的恢复语句 {"database": 目标库, "sqls": [...]}, 接手的执行者据此恢复
+            sa.Column('index_sqls', sa.Text),
+            sa.UniqueConstraint('run_id', 'instance', 'database_name', 'table_name'),
+            sa.Index(f'idx_{table_name}_claim', 'run_id', 'status'),
+        )
+        metadata.create_all(self.engine)
+        # 之前版本创建的任务表补充字段
+        if 'index_sqls' not in [column['name'] for column in sa.inspect(self.engine).get_columns(table_name)]:
+            with self.engine.begin() as conn:
+                conn.execute(sa.text(f'ALTER TABLE {table_name} ADD COLUMN index_sqls TEXT'))
+
+    def enqueue(self, run_id, instance, tables) -> int:
+        """
+        添加任务, 同一次运行中已存在的任务不重复添加(重新规划时只补充新的表)
+        :param run_id: 运行标识
+        :param instance: 实例名
+        :param tables: [(database, table)] 按执行优先级排列
+        :return: 新添加的任务数量
+        """
+        job = self.table
+        with self.engine.begin() as conn:
+            exists = set(conn.execute(sa.select(job.c.database_name, job.c.table_name).where(
+                job.c.run_id == run_id, job.c.instance == instance)).all())
+            rows = [dict(run_id=run_id, instance=instance, database_name=database, table_name=table,
+                         status=PENDING, attempts=0)
+                    for database, table in tables if (database, table) not in exists]
+            if rows:
+                conn.execute(job.insert(), rows)
+        return len(rows)
+
+    def _claimable(self, now):
+        job = self.table
+        return sa.and_(job.c.attempts < self.max_attempts,
+                       sa.or_(job.c.status == PENDING, sa.and_(job.c.status == RUNNING, job.c.lease_until < now)))
+
+    def claim(self, run_id, worker, instances=None) -> dict | None:
+        """
+        领取一个待执行或者租约已过期的任务
+        先查询候选任务再按原条件更新，更新成功的进程才算领取到(乐观并发，sqlite和mysql通用)
+        :param run_id: 运行标识
+        :param worker: 执行者标识
+        :param instances: 只领取这些实例的任务
+        :return: 任务 dict(id, instance, database, table, attempts, index_sqls), 没有可领取的任务时返回None
+        """
+        job = self.table
+        while True:
+            now = time.time()
+            self._fail_exhausted(run_id, now)
+            query = sa.select(job.c.id).where(job.c.run_id == run_id, self._claimable(now))
+            if instances:
+                query = query.where(job.c.instance.in_(list(instances)))
+            with self.engine.begin() as conn:
+                job_id = conn.execute(query.order_by(job.c.id).limit(1)).scalar()
+                if job_id is None:
+                    return None
+                claimed = conn.execute(job.update().where(job.c.id == job_id, self._claimable(now)).values(
+                    status=RUNNING, worker=worker, lease_until=now + self.lease_seconds, heartbeat_at=now,
+                    attempts=job.c.attempts + 1)).rowcount
+                if claimed != 1:
+                    # 被其他进程抢先领取，重新查询
+                    continue
+                row = conn.execute(sa.select(job).where(job.c.id == job_id)).mappings().one()
+            if row['attempts'] > 1:
+                logger.warning(f"【任务 {row['instance']}.{row['database_name']}.{row['table_name']}】"
+                               f"第 {row['attempts']} 次执行(上次执行未完成或失败)")
+            return {'id': row['id'], 'instance': row['instance'], 'database': row['database_name'],
+                    'table': row['table_name'], 'attempts': row['attempts'],
+                    'index_sqls': json.loads(row['index_sqls']) if row['index_sqls'] else None}
+
+    def _fail_exhausted(self, run_id, now):
+        """
+        租约过期且已达到最多执行次数的任务标记为失败
+        """
+        job = self.table
+        with self.engine.begin() as conn:
+            conn.execute(job.update().where(job.c.run_id == run_id, job.c.status == RUNNING, job.c.lease_until < now,
+                                            job.c.attempts >= self.max_attempts)
+                         .values(status=FAILED, error='租约过期'))
+
+    def heartbeat(self, job, worker) -> bool:
+        """
+        续约
+        :return: False: 租约已丢失(已过期并被其他进程领取)
+        """
+        now = time.time()
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(table.update().where(table.c.id == job['id'], table.c.worker == worker,
+                                                     table.c.status == RUNNING)
+                                .values(lease_until=now + self.lease_seconds, heartbeat_at=now)).rowcount == 1
+
+    def save_index_sqls(self, job, worker, database, sqls) -> bool:
+        """
+        删除目标表索引前保存恢复语句, 已保存过时保留第一次保存的语句(之前的执行者删除索引前的完整索引)
+        :param job: 任务
+        :param worker: 执行者标识
+        :param database: 目标数据库
+        :param sqls: 索引恢复语句
+        :return: False: 租约已丢失
+        """
+        table = self.table
+        with self.engine.begin() as conn:
+            owned = conn.execute(sa.select(table.c.index_sqls).where(
+                table.c.id == job['id'], table.c.worker == worker, table.c.status == RUNNING)).first()
+            if owned is None:
+                return False
+            if owned[0] is None:
+                conn.execute(table.update().where(table.c.id == job['id'], table.c.index_sqls.is_(None))
+                             .values(index_sqls=json.dumps({'database': database, 'sqls': list(sqls)},
+                                                           ensure_ascii=False)))
+        return True
+
+    def complete(self, job, worker, error=None) -> bool:
+        """
+        任务执行结束, 失败且未达到最多执行次数时重新放回队列
+        :param job: 任务
+        :param worker: 执行者标识
+        :param error: 错误信息, None表示成功
+        :return: False: 租约已丢失，结果未记录
+        """
+        if error is None:
+            status = DONE
+        else:
+            status = FAILED if job['attempts'] >= self.max_attempts else PENDING
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(table.update().where(table.c.id == job['id'], table.c.worker == worker,
+                                                     table.c.status == RUNNING)
+                                .values(status=status, error=error, lease_until=None)).rowcount == 1
+
+    def stats(self, run_id) -> dict:
+        """
+        各状态的任务数量
+        :return: {status: 数量}
+        """
+        table = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(sa.select(table.c.status, sa.func.count()).where(table.c.run_id == run_id)
+                                .group_by(table.c.status)).all()
+        return {status: count for status, count in rows}
+
+    def failures(self, run_id) -> list[tuple]:
+        """
+        失败的任务
+        :return: [(instance, database, table, 错误信息)]
+        """
+        table = self.table
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(
+                sa.select(table.c.instance, table.c.database_name, table.c.table_name, table.c.error)
+                .where(table.c.run_id == run_id, table.c.status == FAILED).order_by(table.c.id)).all()]
+
+
+class SyncCoordinator:
+    """
+    分布式同步的协调者: 准备目标库表结构，按表生成任务放入队列，等待所有任务完成
+    """
+
+    def __init__(self, queue: JobQueue, instances: list[BaseSync], run_id):
+        self.queue = queue
+        self.instances = instances
+        self.run_id = run_id
+
+    def plan(self, drop_database=False, tee_dumps_folder=None) -> int:
+        """
+        生成任务, 大表优先
+        :return: 新添加的任务数量
+        """
+        count = 0
+        for instance in self.instances:
+            db_map = instance.prepare_sync(drop_database=drop_database, tee_dumps_folder=tee_dumps_folder)
+            sizes = instance.source.get_tables_size(instance.databases)
+            tables = sorted(((database, table) for database, tables in db_map.items() for table in tables),
+                            key=lambda item: sizes.get(item, 0), reverse=True)
+            added = self.queue.enqueue(self.run_id, instance.get_name(), tables)
+            logger.info(f'【实例 {instance.get_name()}】添加同步任务 {added} 个')
+            count += added
+        return count
+
+    def wait(self, poll_seconds=10) -> list[tuple]:
+        """
+        等待所有任务完成
+        :param poll_seconds: 查询间隔
+        :return: 失败的任务 [(instance, database, table, 错误信息)]
+        """
+        while True:
+            stats = self.queue.stats(self.run_id)
+            logger.info(f'【同步任务 {self.run_id}】' + ', '.join(f'{status}: {count}' for status, count in stats.items()))
+            if not stats.get(PENDING) and not stats.get(RUNNING):
+                break
+            time.sleep(poll_seconds)
+        failures = self.queue.failures(self.run_id)
+        if failures:
+            logger.error(f'【同步任务 {self.run_id} 失败 {len(failures)} 个】')
+            for instance, database, table, error in failures:
+                logger.error(f'    {instance}: {database}.{table}: {error}')
+        else:
+            logger.info(f'【同步任务 {self.run_id} 全部完成】')
+        return failures
+
+
+class SyncWorker:
+    """
+    分布式同步的执行者: 从队列中领取表任务，使用现有的单表同步逻辑执行，执行期间定时心跳续约
+    队列中没有可领取的任务且没有执行中的任务时退出
+    任务标记完成前重建本表删除的索引，完成的任务不会再被领取；
+    删除索引前恢复语句先保存到任务中，执行者中途退出时，接手任务的执行者负责恢复
+    """
+
+    def __init__(self, queue: JobQueue, instances: list[BaseSync], run_id, ent_codes, worker=None,
+                 poll_seconds=5, **sync_kwargs):
+        """
+        :param queue: 任务队列
+        :param instances: 同步实例, 只领取这些实例的任务
+        :param run_id: 运行标识
+        :param ent_codes: 账套列表
+        :param worker: 执行者标识, 默认 主机名:进程号
+        :param poll_seconds: 没有可领取的任务时的等待间隔
+        :param sync_kwargs: _sync_database_table 的其他参数(test_data/delete_data/sync_platform_data等)
+        """
+        self.queue = queue
+        self.instances = {instance.get_name(): instance for instance in instances}
+        self.run_id = run_id
+        self.ent_codes = ent_codes
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_seconds = poll_seconds
+        self.sync_kwargs = sync_kwargs
+
+    def _heartbeat(self, job, stop: threading.Event, lost: threading.Event):
+        """
+        定时续约, 租约丢失或者续约失败到租约到期时设置 lost，停止任务的写入(任务会被其他进程重新执行)
+        """
+        deadline = time.time() + self.queue.lease_seconds
+        while not stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(job, self.worker):
+                    logger.warning(f"【{self.worker}】任务 {job['database']}.{job['table']} 的租约已丢失，停止执行")
+                    lost.set()
+                    return
+                deadline = time.time() + self.queue.lease_seconds
+            except BaseException as e:
+                logger.warning(f"【{self.worker}】任务 {job['database']}.{job['table']} 续约失败: {repr(e)}")
+                if time.time() >= deadline:
+                    # 租约已到期，随时可能被其他进程接手
+                    logger.warning(f"【{self.worker}】任务 {job['database']}.{job['table']} 的租约已到期，停止执行")
+                    lost.set()
+                    return
+
+    def _save_index_sqls(self, job, database, table, index_alert_sqls):
+        """
+        删除索引前把恢复语句保存到任务中, 进程退出后接手的执行者可以恢复索引
+        """
+        if not self.queue.save_index_sqls(job, self.worker, database, index_alert_sqls):
+            raise RuntimeError(f'【{database}.{table}】任务租约已丢失，不删除索引')
+
+    def _register_reclaimed_indexes(self, instance: BaseSync, job):
+        """
+        接手的任务: 之前的执行者删除索引后退出时，恢复语句只保存在任务中。登记目标表上仍然缺少的索引，与本进程删除的索引一起重建
+        """
+        stored = job.get('index_sqls')
+        if not stored:
+            return
+        existing = set(instance.target.get_table_index_alert_sqls(stored['database'], job['table']))
+        missing = [sql for sql in stored['sqls'] if sql not in existing]
+        if missing:
+            logger.info(f"【{self.worker}】任务 {job['database']}.{job['table']} 恢复之前执行者删除的 {len(missing)} 个索引")
+            instance.index_restorer.add(stored['database'], job['table'], missing)
+
+    def _release_failed_indexes(self, instance: BaseSync, job):
+        """
+        失败的任务: 重新放回队列时取消本进程登记的索引恢复，恢复语句只由任务记录，避免与接手的执行者重复执行；
+        最后一次执行失败时任务不会再被领取，由本进程重建已删除的索引
+        """
+        target_database = instance.get_target_database(job['database'])
+        if job['attempts'] < self.queue.max_attempts:
+            instance.index_restorer.discard(target_database, job['table'])
+            return
+        try:
+            self._register_reclaimed_indexes(instance, job)
+            instance.index_restorer.restore_table(target_database, job['table'])
+        except BaseException as e:
+            logger.error(f"\r\t【{job['database']}.{job['table']} 索引重建失败】{repr(e)}")
+
+    def run_job(self, job):
+        """
+        执行单个任务
+        :param job: 任务
+        :return:
+        """
+        instance = self.instances[job['instance']]
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop, lost), daemon=True)
+        heartbeat.start()
+        error = None
+        instance.index_restorer.drop_listener = \
+            lambda database, table, sqls: self._save_index_sqls(job, database, table, sqls)
+        # 租约丢失后停止写入，避免与接手的进程同时删除、写入同一个表
+        instance.cancel_event = lost
+        try:
+            instance._sync_database_table(job['database'], job['table'], self.ent_codes, **self.sync_kwargs)
+            self._register_reclaimed_indexes(instance, job)
+            # 标记完成前重建索引(续约仍在进行)，进程在完成后退出也不会丢失索引; 租约已丢失时由接手的执行者重建
+            instance._check_cancelled(job['database'], job['table'])
+            errors = instance.index_restorer.restore_table(instance.get_target_database(job['database']),
+                                                           job['table'])
+            if errors:
+                raise RuntimeError(f'索引重建失败: {"; ".join(errors)}')
+        except BaseException as e:
+            error = repr(e)
+            logger.error(f"\r\t【{job['database']}.{job['table']} 表同步失败】{error}")
+        finally:
+            instance.index_restorer.drop_listener = None
+            instance.cancel_event = None
+            stop.set()
+            heartbeat.join()
+        if lost.is_set():
+            # 接手的进程根据任务中保存的恢复语句重建索引
+            instance.index_restorer.discard(instance.get_target_database(job['database']), job['table'])
+            logger.warning(f"【{self.worker}】任务 {job['database']}.{job['table']} 的租约已丢失，结果未记录")
+            return
+        if error is not None:
+            self._release_failed_indexes(instance, job)
+        if not self.queue.complete(job, self.worker, error):
+            logger.warning(f"【{self.worker}】任务 {job['database']}.{job['table']} 的租约已丢失，结果未记录")
+
+    def run(self) -> int:
+        """
+        循环领取并执行任务
+        :return: 执行的任务数量
+        """
+        for instance in self.instances.values():
+            instance.reset_sync_state()
+        count = 0
+        while True:
+            job = self.queue.claim(self.run_id, self.worker, self.instances.keys())
+            if job is None:
+                stats = self.queue.stats(self.run_id)
+                # 其他进程还有执行中的任务时继续等待，租约过期后可以接手
+                if not stats.get(PENDING) and not stats.get(RUNNING):
+                    break
+                time.sleep(self.poll_seconds)
+                continue
+            self.run_job(job)
+            count += 1
+
+        get_memory_governor().report(desc=f'{self.worker}')
+        logger.info(f'【{self.worker}】执行任务 {count} 个')
+        return count
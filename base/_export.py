@@ -3,9 +3,12 @@ import os
 import shutil
 from concurrent.futures import as_completed
 
-from base._utils import logger
-from base._sink import Mysql
-from base._interface import ExportInterface
+from base._utils import logger, tqdm, replace_bit_bytes
+from base._manifest import ExportManifest
+from base._memory import get_memory_governor
+from base._profile import profiled
+from base._sink import Mysql, get_pushdown_columns, and_conditions
+from base._interface import ExportInterface, ImportInterface
 
 
 class BaseExport(ExportInterface):
@@ -13,86 +16,183 @@ class BaseExport(ExportInterface):
     导出到csv基类
     """
 
-    def __init__(self, source: Mysql, databases: list, dumps_folder: str, max_workers=4):
+    def __init__(self, source: Mysql, databases: list, dumps_folder: str, max_workers=4, use_cache=True):
+        """
+        :param use_cache: 是否复用上次导出的csv, 表数据指纹(行数、更新时间或校验和、表结构、账套条件)未变化时跳过导出
+        """
         self.source = source
         self.databases = databases
         self.dumps_folder = dumps_folder
         self.max_workers = max_workers
+        self.use_cache = use_cache
+        self._manifests = {}
+
+    def _prepare_export_database(self, database) -> list[str]:
+        """
+        导出数据库前的准备工作: 清理数据库目录, 使用缓存时只清理源库已不存在的表
+        :param database: 数据库
+        :return: 源数据库表列表
+        """
+        database_file = os.path.join(self.dumps_folder, database)
+        source_tables = self.source.list_tables(database)
+        if not self.use_cache:
+            # 先删除数据库目录，如果存在的话
+            if os.path.exists(database_file):
+                shutil.rmtree(database_file)
+            os.makedirs(database_file)
+            return source_tables
+
+        os.makedirs(database_file, exist_ok=True)
+        manifest = ExportManifest(database_file)
+        self._manifests[database] = manifest
+        for file in os.listdir(database_file):
+            table, ext = os.path.splitext(file)
+            if ext == '.csv' and table not in source_tables:
+                os.remove(os.path.join(database_file, file))
+        for table in manifest.tables():
+            if table not in source_tables:
+                manifest.invalidate(table)
+        return source_tables
+
+    def _remove_table_dump(self, database, table):
+        """
+        删除表的导出文件及缓存记录
+        :param database: 数据库
+        :param table: 表名
+        :return:
+        """
+        manifest = self._manifests.get(database)
+        if manifest:
+            manifest.invalidate(table)
+        csv_file = os.path.join(self.dumps_folder, database, f'{table}.csv')
+        if os.path.exists(csv_file):
+            os.remove(csv_file)
+
+    def _get_pushdown(self, database, table):
+        """
+        同时实现了导入接口时，把导入模式下的常量字段覆盖和行过滤条件下推到导出查询中
+        导入时 chunk_wrapper 再次处理的结果不变
+        :param database: 数据库
+        :param table: 表名
+        :return: (查询字段表达式列表或None, 行过滤条件或None)
+        """
+        if not isinstance(self, ImportInterface):
+            return None, None
+        columns = self.source.get_table_column_names(database, table)
+        pushdown_columns = get_pushdown_columns(columns, self.column_overrides(database, table, False) or {})
+        return pushdown_columns, self.row_predicate(database, table, False)
+
+    @profiled
+    def _export_database_table(self, database, source_table, ent_code):
+        """
+        导出源的指定表
+        :param database:
+        :param source_table:
+        :param ent_code:
+        :return: True: 已导出 False: 跳过
+        """
+        # 调试模式，单独只导入某一个表
+        debug_table = self.single_table_for_debug()
+        if debug_table and source_table != debug_table:
+            self._remove_table_dump(database, source_table)
+            return False
+
+        # 匹配表过滤器，如果返回true则继续导出，否则跳过当前表继续下一个
+        if self.table_data_match_filter:
+            matcher = self.table_data_match_filter(database, source_table)
+            if not matcher:
+                self._remove_table_dump(database, source_table)
+                return False
+
+        csv_file = os.path.join(self.dumps_folder, database, f'{source_table}.csv')
+        # 判断表是否包含ent_code字段
+        exist_ent_code_column = self.source.exists_table_column(database, source_table, 'ent_code')
+
+        pushdown_columns, predicate = self._get_pushdown(database, source_table)
+        condition = and_conditions(f"ent_code = '{ent_code}'" if exist_ent_code_column else None, predicate)
+
+        # 表数据未变化则复用上次导出的csv
+        manifest = self._manifests.get(database)
+        fingerprint = None
+        if manifest:
+            # 导出前计算指纹，导出过程中发生的变更会在下次导出时识别出来
+            fingerprint = self.source.get_table_fingerprint(database, source_table, condition)
+            # 下推的字段变化时也需要重新导出
+            if pushdown_columns:
+                fingerprint['columns'] = pushdown_columns
+            # 没有数据时不会生成csv, 记录的指纹一致即可跳过
+            if manifest.get(source_table) == fingerprint and (os.path.exists(csv_file) or fingerprint['rows'] == 0):
+                logger.info(f'    【导出表 {database}.{source_table}】数据未变化，复用已有文件')
+                return False
+
+        logger.info(f'    【导出表 {database}.{source_table}】。。。')
+        # 先删除旧文件及缓存记录，导出中途失败不会留下被误用的csv
+        self._remove_table_dump(database, source_table)
+
+        # 不包含ent_code字段，则导出全表， 否则导出ent_code条件内数据
+        if not exist_ent_code_column and not pushdown_columns and not predicate:
+            self.source.from_table_to_csv(database, source_table,
+                                          csv_file=csv_file)
+        else:
+            select = ', '.join(pushdown_columns) if pushdown_columns else '*'
+            where = f' where {condition}' if condition else ''
+            count_sql = f"/** 导出数量 **/ select count(0) from `{database}`.`{source_table}`{where}"
+            query_sql = f"/** 导出数据 **/ select {select} from `{database}`.`{source_table}`{where}"
+
+            self.source.from_sql_to_csv(count_sql, query_sql, database=database, csv_file=csv_file,
+                                        chunk_callback=replace_bit_bytes if exist_ent_code_column else None)
+        if manifest:
+            manifest.set(source_table, fingerprint)
+        return True
 
     def _export_database(self, database, ent_code):
         """
-        导出源的指定数据库所有表
+        串行导出源的指定数据库所有表
         :param database:
         :param ent_code:
         :return:
         """
-        # 先删除数据库目录，如果存在的话
-        database_file = os.path.join(self.dumps_folder, database)
-        if os.path.exists(database_file):
-            shutil.rmtree(database_file)
-
-        source_tables = self.source.list_tables(database)
-        for index, source_table in enumerate(source_tables):
-
-            # 调试模式，单独只导入某一个表
-            debug_table = self.single_table_for_debug()
-            if debug_table and source_table != debug_table:
-                continue
-
-            # 匹配表过滤器，如果返回true则继续导出，否则跳过当前表继续下一个
-            if self.table_data_match_filter:
-                matcher = self.table_data_match_filter(database, source_table)
-                if not matcher:
-                    continue
-
-            logger.info(f'    【导出表 {database}.{source_table} {index + 1}/{len(source_tables)}】。。。')
-            csv_file = os.path.join(self.dumps_folder, database, f'{source_table}.csv')
-            # csv存在的话先删除文件,几乎没有这个情况。因为上面先删除库目录的。
-            if os.path.exists(csv_file):
-                os.remove(csv_file)
-            # csv目录不存在的话先创建
-            if not os.path.exists(os.path.dirname(csv_file)):
-                os.makedirs(os.path.dirname(csv_file))
-
-            # 判断表是否包含ent_code字段
-            exist_ent_code_column = self.source.exists_table_column(database, source_table, 'ent_code')
-
-            # 不包含ent_code字段，则导出全表， 否则导出ent_code条件内数据
-            if not exist_ent_code_column:
-                self.source.from_table_to_csv(database, source_table,
-                                              csv_file=csv_file)
-            else:
-                count_sql = f"/** 导出数量 **/ select count(0) from `{database}`.`{source_table}` where ent_code = '{ent_code}'"
-                query_sql = f"/** 导出数据 **/ select * from `{database}`.`{source_table}` where ent_code = '{ent_code}'"
-
-                def chunk_callback(item):
-                    # 替换bit类型的 b'\x00' 值为0
-                    item = item.map(lambda x: x[0] if type(x) is bytes else x)
-                    return item
-
-                self.source.from_sql_to_csv(count_sql, query_sql, database=database, csv_file=csv_file,
-                                            chunk_callback=chunk_callback)
+        source_tables = self._prepare_export_database(database)
+        for source_table in source_tables:
+            self._export_database_table(database, source_table, ent_code)
 
     def export_parallel(self, ent_code):
         """
-        导出源库指定数据库列表的所有表,并行执行
+        导出源库指定数据库列表的所有表, 所有库的表提交到同一个线程池并行执行
         :param ent_code:
-        :return:
+        :return: 失败的表列表 [(database, table, 错误信息)]
         """
+        # 先完成每个库的准备工作
+        db_map = {}
+        failures = []
+        for index, database in enumerate(self.databases):
+            logger.info(f'【导出库 {database} {index + 1}/{len(self.databases)}】。。。')
+            try:
+                db_map[database] = self._prepare_export_database(database)
+            except BaseException as e:
+                logger.error(f"【导出失败】【{database}】{repr(e)}")
+                failures.append((database, None, repr(e)))
+
+        export_bar = tqdm(total=sum(len(tables) for tables in db_map.values()),
+                          desc=f'实例【{self.get_name()}】的表导出进度')
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
-            futures = []
-            for index, db in enumerate(self.databases):
-
-                # 导出入口方法
-                def export_database(database):
-                    try:
-                        logger.info(f'【导出库 {database} {index + 1}/{len(self.databases)}】。。。')
-                        self._export_database(database, ent_code)
-                    except BaseException as e:
-                        logger.error(f"【导出失败】{repr(e)}")
-
-                # 并发执行
-                future = pool.submit(export_database, db)
-                futures.append(future)
+            futures = {pool.submit(self._export_database_table, database, table, ent_code): (database, table)
+                       for database, tables in db_map.items() for table in tables}
             for future in as_completed(futures):  # 并发执行
-                logger.info(f'【导出成功 {db} {index + 1}/{len(self.databases)}】')
+                database, table = futures[future]
+                try:
+                    future.result()
+                except BaseException as e:
+                    logger.error(f"\r\t【导出失败】【{database}.{table}】{repr(e)}")
+                    failures.append((database, table, repr(e)))
+                export_bar.update(1)
+
+        get_memory_governor().report(desc=f'实例【{self.get_name()}】导出')
+
+        if failures:
+            logger.error(f'【实例 {self.get_name()} 导出失败 {len(failures)} 个】')
+            for database, table, error in failures:
+                logger.error(f'    {database}.{table or "*"}: {error}')
+        else:
+            logger.info(f'【导出成功 {self.get_name()}】')
+        return failures
@@ -3,10 +3,12 @@ import os
 from concurrent.futures import as_completed
 
 from pymysql import DatabaseError, MySQLError
-from tqdm import tqdm
 
-from base._sink import Mysql
-from base._utils import logger
+from base._index import IndexRestorer
+from base._memory import get_memory_governor
+from base._profile import profiled
+from base._sink import Mysql, Csv
+from base._utils import logger, tqdm
 from base._interface import ImportInterface
 
 
@@ -15,22 +17,42 @@ class BaseImport(ImportInterface):
     导入基类
     """
 
-    def __init__(self, source: Mysql, target: Mysql, databases: list, dumps_folder: str, max_workers=8):
+    def __init__(self, source: Mysql, target: Mysql, databases: list, dumps_folder: str, max_workers=8,
+                 index_workers=2):
         self.source = source
         self.target = target
         self.databases = databases
         self.dumps_folder = dumps_folder
         self.max_workers = max_workers
+        # 索引延迟到数据导入完成后，由独立线程池重建
+        self.index_restorer = IndexRestorer(target, max_workers=index_workers)
 
     def get_columns_dtype(self, database, table):
         """
-        返回csv读取时指定的dtype
+        返回csv读取时指定的dtype, 会覆盖根据目标表字段自动生成的类型
         :param database: 数据库
         :param table: 表名
         :return: 返回dtype类型对象  指定类型 例如： {'a': np.int16, 'b': np.float64}
         """
         return None
 
+    def get_csv_read_types(self, database, table):
+        """
+        读取csv时的字段类型，根据目标表字段元数据自动生成，get_columns_dtype 返回的类型优先
+        :param database: 数据库
+        :param table: 表名
+        :return: (dtype, parse_dates)
+        """
+        user_dtype = self.get_columns_dtype(database, table)
+        # 指定了整体类型(非字段字典)时不再自动推断
+        if user_dtype is not None and not isinstance(user_dtype, dict):
+            return user_dtype, None
+        dtype, parse_dates = self.target.get_table_csv_dtype(database, table)
+        if user_dtype:
+            dtype.update(user_dtype)
+            parse_dates = [column for column in parse_dates if column not in user_dtype]
+        return dtype, parse_dates
+
     def __create_database_if_not_exists(self, database):
         """
         自动判断是否创建目标库
@@ -60,82 +82,106 @@ class BaseImport(ImportInterface):
         except BaseException as e:
             raise MySQLError(f'create table error: 【{database}.{table}】 {repr(e)}')
 
-    def _import_database(self, database, is_truncate_data=False):
+    def _prepare_import_database(self, database) -> list[str]:
         """
-        导入指定的数据库
+        导入数据库前的准备工作: 创建目标数据库
         :param database: 数据库
-        :return:
+        :return: 源数据库表列表
         """
-
         # 创建目标数据库，如果不存在
         self.__create_database_if_not_exists(database)
-
-        # csv所在目录
-        database_folder = os.path.join(self.dumps_folder, database)
         # 源数据库表列表
-        source_tables = self.source.list_tables(database=database)
+        return self.source.list_tables(database=database)
 
-        table_bar = tqdm(total=len(source_tables), desc=f'数据库【{database}】的表处理进度')
-        for index, table in enumerate(source_tables):
-            try:
-                # 调试模式，单独只导入某一个表
-                debug_table = self.single_table_for_debug()
-                if debug_table and table != debug_table:
-                    continue
-
-                # 如果表不存在，则创建
-                self.__create_table_if_not_exists(database, table)
-
-                # 导入csv
-                filename = os.path.join(database_folder, f'{table}.csv')
-                if os.path.exists(filename):
-
-                    index_alert_sqls = self.target.get_table_index_alert_sqls(database, table)
-                    # 导入前删除索引
-                    index_drop_sqls = self.target.get_table_index_drop_sql(database, table)
-                    if index_drop_sqls:
-                        for index_drop in index_drop_sqls:
-                            self.target.execute_update(index_drop, database=database)
-
-                    # 开始导入
-                    csv_file = os.path.join(database_folder, filename)
-                    self.target.from_csv_to_table(csv_file, database, table, is_truncate_data,
-                                                  chunk_wrapper=self.chunk_wrapper,
-                                                  dtype=self.get_columns_dtype(database, table))
-
-                    # 导入后恢复索引
-                    if index_alert_sqls:
-                        for index_alert in index_alert_sqls:
-                            self.target.execute_update(index_alert, database)
-
-                    logger.info(f'【{database}.{table}】导入成功, 剩余 {index + 1}/{len(source_tables)}')
-                else:
-                    logger.warning(f'【{database}.{table}】无需处理, 剩余 {index + 1}/{len(source_tables)}')
-            except BaseException as e:
-                logger.error(f'_import_database error: {repr(e)}')
-            table_bar.update(1)
-        pass
+    @profiled
+    def _import_database_table(self, database, table, is_truncate_data=False):
+        """
+        导入指定的表
+        :param database: 数据库
+        :param table: 表名
+        :param is_truncate_data: 是否清空目标表数据
+        :return: True: 已导入 False: 无需处理
+        """
+        # 调试模式，单独只导入某一个表
+        debug_table = self.single_table_for_debug()
+        if debug_table and table != debug_table:
+            return False
 
-    def import_parallel(self, is_truncate_data=False):
+        # 如果表不存在，则创建
+        self.__create_table_if_not_exists(database, table)
+
+        # 导入csv
+        csv_file = os.path.join(self.dumps_folder, database, f'{table}.csv')
+        if not os.path.exists(csv_file):
+            logger.warning(f'【{database}.{table}】无需处理')
+            return False
+
+        # 按写入量与目标表数据量决定是否删除索引
+        index_alert_sqls = self.index_restorer.prepare(database, table, Csv().estimate_csv_rows(csv_file),
+                                                       0 if is_truncate_data else None)
+
+        try:
+            # 开始导入
+            dtype, parse_dates = self.get_csv_read_types(database, table)
+            self.target.from_csv_to_table(csv_file, database, table, is_truncate_data,
+                                          chunk_wrapper=self.chunk_wrapper,
+                                          dtype=dtype, parse_dates=parse_dates)
+        finally:
+            # 登记索引恢复，待所有表导入完成后统一重建
+            self.index_restorer.add(database, table, index_alert_sqls)
+        logger.info(f'【{database}.{table}】导入成功')
+        return True
+
+    def _import_database(self, database, is_truncate_data=False):
         """
-        并发批量导入
+        串行导入指定数据库的所有表, 导入完成后重建延迟的索引
+        :param database: 数据库
+        :param is_truncate_data: 是否清空目标表数据
         :return:
         """
-        import_bar = tqdm(total=len(self.databases), desc=f'实例【{self.get_name()}】的数据库处理进度')
+        source_tables = self._prepare_import_database(database)
+        try:
+            for table in source_tables:
+                self._import_database_table(database, table, is_truncate_data=is_truncate_data)
+        finally:
+            self.index_restorer.restore_parallel(desc=f'数据库【{database}】的索引重建进度')
+
+    def import_parallel(self, is_truncate_data=False):
+        """
+        并发批量导入, 所有库的表提交到同一个线程池
+        :return: 失败的表列表 [(database, table, 错误信息)]
+        """
+        # 先完成每个库的准备工作
+        db_map = {}
+        failures = []
+        for database in self.databases:
+            try:
+                db_map[database] = self._prepare_import_database(database)
+            except BaseException as e:
+                logger.error(f'【{database}】【导入失败】: {repr(e)}')
+                failures.append((database, None, repr(e)))
+
+        import_bar = tqdm(total=sum(len(tables) for tables in db_map.values()),
+                          desc=f'实例【{self.get_name()}】的表处理进度')
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
-            futures = []
-            for db in self.databases:
-
-                # 并发执行的导入方法
-                def import_database(database):
-                    try:
-                        # 开始导入
-                        self._import_database(database, is_truncate_data=is_truncate_data)
-                    except BaseException as e:
-                        logger.error(f'【{database}】【导入失败】: {repr(e)}')
-
-                # 提交并发执行
-                future = pool.submit(import_database, db)
-                futures.append(future)
-            for future in as_completed(futures):  # 并发执行
+            futures = {pool.submit(self._import_database_table, database, table, is_truncate_data): (database, table)
+                       for database, tables in db_map.items() for table in tables}
+            for future in as_completed(futures):
+                database, table = futures[future]
+                try:
+                    future.result()
+                except BaseException as e:
+                    logger.error(f'\r\t【{database}.{table} 导入失败】{repr(e)}')
+                    failures.append((database, table, repr(e)))
                 import_bar.update(1)
+
+        # 数据导入完成后，统一重建索引
+        self.index_restorer.restore_parallel(desc=f'实例【{self.get_name()}】的索引重建进度')
+
+        get_memory_governor().report(desc=f'实例【{self.get_name()}】导入')
+
+        if failures:
+            logger.error(f'【实例 {self.get_name()} 导入失败 {len(failures)} 个】')
+            for database, table, error in failures:
+                logger.error(f'    {database}.{table or "*"}: {error}')
+        return failures
@@ -0,0 +1,178 @@
+import concurrent
+import time
+from concurrent.futures import as_completed
+from threading import Lock
+
+from base._sink import Mysql
+from base._utils import logger, tqdm, get_config
+
+
+def should_rebuild_indexes(incoming_rows, target_rows, index_count, insert_penalty=None) -> bool:
+    """
+    比较两种方式维护二级索引的代价，判断写入前是否删除索引、写入后重建
+    保留索引: 每写入一行逐个更新索引(随机写)，代价约 写入行数 * 索引数 * insert_penalty
+    删除重建: 重建时对全表排序写入索引，代价约 (目标表已有行数 + 写入行数) * 索引数
+    :param incoming_rows: 预估写入的行数
+    :param target_rows: 目标表已有的行数
+    :param index_count: 二级索引数量
+    :param insert_penalty: 逐行维护索引相对于重建的代价倍数, 默认读取 config.ini 中 [index] insert_penalty，默认5
+    :return: True: 删除后重建  False: 保留索引直接写入
+    """
+    if index_count <= 0:
+        return False
+    if insert_penalty is None:
+        insert_penalty = get_config().getfloat('index', 'insert_penalty', fallback=5)
+    keep_cost = incoming_rows * index_count * insert_penalty
+    rebuild_cost = (target_rows + incoming_rows) * index_count
+    return rebuild_cost < keep_cost
+
+
+class IndexRestorer:
+    """
+    延迟索引重建器
+    数据阶段只收集各表的索引恢复语句，数据全部写入后，由独立的有界线程池统一重建，
+    避免索引重建占用数据写入线程
+    """
+
+    def __init__(self, target: Mysql, max_workers=2):
+        """
+        :param target: 目标库
+        :param max_workers: 同时重建索引的表数量上限，避免目标库负载过高
+        """
+        self.target = target
+        self.max_workers = max_workers
+        self._tasks = []
+        self._lock = Lock()
+        # 删除索引前的回调 function(database, table, index_alert_sqls), 分布式同步在删除前持久化恢复语句，回调出错时不删除
+        self.drop_listener = None
+
+    def add(self, database, table, index_alert_sqls):
+        """
+        登记表的索引恢复语句，等待统一重建
+        :param database: 数据库
+        :param table: 表名
+        :param index_alert_sqls: 索引恢复语句列表
+        :return:
+        """
+        if not index_alert_sqls:
+            return
+        with self._lock:
+            # 同一个表多次登记时合并，相同的语句只执行一次
+            for task_database, task_table, task_sqls in self._tasks:
+                if task_database == database and task_table == table:
+                    task_sqls.extend(sql for sql in index_alert_sqls if sql not in task_sqls)
+                    return
+            self._tasks.append((database, table, list(index_alert_sqls)))
+
+    def discard(self, database, table) -> list[str]:
+        """
+        取消表已登记的索引恢复(比如分布式任务已被其他进程接手，由接手的进程恢复)
+        :param database: 数据库
+        :param table: 表名
+        :return: 取消的索引恢复语句
+        """
+        with self._lock:
+            for task in self._tasks:
+                if task[0] == database and task[1] == table:
+                    self._tasks.remove(task)
+                    return task[2]
+        return []
+
+    def prepare(self, database, table, incoming_rows=None, target_rows=None) -> list[str]:
+        """
+        写入数据前按代价决定是否删除目标表的二级索引
+        小批量写入到已有大量数据的表时保留索引，大批量写入或者目标表为空时删除索引，写入完成后重建
+        :param database: 目标数据库
+        :param table: 目标表
+        :param incoming_rows: 预估写入的行数, None时总是删除索引
+        :param target_rows: 目标表写入前的行数, 默认按表统计信息预估(写入前会清空目标表时传0)
+        :return: 需要在写入完成后执行的索引恢复语句, 保留索引时为空列表
+        """
+        index_drop_sqls = self.target.get_table_index_drop_sql(database, table)
+        if not index_drop_sqls:
+            return []
+        if incoming_rows is not None:
+            if target_rows is None:
+                target_rows = self.target.get_table_rows_estimate(database, table)
+            rebuild = should_rebuild_indexes(incoming_rows, target_rows, len(index_drop_sqls))
+            logger.info(f'\r\t【{database}.{table}】预估写入 {incoming_rows} 条, 目标表已有约 {target_rows} 条, '
+                        f'{len(index_drop_sqls)} 个索引: {"删除索引, 写入后重建" if rebuild else "保留索引"}')
+            if not rebuild:
+                return []
+        # 记录索引
+        index_alert_sqls = self.target.get_table_index_alert_sqls(database, table)
+        if self.drop_listener:
+            self.drop_listener(database, table, index_alert_sqls)
+        # 导入前删除索引
+        for index_drop in index_drop_sqls:
+            self.target.execute_update(index_drop, database=database)
+        return index_alert_sqls
+
+    def pending_count(self):
+        """
+        待重建索引的表数量
+        """
+        with self._lock:
+            return len(self._tasks)
+
+    def _restore_table(self, database, table, index_alert_sqls):
+        """
+        重建单个表的索引
+        :return: (耗时秒数, 错误列表)
+        """
+        s_time = time.time()
+        errors = []
+        for index_alert in index_alert_sqls:
+            try:
+                self.target.execute_update(index_alert, database)
+            except BaseException as e:
+                errors.append(repr(e))
+        return time.time() - s_time, errors
+
+    def restore_table(self, database, table) -> list[str]:
+        """
+        立即重建单个表已登记的索引(比如分布式任务在标记完成前重建)
+        :param database: 数据库
+        :param table: 表名
+        :return: 错误列表
+        """
+        index_alert_sqls = self.discard(database, table)
+        if not index_alert_sqls:
+            return []
+        cost, errors = self._restore_table(database, table, index_alert_sqls)
+        for error in errors:
+            logger.error(f'\r\t【{database}.{table} 索引重建失败】{error}')
+        logger.info(f'\r\t【{database}.{table}】索引重建耗时 {cost:.2f}秒')
+        return errors
+
+    def restore_parallel(self, desc=None) -> dict:
+        """
+        按表数据量从大到小的顺序，并行重建所有已登记的索引
+        :param desc: 进度条描述
+        :return: 每个表的重建耗时 {(database, table): 秒}
+        """
+        with self._lock:
+            tasks, self._tasks = self._tasks, []
+        if not tasks:
+            return {}
+
+        # 大表先建，避免最后只剩一个大表在跑
+        sizes = self.target.get_tables_size(list(set(task[0] for task in tasks)))
+        tasks.sort(key=lambda task: sizes.get((task[0], task[1]), 0), reverse=True)
+
+        costs = {}
+        index_bar = tqdm(total=len(tasks), desc=desc or '索引重建进度')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._restore_table, *task): task for task in tasks}
+            for future in as_completed(futures):
+                database, table, index_alert_sqls = futures[future]
+                cost, errors = future.result()
+                costs[(database, table)] = cost
+                for error in errors:
+                    logger.error(f'\r\t【{database}.{table} 索引重建失败】{error}')
+                index_bar.update(1)
+
+        logger.info(f'【索引重建完成】共 {len(costs)} 个表，各表耗时:')
+        for (database, table), cost in sorted(costs.items(), key=lambda x: x[1], reverse=True):
+            logger.info(f'    {database}.{table}: {cost:.2f}秒')
+        return costs
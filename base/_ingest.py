@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import concurrent
+import io
+import mmap
+import os
+from concurrent.futures import as_completed
+from typing import Callable, TYPE_CHECKING
+
+from base._memory import get_memory_governor, get_dataframe_bytes
+from base._retry import retry_call
+from base._utils import logger, lazy_import, tqdm, get_dtype_backend, dtype_backend_kwargs, to_backend_dtype, \
+    compact_dataframe
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+    from base._sink import Mysql
+
+pd = lazy_import('pandas')
+
+
+class ParallelCsvIngest:
+    """
+    单个大csv文件并行导入
+    内存映射文件，按记录边界(识别引号内的换行)切分成多个字节区间，多线程并行解析，
+    每个线程使用独立的连接写入同一个表
+    """
+
+    def __init__(self, mysql: Mysql, workers=4, block_size=64 * 1024 * 1024, chunksize=10000):
+        """
+        :param mysql: 目标库
+        :param workers: 并行解析及写入的线程数(即写入连接数)
+        :param block_size: 每个字节区间的大约大小
+        :param chunksize: 每批写入数量
+        """
+        self.mysql = mysql
+        self.workers = workers
+        self.block_size = block_size
+        self.chunksize = chunksize
+
+    @staticmethod
+    def _find_record_end(mm, pos, quotes=0):
+        """
+        从pos开始查找引号外的第一个换行符，返回下一条记录的起始位置
+        :param mm: 文件内容
+        :param pos: 查找起始位置
+        :param quotes: 上一个记录边界到pos之间的引号数量
+        :return: 下一条记录的起始位置, 到文件末尾返回文件长度
+        """
+        size = len(mm)
+        while pos < size:
+            newline = mm.find(b'\n', pos)
+            if newline < 0:
+                return size
+            # 转义的引号是成对出现的("")，所以引号数量为偶数时换行符在引号外
+            quotes += mm[pos:newline].count(b'"')
+            if quotes % 2 == 0:
+                return newline + 1
+            pos = newline + 1
+        return size
+
+    def split_ranges(self, mm) -> tuple[list[str], list[tuple[int, int]]]:
+        """
+        按记录边界切分文件
+        :param mm: 文件内容
+        :return: (表头字段列表, [(起始位置, 结束位置)])
+        """
+        header_end = self._find_record_end(mm, 0)
+        columns = list(pd.read_csv(io.BytesIO(mm[:header_end]), nrows=0).columns)
+        ranges = []
+        start = header_end
+        size = len(mm)
+        while start < size:
+            target = min(start + self.block_size, size)
+            # 区间起点一定在引号外，统计到切分目标位置的引号数量
+            quotes = 0
+            for window in range(start, target, 8 * 1024 * 1024):
+                quotes += mm[window:min(window + 8 * 1024 * 1024, target)].count(b'"')
+            end = self._find_record_end(mm, target, quotes) if target < size else size
+            ranges.append((start, end))
+            start = end
+        return columns, ranges
+
+    def _parse_range(self, mm, start, end, columns, dtype=None, parse_dates=None) -> DataFrame:
+        """
+        解析一个字节区间为DataFrame, 优先使用pyarrow多线程解析
+        """
+        data = mm[start:end]
+        try:
+            import pyarrow
+            from pyarrow import csv as pyarrow_csv
+        except ImportError:
+            date_format = 'ISO8601' if parse_dates else None
+            df = pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=to_backend_dtype(dtype),
+                             low_memory=False, parse_dates=parse_dates, date_format=date_format,
+                             **dtype_backend_kwargs())
+            return compact_dataframe(df)
+
+        read_options = pyarrow_csv.ReadOptions(column_names=columns, use_threads=True)
+        # 字符串字段不能让pyarrow推断成数字，否则会丢失前导0
+        string_columns = {column: pyarrow.string() for column, value in (dtype or {}).items()
+                          if value == 'string'} if isinstance(dtype, dict) else {}
+        convert_options = pyarrow_csv.ConvertOptions(strings_can_be_null=True, column_types=string_columns)
+        # 引号内可以有换行，否则超过pyarrow读取块大小的区间会在引号内被切开
+        parse_options = pyarrow_csv.ParseOptions(newlines_in_values=True)
+        arrow_table = pyarrow_csv.read_csv(pyarrow.py_buffer(data), read_options=read_options,
+                                           parse_options=parse_options, convert_options=convert_options)
+        # pyarrow类型后端时直接使用arrow内存，不转换为numpy/object
+        if get_dtype_backend() == 'pyarrow':
+            df = arrow_table.to_pandas(types_mapper=pd.ArrowDtype)
+        else:
+            df = arrow_table.to_pandas()
+        dtype = to_backend_dtype(dtype)
+        if isinstance(dtype, dict):
+            df = df.astype({column: value for column, value in dtype.items() if column in df.columns})
+        elif dtype is not None:
+            df = df.astype(dtype)
+        for column in parse_dates or []:
+            if column in df.columns and pd.api.types.is_string_dtype(df[column].dtype):
+                try:
+                    df[column] = pd.to_datetime(df[column], format='ISO8601')
+                except (ValueError, TypeError):
+                    # 无法解析的日期(例如 0000-00-00)保留原始字符串
+                    pass
+        return compact_dataframe(df)
+
+    def ingest(self, csv_file, database, table, chunk_wrapper: Callable = None, dtype=None, parse_dates=None) -> int:
+        """
+        并行导入csv文件到数据表
+        :param csv_file: csv文件
+        :param database: 数据库名
+        :param table: 表名
+        :param chunk_wrapper: df对象包装过滤器 function(df, database, table) -> df
+        :param dtype: 指定类型
+        :param parse_dates: 需要解析为日期时间的字段列表
+        :return: 写入的行数
+        """
+        if os.path.getsize(csv_file) == 0:
+            return 0
+        with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            columns, ranges = self.split_ranges(mm)
+            logger.info(f'【{database}.{table}】csv切分为 {len(ranges)} 个区间并行导入')
+
+            governor = get_memory_governor()
+
+            def ingest_range(start, end):
+                # 解析前按字节区间的数倍申请内存预算
+                held = (end - start) * 3
+                governor.acquire(held)
+                try:
+                    df = self._parse_range(mm, start, end, columns, dtype=dtype, parse_dates=parse_dates)
+                    actual = get_dataframe_bytes(df)
+                    governor.reserve(actual)
+                    governor.release(held)
+                    held = actual
+                    rows = 0
+                    for offset in range(0, len(df), self.chunksize):
+                        chunk = df.iloc[offset:offset + self.chunksize]
+                        if chunk_wrapper:
+                            chunk = chunk_wrapper(chunk.copy(), database, table)
+                        if len(chunk) > 0:
+                            retry_call(chunk.to_sql, table, schema=database, con=self.mysql.get_engine(),
+                                       if_exists='append', index=False, desc=f'{database}.{table} 写入')
+                            rows += len(chunk)
+                    return rows
+                finally:
+                    governor.release(held)
+
+            total = 0
+            range_bar = tqdm(total=len(ranges), desc=f'【{database}.{table}】并行导入进度')
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(ingest_range, start, end) for start, end in ranges]
+                for future in as_completed(futures):
+                    total += future.result()
+                    range_bar.update(1)
+            return total
@@ -60,3 +60,35 @@ class ImportInterface(Interface):
         :return: pandas DataFrame 对象
         """
         return df
+
+    def column_overrides(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 中字段覆盖规则的sql表达式描述，用于在服务端直接完成转换(数据不经过pandas)
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: dict {字段名: sql表达式} 例如 {'id': 'NULL', 'name': "CONCAT('uat.', `name`)"}
+        常量表达式会直接下推到读取源表的查询中，chunk_wrapper 不应再依赖这些字段的原始值
+        """
+        return {}
+
+    def row_predicate(self, database, table, is_sync=False):
+        """
+        读取源表时的行过滤条件，同步和导出时直接追加到源查询的WHERE中，不满足条件的数据不会被读取
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: sql条件 例如 "TRIM(`name`) <> ''"，不过滤时返回None
+        """
+        return None
+
+    def is_sql_expressible(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 对当前表的处理是否可以完全由 column_overrides 描述
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: True: 可以在服务端用sql完成转换  False: 必须经过 chunk_wrapper 处理
+        """
+        # 没有重写 chunk_wrapper 时不存在任何转换
+        return type(self).chunk_wrapper is ImportInterface.chunk_wrapper
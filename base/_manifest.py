@@ -0,0 +1,73 @@
+import json
+import os
+from threading import Lock
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class ExportManifest:
+    """
+    导出清单, 记录数据库目录下每个表导出时的数据指纹
+    下次导出时指纹一致的表直接复用已有的csv
+    """
+
+    def __init__(self, database_folder):
+        """
+        :param database_folder: 数据库的导出目录
+        """
+        self.manifest_file = os.path.join(database_folder, MANIFEST_FILE)
+        self._lock = Lock()
+        self._tables = {}
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    self._tables = json.load(f)
+            except (ValueError, OSError):
+                # 清单损坏时视为没有缓存
+                self._tables = {}
+
+    def get(self, table):
+        """
+        获取表的指纹
+        :param table: 表名
+        :return: dict 或 None
+        """
+        with self._lock:
+            return self._tables.get(table)
+
+    def tables(self) -> list[str]:
+        """
+        清单中记录的表
+        """
+        with self._lock:
+            return list(self._tables.keys())
+
+    def set(self, table, fingerprint):
+        """
+        记录表的指纹并保存
+        :param table: 表名
+        :param fingerprint: 指纹
+        :return:
+        """
+        with self._lock:
+            self._tables[table] = fingerprint
+            self._save()
+
+    def invalidate(self, table):
+        """
+        使表的缓存失效, 导出开始前调用，中途失败时不会误用不完整的csv
+        :param table: 表名
+        :return:
+        """
+        with self._lock:
+            if self._tables.pop(table, None) is not None:
+                self._save()
+
+    def _save(self):
+        """
+        先写临时文件再替换，避免中断时清单不完整
+        """
+        tmp_file = f'{self.manifest_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._tables, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
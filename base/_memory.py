@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from threading import Condition, Lock
+from typing import Iterator, TYPE_CHECKING
+
+from base._profile import timer
+from base._utils import logger, get_config
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+def get_dataframe_bytes(df: DataFrame) -> int:
+    """
+    DataFrame实际占用的内存字节数
+    """
+    return int(df.memory_usage(deep=True).sum())
+
+
+class MemoryGovernor:
+    """
+    进程级内存预算
+    读取数据块前先申请预估的内存，写入完成后释放，预算不足时阻塞读取，避免多个线程同时读取大数据块导致内存溢出
+    """
+
+    def __init__(self, budget: int):
+        """
+        :param budget: 预算字节数
+        """
+        self.budget = budget
+        self.used = 0
+        self.peak = 0
+        self._condition = Condition(Lock())
+
+    def available(self) -> int:
+        """
+        剩余可用的预算
+        """
+        with self._condition:
+            return max(0, self.budget - self.used)
+
+    def acquire(self, nbytes: int):
+        """
+        申请内存, 预算不足时阻塞等待其他数据块释放
+        单个数据块超过预算时，等到没有其他占用后再放行，避免永久阻塞
+        :param nbytes: 字节数
+        :return:
+        """
+        with self._condition:
+            while self.used > 0 and self.used + nbytes > self.budget:
+                self._condition.wait()
+            self._add(nbytes)
+
+    def reserve(self, nbytes: int):
+        """
+        不阻塞地登记内存占用, 用于已经在内存中的数据(比如写入队列中的数据块)
+        :param nbytes: 字节数
+        :return:
+        """
+        with self._condition:
+            self._add(nbytes)
+
+    def release(self, nbytes: int):
+        """
+        释放内存
+        :param nbytes: 字节数
+        :return:
+        """
+        with self._condition:
+            self.used = max(0, self.used - nbytes)
+            self._condition.notify_all()
+
+    def _add(self, nbytes):
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def govern(self, chunks: Iterator[DataFrame], estimate=0) -> Iterator[DataFrame]:
+        """
+        包装数据块迭代器: 读取下一块前按上一块的大小申请内存，处理方取下一块时释放上一块
+        :param chunks: 数据块迭代器
+        :param estimate: 第一块的预估字节数
+        :return:
+        """
+        iterator = iter(chunks)
+        while True:
+            self.acquire(estimate)
+            held = estimate
+            try:
+                with timer('read'):
+                    chunk = next(iterator)
+            except StopIteration:
+                self.release(held)
+                return
+            except BaseException:
+                self.release(held)
+                raise
+            actual = get_dataframe_bytes(chunk)
+            # 按实际大小修正占用
+            if actual > held:
+                self.reserve(actual - held)
+            else:
+                self.release(held - actual)
+            held = estimate = actual
+            try:
+                yield chunk
+            finally:
+                self.release(held)
+
+    def fit_rows(self, chunksize, row_bytes, min_rows=1000) -> int:
+        """
+        按剩余预算缩小每批读取的行数
+        :param chunksize: 期望的行数
+        :param row_bytes: 每行预估字节数
+        :param min_rows: 最少行数
+        :return: 行数
+        """
+        if row_bytes <= 0:
+            return chunksize
+        return max(min(min_rows, chunksize), min(chunksize, self.available() // row_bytes))
+
+    def report(self, desc=None):
+        """
+        输出内存峰值与预算
+        """
+        logger.info(f'【{desc or "内存"}】数据块内存峰值 {self.peak / 1024 / 1024:.1f}M / 预算 {self.budget / 1024 / 1024:.0f}M')
+
+
+_governor = None
+_governor_lock = Lock()
+
+
+def get_memory_governor() -> MemoryGovernor:
+    """
+    进程内共享的内存预算, config.ini 中 [memory] budget_mb 配置，默认2048M
+    :return: MemoryGovernor
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            budget_mb = get_config().getint('memory', 'budget_mb', fallback=2048)
+            _governor = MemoryGovernor(budget_mb * 1024 * 1024)
+    return _governor
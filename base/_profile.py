@@ -0,0 +1,201 @@
+import cProfile
+import fnmatch
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+from base._utils import logger, get_config, str2bool
+
+_local = threading.local()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_profile_settings():
+    """
+    读取config.ini中的 [profile] 配置
+    enabled: 是否开启
+    tables: 需要分析的表, 逗号分隔, 支持通配符 例如: rbac_new.*, manufacture.customer
+    sample_rate: 未匹配的表按比例随机抽样分析 0~1
+    cpu: 是否使用cProfile分析cpu
+    memory: 是否使用tracemalloc分析内存
+    output_dir: 输出目录, 每次运行一个子目录
+    :return: dict, 未开启返回None
+    """
+    config = get_config()
+    if not config.has_section('profile') or not str2bool(config.get('profile', 'enabled', fallback='false')):
+        return None
+    tables = config.get('profile', 'tables', fallback='')
+    return {
+        'tables': [pattern.strip() for pattern in tables.split(',') if pattern.strip()],
+        'sample_rate': config.getfloat('profile', 'sample_rate', fallback=0),
+        'cpu': str2bool(config.get('profile', 'cpu', fallback='true')),
+        'memory': str2bool(config.get('profile', 'memory', fallback='false')),
+        'output_dir': os.path.join(config.get('profile', 'output_dir', fallback='profile'),
+                                   time.strftime('%Y%m%d-%H%M%S')),
+    }
+
+
+def is_profiled_table(database, table) -> bool:
+    """
+    当前表是否需要分析
+    """
+    settings = get_profile_settings()
+    if settings is None:
+        return False
+    name = f'{database}.{table}'
+    if any(fnmatch.fnmatch(name, pattern) for pattern in settings['tables']):
+        return True
+    return random.random() < settings['sample_rate']
+
+
+class TableProfile:
+    """
+    单表的性能分析: cProfile、tracemalloc快照、各个DataFrame操作的耗时
+    输出文件: {output_dir}/{实例}/{数据库}.{表}.prof|.cpu.txt|.mem.txt|.timings.txt
+    """
+
+    def __init__(self, instance, database, table, cpu=True, memory=False, output_dir='profile'):
+        self.name = f'{database}.{table}'
+        self.folder = os.path.join(output_dir, instance)
+        self.cpu = cpu
+        self.memory = memory
+        self.timings = defaultdict(lambda: [0, 0.0])
+        self._timings_lock = threading.Lock()
+        self._profiler = None
+        self._snapshot = None
+        self._start_time = None
+
+    def add_timing(self, name, seconds):
+        """
+        记录一次操作的耗时
+        """
+        with self._timings_lock:
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+
+    def start(self):
+        global _tracemalloc_users
+        self._start_time = time.perf_counter()
+        if self.cpu:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:
+                # 同一时间只能有一个profiler时(python3.12+)，跳过cpu分析
+                logger.warning(f'【{self.name}】cpu分析未开启: {repr(e)}')
+                self._profiler = None
+        if self.memory:
+            with _tracemalloc_lock:
+                if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                _tracemalloc_users += 1
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        global _tracemalloc_users
+        total = time.perf_counter() - self._start_time
+        if self._profiler:
+            self._profiler.disable()
+        os.makedirs(self.folder, exist_ok=True)
+        prefix = os.path.join(self.folder, self.name)
+        if self._profiler:
+            self._profiler.dump_stats(f'{prefix}.prof')
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+            with open(f'{prefix}.cpu.txt', 'w', encoding='utf-8') as f:
+                f.write(stream.getvalue())
+        if self._snapshot:
+            # 多个表同时分析时，快照包含其他线程的内存分配
+            stats = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+            with open(f'{prefix}.mem.txt', 'w', encoding='utf-8') as f:
+                for stat in stats[:50]:
+                    f.write(f'{stat}\n')
+            with _tracemalloc_lock:
+                _tracemalloc_users -= 1
+                if _tracemalloc_users == 0:
+                    tracemalloc.stop()
+        with open(f'{prefix}.timings.txt', 'w', encoding='utf-8') as f:
+            f.write(f'total\t1\t{total:.3f}\n')
+            for name, (count, seconds) in sorted(self.timings.items(), key=lambda x: x[1][1], reverse=True):
+                f.write(f'{name}\t{count}\t{seconds:.3f}\n')
+        logger.info(f'【{self.name}】性能分析结果已输出到 {prefix}.*')
+
+
+def current_profile():
+    """
+    当前线程正在进行的单表分析
+    """
+    return getattr(_local, 'profile', None)
+
+
+def activate_profile(profile):
+    """
+    把单表分析关联到当前线程, 用于同一个表的其他线程(比如写入线程)记录耗时
+    """
+    _local.profile = profile
+
+
+@contextmanager
+def profile_table(instance, database, table):
+    """
+    按配置对单表的处理进行性能分析
+    :param instance: 实例名
+    :param database: 数据库
+    :param table: 表
+    :return:
+    """
+    if not is_profiled_table(database, table):
+        yield None
+        return
+    settings = get_profile_settings()
+    profile = TableProfile(instance, database, table, cpu=settings['cpu'], memory=settings['memory'],
+                           output_dir=settings['output_dir'])
+    previous = current_profile()
+    activate_profile(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        activate_profile(previous)
+
+
+def profiled(func):
+    """
+    方法装饰器, 第一、二个参数是数据库和表名的方法按配置进行性能分析
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, database, table, *args, **kwargs):
+        with profile_table(self.get_name(), database, table):
+            return func(self, database, table, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def timer(name):
+    """
+    记录当前线程正在分析的表的某个操作耗时, 没有分析时不做任何处理
+    :param name: 操作名称 例如: read_sql/chunk_wrapper/to_sql
+    :return:
+    """
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    s_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_timing(name, time.perf_counter() - s_time)
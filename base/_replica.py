@@ -0,0 +1,129 @@
+import itertools
+import time
+from threading import Lock
+
+from base._retry import is_connection_error
+from base._sink import Mysql
+from base._utils import logger, get_config
+
+
+def parse_replicas(replicas, default_port='3306') -> list[tuple]:
+    """
+    解析只读实例配置
+    :param replicas: 逗号分隔的 host:port 例如: 10.0.0.2:3306, 10.0.0.3
+    :param default_port: 未指定端口时的默认端口
+    :return: [(host, port)]
+    """
+    if not replicas:
+        return []
+    if isinstance(replicas, str):
+        replicas = [replica.strip() for replica in replicas.split(',') if replica.strip()]
+    result = []
+    for replica in replicas:
+        if isinstance(replica, str):
+            host, _, port = replica.partition(':')
+            replica = (host, port or default_port)
+        result.append(tuple(replica))
+    return result
+
+
+class ReplicatedMysql(Mysql):
+    """
+    带只读实例的mysql源
+    大批量的数据读取分散到只读实例(轮询或者当前连接数最少)，元数据、DDL及其他查询仍然走主实例
+    只读实例延迟超过上限或者无法检测时，读取回退到主实例
+    只读实例的配置在 config.ini 中 [replica]: strategy = round_robin/least_loaded, max_lag = 30(秒, <=0不检测),
+    check_interval = 10(秒, 延迟检测结果的缓存时间)
+    """
+
+    def __init__(self, host: str, port: str, user: str, password: str, replicas=None, strategy=None, max_lag=None):
+        """
+        :param replicas: 只读实例 [(host, port)] 或者逗号分隔的 host:port, 账号密码与主实例相同
+        :param strategy: 只读实例选择策略 round_robin: 轮询  least_loaded: 当前使用连接数最少
+        :param max_lag: 允许的最大复制延迟(秒)
+        """
+        super().__init__(host, port, user, password)
+        config = get_config()
+        self.strategy = strategy or config.get('replica', 'strategy', fallback='round_robin')
+        self.max_lag = max_lag if max_lag is not None else config.getfloat('replica', 'max_lag', fallback=30)
+        self.check_interval = config.getfloat('replica', 'check_interval', fallback=10)
+        self.replicas = [Mysql(replica_host, replica_port, user, password)
+                         for replica_host, replica_port in parse_replicas(replicas, default_port=port)]
+        self._counter = itertools.count()
+        self._lags = {}
+        # 读取失败的只读实例 {id(replica): 失败时间}
+        self._failures = {}
+        self._lock = Lock()
+
+    def get_replica_lag(self, replica: Mysql):
+        """
+        只读实例的复制延迟
+        :param replica: 只读实例
+        :return: 延迟秒数, 没有复制或者复制线程停止时返回None
+        """
+        try:
+            row = replica.execute_query('SHOW REPLICA STATUS').mappings().first()
+            lag_key = 'Seconds_Behind_Source'
+        except BaseException:
+            # mysql 8.0.22 以前的版本
+            row = replica.execute_query('SHOW SLAVE STATUS').mappings().first()
+            lag_key = 'Seconds_Behind_Master'
+        if not row or row.get(lag_key) is None:
+            return None
+        return float(row[lag_key])
+
+    def is_replica_healthy(self, replica: Mysql) -> bool:
+        """
+        只读实例的复制延迟是否在允许范围内, 检测结果缓存 check_interval 秒; 读取失败后 check_interval 秒内不可用
+        """
+        key = id(replica)
+        now = time.monotonic()
+        with self._lock:
+            failed_at = self._failures.get(key)
+            cached = self._lags.get(key)
+        if failed_at is not None and now - failed_at < self.check_interval:
+            return False
+        if self.max_lag <= 0:
+            return True
+        if cached and now - cached[1] < self.check_interval:
+            return cached[0]
+        try:
+            lag = self.get_replica_lag(replica)
+            healthy = lag is not None and lag <= self.max_lag
+            if not healthy:
+                logger.warning(f'【只读实例 {replica.host}:{replica.port}】复制延迟 {lag} 秒，暂不从该实例读取')
+        except BaseException as e:
+            healthy = False
+            logger.warning(f'【只读实例 {replica.host}:{replica.port}】延迟检测失败，暂不从该实例读取: {repr(e)}')
+        with self._lock:
+            self._lags[key] = (healthy, now)
+        return healthy
+
+    def get_read_engine(self):
+        """
+        大批量数据读取使用的engine, 从可用的只读实例中选择, 没有可用的只读实例时使用主实例
+        """
+        replicas = [replica for replica in self.replicas if self.is_replica_healthy(replica)]
+        if not replicas:
+            return self.get_engine()
+        # 轮换起点，连接数相同时也能分散到不同的只读实例
+        start = next(self._counter) % len(replicas)
+        replicas = replicas[start:] + replicas[:start]
+        if self.strategy == 'least_loaded':
+            replica = min(replicas, key=lambda item: item.get_engine().pool.checkedout())
+        else:
+            replica = replicas[0]
+        return replica.get_engine()
+
+    def report_read_failure(self, engine, error):
+        """
+        只读实例连接失败(宕机、连接中断)时标记为不可用, check_interval 秒内不再从该实例读取，重试时选择其他只读实例或者主实例
+        """
+        if not is_connection_error(error):
+            return
+        for replica in self.replicas:
+            if replica.get_engine() is engine:
+                logger.warning(f'【只读实例 {replica.host}:{replica.port}】读取失败，暂不从该实例读取: {repr(error)}')
+                with self._lock:
+                    self._failures[id(replica)] = time.monotonic()
+                return
@@ -0,0 +1,82 @@
+import time
+from typing import Callable
+
+from base._utils import logger, get_config
+
+# 可以重试的mysql错误码
+TRANSIENT_ERROR_CODES = {
+    1040,  # Too many connections
+    1205,  # Lock wait timeout exceeded
+    1213,  # Deadlock found when trying to get lock
+    2003,  # Can't connect to MySQL server
+    2006,  # MySQL server has gone away
+    2013,  # Lost connection to MySQL server during query
+}
+
+# 连接不可用的错误码, 读取时遇到这些错误需要换一个实例
+CONNECTION_ERROR_CODES = {2003, 2006, 2013}
+
+
+def get_error_code(e: BaseException):
+    """
+    获取异常中的mysql错误码, 会展开sqlalchemy包装的原始异常及异常链
+    :param e: 异常
+    :return: 错误码, 不是mysql错误时返回None
+    """
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        # sqlalchemy.exc.DBAPIError 的原始 pymysql 异常
+        orig = getattr(e, 'orig', None)
+        if orig is not None:
+            e = orig
+            continue
+        if e.args and isinstance(e.args[0], int):
+            return e.args[0]
+        e = e.__cause__ or e.__context__
+    return None
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    是否是可以重试的临时错误(死锁、锁等待超时、连接中断等)
+    :param e: 异常
+    :return: True: 可以重试 False: 致命错误
+    """
+    return get_error_code(e) in TRANSIENT_ERROR_CODES
+
+
+def is_connection_error(e: BaseException) -> bool:
+    """
+    是否是连接不可用的错误(无法连接、连接中断)
+    :param e: 异常
+    :return: True: 连接错误
+    """
+    return get_error_code(e) in CONNECTION_ERROR_CODES
+
+
+def retry_call(func: Callable, *args, desc=None, max_retries=None, **kwargs):
+    """
+    执行函数，遇到临时错误时按指数退避重试, 重试时从连接池获取新的连接
+    重试次数及等待时间可以在config.ini中 [retry] max_retries/backoff_seconds/max_backoff_seconds 配置
+    :param func: 执行的函数, 需要保证重试是安全的(比如单个事务内的批量写入)
+    :param desc: 日志描述
+    :param max_retries: 最大重试次数
+    :return: 函数返回值
+    """
+    config = get_config()
+    if max_retries is None:
+        max_retries = config.getint('retry', 'max_retries', fallback=5)
+    backoff = config.getfloat('retry', 'backoff_seconds', fallback=1)
+    max_backoff = config.getfloat('retry', 'max_backoff_seconds', fallback=30)
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            if attempt >= max_retries or not is_transient_error(e):
+                raise
+            wait = min(backoff * 2 ** attempt, max_backoff)
+            attempt += 1
+            logger.warning(f'\r\t【{desc or func.__name__}】第 {attempt}/{max_retries} 次重试, {wait:.1f}秒后执行: {repr(e)}')
+            time.sleep(wait)
@@ -1,27 +1,146 @@
+from __future__ import annotations
+
+import decimal
+import functools
+import hashlib
 import os
 import platform
-from typing import Iterator, Callable, Generator
-
-import pandas as pd
-import sqlalchemy.engine.cursor
-from pandas import DataFrame
-from sqlalchemy import create_engine
-from sqlalchemy import text
-from sqlalchemy.engine import Engine
-from tqdm import tqdm
-
-from base._utils import logger, execute_command
-
-if platform.system() == 'Windows':
-    mysqlpump_file = os.path.join('mysql-client', 'win', 'x64', 'mysqlpump.exe')
-    mysqldump_file = os.path.join('mysql-client', 'win', 'x64', 'mysqldump.exe')
-    mysql_file = os.path.join('mysql-client', 'win', 'x64', 'mysql.exe')
-elif platform.system() == 'Darwin':
-    mysqlpump_file = os.path.join('mysql-client', 'mac', 'arm64', 'mysqlpump')
-    mysqldump_file = os.path.join('mysql-client', 'mac', 'arm64', 'mysqldump')
-    mysql_file = os.path.join('mysql-client', 'mac', 'arm64', 'mysql')
-else:
-    raise BaseException('暂不支持')
+import re
+import shutil
+import tempfile
+from subprocess import Popen, PIPE
+from typing import Iterator, Callable, Generator, TYPE_CHECKING
+
+from base._memory import get_memory_governor, get_dataframe_bytes
+from base._profile import timer
+from base._retry import retry_call
+from base._sqlfile import SqlFileImporter
+from base._utils import logger, get_config, lazy_import, tqdm, dtype_backend_kwargs, \
+    to_backend_dtype, compact_dataframe, replace_bit_bytes
+
+if TYPE_CHECKING:
+    import sqlalchemy.engine.cursor
+    from pandas import DataFrame
+    from sqlalchemy.engine import Engine
+
+pd = lazy_import('pandas')
+sa = lazy_import('sqlalchemy')
+pymysql = lazy_import('pymysql')
+
+# 判断表数据是否变化时优先使用的更新时间字段
+UPDATE_TIME_COLUMNS = ('update_time', 'modify_time', 'gmt_modified', 'updated_at', 'last_update_time')
+
+
+@functools.lru_cache(maxsize=None)
+def get_mysql_client_file(name):
+    """
+    获取mysql客户端命令路径
+    优先使用config.ini中 [global] mysql_client_dir 配置的目录，其次是内置的客户端，linux下从系统PATH查找
+    :param name: 命令名称 mysql/mysqldump/mysqlpump
+    :return: 命令路径
+    """
+    if platform.system() == 'Windows':
+        name = f'{name}.exe'
+    client_dir = get_config().get('global', 'mysql_client_dir', fallback=None)
+    if client_dir:
+        return os.path.join(client_dir, name)
+    if platform.system() == 'Windows':
+        return os.path.join('mysql-client', 'win', 'x64', name)
+    elif platform.system() == 'Darwin':
+        return os.path.join('mysql-client', 'mac', 'arm64', name)
+    else:
+        return shutil.which(name) or name
+
+
+def get_mysqldump_options() -> list[str]:
+    """
+    mysqldump 数据流式同步的参数, 使用MariaDB客户端时可以在config.ini中 [global] mysqldump_options 调整
+    :return: 参数列表
+    """
+    return get_config().get('global', 'mysqldump_options',
+                            fallback='--no-create-info --extended-insert --complete-insert --single-transaction '
+                                     '--skip-triggers --skip-add-locks --compact --hex-blob '
+                                     '--set-gtid-purged=OFF').split()
+
+
+def parse_sql_constant(expression):
+    """
+    解析sql常量表达式为python值
+    :param expression: sql表达式 例如: NULL、'abc'、123
+    :return: (是否是常量, python值)
+    """
+    expression = expression.strip()
+    if expression.upper() == 'NULL':
+        return True, None
+    if re.fullmatch(r"'(?:[^'\\]|'')*'", expression):
+        return True, expression[1:-1].replace("''", "'")
+    if re.fullmatch(r'-?\d+', expression):
+        return True, int(expression)
+    if re.fullmatch(r'-?\d+\.\d+', expression):
+        return True, decimal.Decimal(expression)
+    return False, None
+
+
+def get_pushdown_columns(columns, overrides):
+    """
+    把字段覆盖规则中的常量下推到查询字段，被覆盖的字段不再读取原始值
+    非常量表达式不下推(chunk_wrapper 会再次转换，例如 CONCAT 会重复拼接)
+    :param columns: 表字段列表
+    :param overrides: 字段覆盖规则 {字段名: sql表达式}
+    :return: 查询字段表达式列表，没有可下推的常量时返回None
+    """
+    select_columns = []
+    pushed = False
+    for column in columns:
+        if column in overrides and parse_sql_constant(overrides[column])[0]:
+            select_columns.append(f'{overrides[column].strip()} AS `{column}`')
+            pushed = True
+        else:
+            select_columns.append(f'`{column}`')
+    return select_columns if pushed else None
+
+
+def and_conditions(*conditions):
+    """
+    用 and 连接多个过滤条件，忽略空条件
+    :param conditions: 过滤条件
+    :return: 过滤条件，全部为空时返回None
+    """
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) <= 1:
+        return conditions[0] if conditions else None
+    return ' and '.join(f'({condition})' for condition in conditions)
+
+
+def get_upsert_clause(columns, upsert_keys):
+    """
+    INSERT 语句的 ON DUPLICATE KEY UPDATE 子句, 与已有行重复时用写入的值更新其他字段
+    :param columns: 写入字段列表
+    :param upsert_keys: 重复时不更新的字段(业务键及主键)
+    :return: 例如: ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)
+    """
+    update_columns = [column for column in columns if column not in upsert_keys]
+    if not update_columns:
+        # 所有字段都是键时，重复行保持不变
+        update_columns = [next(column for column in columns if column in upsert_keys)]
+    return 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'`{column}` = VALUES(`{column}`)' for column in update_columns)
+
+
+def get_upsert_method(upsert_keys) -> Callable:
+    """
+    DataFrame.to_sql 的 method 参数, 使用 INSERT ... ON DUPLICATE KEY UPDATE 写入
+    :param upsert_keys: 重复时不更新的字段(业务键及主键)
+    :return:
+    """
+
+    def upsert(table, conn, keys, data_iter):
+        name = f'`{table.schema}`.`{table.name}`' if table.schema else f'`{table.name}`'
+        insert_sql = (f"INSERT INTO {name} ({', '.join(f'`{key}`' for key in keys)}) "
+                      f"VALUES ({', '.join(['%s'] * len(keys))}) {get_upsert_clause(keys, upsert_keys)}")
+        # pymysql 会把多行合并为 INSERT ... VALUES (...), (...) ON DUPLICATE KEY UPDATE 批量写入
+        return conn.exec_driver_sql(insert_sql, [tuple(row) for row in data_iter]).rowcount
+
+    return upsert
 
 
 class Csv:
@@ -40,17 +159,48 @@ class Csv:
         dataframe = pd.read_csv(filepath_or_buffer=csv_file, dtype=dtype)
         return dataframe
 
-    def get_chunks_from_csv(self, csv_file, chunksize=10000, dtype=None) -> Generator:
+    def get_chunks_from_csv(self, csv_file, chunksize=10000, dtype=None, parse_dates=None) -> Generator:
         """
         从csv读取数据到pandas
         :param csv_file: csv文件
         :param chunksize: 每批次读取数量
+        :param dtype: 指定类型 例如： {'a': 'Int64', 'b': 'string'}
+        :param parse_dates: 需要解析为日期时间的字段列表
         :return:
         """
         if not os.path.isfile(csv_file):
             raise FileExistsError(f'{csv_file}文件不存在')
-        chunks = pd.read_csv(filepath_or_buffer=csv_file, chunksize=chunksize, low_memory=False, dtype=dtype)
-        return chunks
+        # 导出的日期时间都是ISO格式(可能带微秒)，指定格式避免逐行推断
+        date_format = 'ISO8601' if parse_dates else None
+        chunks = pd.read_csv(filepath_or_buffer=csv_file, chunksize=chunksize, low_memory=False,
+                             dtype=to_backend_dtype(dtype), parse_dates=parse_dates, date_format=date_format,
+                             **dtype_backend_kwargs())
+        return map(compact_dataframe, chunks)
+
+    def estimate_csv_rows(self, csv_file) -> int:
+        """
+        按换行符数量预估csv的数据行数(字段值中包含换行时会偏大)
+        :param csv_file: csv文件
+        :return: 行数
+        """
+        lines = 0
+        with open(csv_file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                lines += block.count(b'\n')
+        # 去掉表头
+        return max(0, lines - 1)
+
+    def append_dataframe_to_csv(self, df: DataFrame, csv_file):
+        """
+        追加DataFrame到csv文件, 文件不存在时先写入表头
+        :param df: DataFrame
+        :param csv_file: csv文件
+        :return:
+        """
+        if os.path.exists(csv_file):
+            df.to_csv(csv_file, mode='a', index=False, header=False, encoding='utf-8')
+        else:
+            df.to_csv(csv_file, index=False, encoding='utf-8')
 
 
 class Mysql:
@@ -65,7 +215,10 @@ class Mysql:
         self.user = user
         self.password = password
         url = f'mysql+pymysql://{self.user}:{self.password}@{self.host}:{self.port}/mysql'
-        self.engine = create_engine(url, echo_pool=True, pool_size=20)
+        # 取出连接时先检测，重试时不会拿到已断开的连接
+        self.engine = sa.create_engine(url, echo_pool=True, pool_size=20, pool_pre_ping=True)
+        # mysql服务实例的唯一标识
+        self._server_id = None
 
     def get_engine(self) -> Engine:
         """
@@ -75,31 +228,49 @@ class Mysql:
         # 如果未指定数据库，返回默认连接
         return self.engine
 
-    def execute_query(self, sql, database=None) -> sqlalchemy.engine.cursor.CursorResult:
+    def get_read_engine(self) -> Engine:
+        """
+        大批量数据读取使用的engine, 默认与 get_engine 相同, 有只读实例时由子类选择只读实例
+        :return:
+        """
+        return self.get_engine()
+
+    def report_read_failure(self, engine: Engine, error: BaseException):
+        """
+        get_read_engine 返回的engine读取失败, 有只读实例时由子类暂停使用失败的只读实例，重试时选择其他实例
+        :param engine: 读取失败的engine
+        :param error: 异常
+        :return:
+        """
+        pass
+
+    def execute_query(self, sql, database=None, parameters=None) -> sqlalchemy.engine.cursor.CursorResult:
         """
         执行sql语句并返回指针结果
         :param sql: sql语句
+        :param parameters: 参数, 支持通配符
         :return: sqlalchemy.engine.cursor.CursorResult
         """
         with self.get_engine().connect() as conn:
             if database:
-                conn.execute(text(f'use `{database}`;'))
-            result = conn.execute(text(sql))
+                conn.execute(sa.text(f'use `{database}`;'))
+            result = conn.execute(sa.text(sql), parameters)
         return result
 
-    def execute_update(self, sql, database=None, parameters=None):
+    def execute_update(self, sql, database=None, parameters=None) -> int:
         """
         执行更新或者插入语句, 支持通配符
         :param sql: sql语句
-        :return: sqlalchemy.engine.cursor.CursorResult
+        :return: 影响的行数
         """
         conn = self.get_engine().connect()
         with conn.begin() as txn:
             if database:
-                conn.execute(text(f'use `{database}`;'))
-            conn.execute(text(sql), parameters)
+                conn.execute(sa.text(f'use `{database}`;'))
+            result = conn.execute(sa.text(sql), parameters)
             txn.commit()
         conn.close()
+        return result.rowcount
 
     def execute_updates(self, sqls, database=None, desc=None):
         """
@@ -111,9 +282,9 @@ class Mysql:
         conn = self.get_engine().connect()
         with conn.begin() as txn:
             if database:
-                conn.execute(text(f'use `{database}`;'))
+                conn.execute(sa.text(f'use `{database}`;'))
             for sql in sqls:
-                conn.execute(text(sql), None)
+                conn.execute(sa.text(sql), None)
                 sql_bar.update(1)
             txn.commit()
         conn.close()
@@ -128,9 +299,9 @@ class Mysql:
         """
         # 使用 SQL 查询语句获取数据，并将结果存储到 DataFrame 对象中
         # chunks = pd.read_sql(f'SELECT * FROM `{database}`.`{table}`', con=self.engine, chunksize=chunksize)
-        chunks = pd.read_sql_table(table_name=table, con=self.get_engine(), schema=database,
-                                   chunksize=chunksize)
-        return chunks
+        chunks = pd.read_sql_table(table_name=table, con=self.get_read_engine(), schema=database,
+                                   chunksize=chunksize, **dtype_backend_kwargs())
+        return map(compact_dataframe, chunks)
 
     def get_dataframe_all_from_table(self, table) -> DataFrame:
         """
@@ -149,10 +320,9 @@ class Mysql:
         :return:
         """
         # 使用 SQL 查询语句获取数据，并将结果存储到 DataFrame 对象中
-        dataframe = pd.read_sql(sql, con=self.get_engine())
+        dataframe = pd.read_sql(sql, con=self.get_engine(), **dtype_backend_kwargs())
         # 替换bit类型的 b'\x00' 值为0
-        dataframe = dataframe.map(lambda x: x[0] if type(x) is bytes else x)
-        return dataframe
+        return replace_bit_bytes(dataframe)
 
     def get_dataframe_chunks_from_sql(self, sql, chunksize=100000) -> Iterator[DataFrame]:
         """
@@ -162,8 +332,8 @@ class Mysql:
         :return:
         """
         # 使用 SQL 查询语句获取数据，并将结果存储到 DataFrame 对象中
-        chunks = pd.read_sql(sql, con=self.get_engine(), chunksize=chunksize)
-        return chunks
+        chunks = pd.read_sql(sql, con=self.get_read_engine(), chunksize=chunksize, **dtype_backend_kwargs())
+        return map(compact_dataframe, chunks)
 
     def from_table_to_csv(self, database, table, csv_file, chunk_callback=None):
         """
@@ -176,18 +346,22 @@ class Mysql:
         chunksize = 100000
         count = self.execute_query(f'SELECT count(0) FROM `{database}`.`{table}`').scalar()
         chunks = self.get_dataframe_chunks_from_table(database, table, chunksize=chunksize)
+        # 读取前申请内存预算
+        chunks = get_memory_governor().govern(chunks, self.estimate_chunk_bytes(database, table, chunksize))
         # 显示进度
         chunks = tqdm(chunks, total=count / chunksize)
         for index, item in enumerate(chunks):
             # log.info(f'导出表数据进度: {count}')
             if chunk_callback:
-                item = chunk_callback(item)
-            if index > 0:
-                # 追加内容
-                item.to_csv(csv_file, mode='a', index=False, header=False, encoding='utf-8')
-            else:
-                # 将 DataFrame 对象写入 csv 文件中
-                item.to_csv(csv_file, index=False, encoding='utf-8')
+                with timer('chunk_callback'):
+                    item = chunk_callback(item)
+            with timer('to_csv'):
+                if index > 0:
+                    # 追加内容
+                    item.to_csv(csv_file, mode='a', index=False, header=False, encoding='utf-8')
+                else:
+                    # 将 DataFrame 对象写入 csv 文件中
+                    item.to_csv(csv_file, index=False, encoding='utf-8')
 
     def from_sql_to_csv(self, count_sql, query_sql, csv_file, database=None, chunksize=10000, chunk_callback=None):
         """
@@ -198,7 +372,7 @@ class Mysql:
         :return:
         """
         count = self.execute_query(count_sql, database=database).scalar()
-        chunks = self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize)
+        chunks = get_memory_governor().govern(self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize))
         # 显示进度
         chunks = tqdm(chunks, total=count / chunksize)
         for index, item in enumerate(chunks):
@@ -206,13 +380,15 @@ class Mysql:
                 continue
             # log.info(f'导出表数据进度: {count}')
             if chunk_callback:
-                item = chunk_callback(item)
-            if index > 0:
-                # 追加内容
-                item.to_csv(csv_file, mode='a', index=False, header=False, encoding='utf-8')
-            else:
-                # 创建文件并将 DataFrame 对象写入 csv 文件中
-                item.to_csv(csv_file, index=False, encoding='utf-8')
+                with timer('chunk_callback'):
+                    item = chunk_callback(item)
+            with timer('to_csv'):
+                if index > 0:
+                    # 追加内容
+                    item.to_csv(csv_file, mode='a', index=False, header=False, encoding='utf-8')
+                else:
+                    # 创建文件并将 DataFrame 对象写入 csv 文件中
+                    item.to_csv(csv_file, index=False, encoding='utf-8')
 
     def from_table_to_call_no_processor(self, database, table, chunk_call, chunksize=10000):
         """
@@ -221,9 +397,206 @@ class Mysql:
         :return:
         """
         chunks = self.get_dataframe_chunks_from_table(database, table, chunksize=chunksize)
+        chunks = get_memory_governor().govern(chunks, self.estimate_chunk_bytes(database, table, chunksize))
         for index, item in enumerate(chunks):
             chunk_call(item)
 
+    def from_table_to_rows_call(self, database, table, columns, rows_call, condition=None, chunksize=10000):
+        """
+        不经过pandas，按主键(没有主键时按非空唯一索引)分页读取表数据的原始行(tuple), 遇到临时错误时从最后一个已处理的键处重试
+        没有可用的键时，退化为一次查询流式读取(不能续传)
+        :param database: 数据库名
+        :param table: 数据库表名
+        :param columns: 读取的字段列表
+        :param rows_call: 每页数据的处理函数 function(rows: list[tuple])
+        :param condition: 过滤条件 例如: ent_code = 'xxx'
+        :param chunksize: 每页数量
+        :return:
+        """
+        key = self.get_table_paging_key(database, table)
+        select_columns = list(columns)
+        # 分页键不在读取字段中时追加到最后，用于分页，处理前去掉
+        select_columns += [column for column in key if column not in select_columns]
+        strip_key = len(select_columns) > len(columns)
+        select_sql = f"/** 导出数据 **/ select {', '.join(f'`{column}`' for column in select_columns)} " \
+                     f"from `{database}`.`{table}`"
+        governor = get_memory_governor()
+        row_bytes = self.estimate_chunk_bytes(database, table, 1)
+
+        if not key:
+            logger.warning(f'\r\t【{database}.{table}】没有主键及非空唯一索引，流式读取，遇到临时错误时不能续传')
+            where = f' where {condition}' if condition else ''
+            conn = self.get_read_engine().raw_connection()
+            # 服务端游标流式读取
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(f'{select_sql}{where}')
+                while True:
+                    governor.acquire(chunksize * row_bytes)
+                    try:
+                        with timer('read'):
+                            rows = cursor.fetchmany(chunksize)
+                        if rows:
+                            rows_call(rows)
+                    finally:
+                        governor.release(chunksize * row_bytes)
+                    if len(rows) < chunksize:
+                        return
+            finally:
+                cursor.close()
+                conn.close()
+
+        key_indexes = [select_columns.index(column) for column in key]
+        key_columns = ', '.join(f'`{column}`' for column in key)
+        last_key = None
+
+        def fetch_page(sql, parameters):
+            # 每次重试重新选择读取的实例
+            engine = self.get_read_engine()
+            try:
+                conn = engine.raw_connection()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(sql, parameters)
+                    return cursor.fetchall()
+                finally:
+                    conn.close()
+            except BaseException as e:
+                self.report_read_failure(engine, e)
+                raise
+
+        while True:
+            # pymysql使用%(name)s参数，条件中的%需要转义
+            conditions = [condition.replace('%', '%%')] if condition else []
+            parameters = {}
+            if last_key is not None:
+                conditions.append(f"({key_columns}) > ({', '.join(f'%(last_{index})s' for index in range(len(key)))})")
+                parameters = {f'last_{index}': value for index, value in enumerate(last_key)}
+            where = f" where {' and '.join(conditions)}" if conditions else ''
+            limit = governor.fit_rows(chunksize, row_bytes)
+            page_sql = f"{select_sql.replace('%', '%%')}{where} order by {key_columns} limit {limit}"
+            held = limit * row_bytes
+            governor.acquire(held)
+            try:
+                with timer('read'):
+                    rows = retry_call(fetch_page, page_sql, parameters, desc=f'{database}.{table} 读取')
+                if not rows:
+                    return
+                last_key = tuple(rows[-1][index] for index in key_indexes)
+                if strip_key:
+                    rows = [row[:len(columns)] for row in rows]
+                rows_call(rows)
+            finally:
+                governor.release(held)
+            if len(rows) < limit:
+                return
+
+    def insert_rows(self, database, table, columns, rows, upsert_keys=None) -> int:
+        """
+        不经过pandas, 使用executemany批量写入原始行，在一个事务中提交
+        :param database: 数据库名
+        :param table: 表名
+        :param columns: 写入字段列表, 与每行的值一一对应
+        :param rows: 行列表 list[tuple]
+        :param upsert_keys: 按 INSERT ... ON DUPLICATE KEY UPDATE 写入时，重复时不更新的字段(业务键及主键)
+        :return: 写入的行数
+        """
+        insert_sql = f"INSERT INTO `{database}`.`{table}` ({', '.join(f'`{column}`' for column in columns)}) " \
+                     f"VALUES ({', '.join(['%s'] * len(columns))})"
+        if upsert_keys:
+            insert_sql = f'{insert_sql} {get_upsert_clause(columns, upsert_keys)}'
+        conn = self.get_engine().raw_connection()
+        try:
+            cursor = conn.cursor()
+            # pymysql 会把多行合并为 INSERT ... VALUES (...), (...) 批量写入
+            cursor.executemany(insert_sql, rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def from_table_to_call_by_key(self, database, table, chunk_call, condition=None, chunksize=10000, columns=None):
+        """
+        按主键(没有主键时按非空唯一索引)分页读取表数据, 每页是独立的查询，遇到临时错误时从最后一个已处理的键处重试
+        没有可用的键时，退化为一次查询流式读取(不能续传)
+        :param database: 数据库名
+        :param table: 数据库表名
+        :param chunk_call: 每页数据的处理函数 function(df)
+        :param condition: 过滤条件 例如: ent_code = 'xxx'
+        :param chunksize: 每页数量
+        :param columns: 查询字段表达式列表, 默认 *
+        :return:
+        """
+        key = self.get_table_paging_key(database, table)
+        select = ', '.join(columns) if columns else '*'
+        if not key:
+            logger.warning(f'\r\t【{database}.{table}】没有主键及非空唯一索引，流式读取，遇到临时错误时不能续传')
+            where = f' where {condition}' if condition else ''
+            query_sql = f"/** 导出数据 **/ select {select} from `{database}`.`{table}`{where}"
+            self.from_sql_to_call_no_processor(query_sql, chunk_call, database=database, chunksize=chunksize)
+            return
+
+        # 分页键被替换为常量表达式时，额外查询分页键
+        key_names = []
+        for index, column in enumerate(key):
+            if columns and f'`{column}`' not in columns:
+                key_names.append(f'__page_key_{index}')
+                select = f'{select}, `{column}` AS `{key_names[-1]}`'
+            else:
+                key_names.append(column)
+        key_columns = ', '.join(f'`{column}`' for column in key)
+        last_key = None
+        governor = get_memory_governor()
+        row_bytes = self.estimate_chunk_bytes(database, table, 1)
+
+        def read_page(sql, params):
+            # 每次重试重新选择读取的实例
+            engine = self.get_read_engine()
+            try:
+                return pd.read_sql(sa.text(sql), con=engine, params=params, **dtype_backend_kwargs())
+            except BaseException as e:
+                self.report_read_failure(engine, e)
+                raise
+
+        while True:
+            conditions = [condition] if condition else []
+            params = None
+            if last_key is not None:
+                conditions.append(f"({key_columns}) > ({', '.join(f':last_{index}' for index in range(len(key)))})")
+                params = {f'last_{index}': value for index, value in enumerate(last_key)}
+            where = f" where {' and '.join(conditions)}" if conditions else ''
+            # 内存预算不足时缩小本页的数量
+            limit = governor.fit_rows(chunksize, row_bytes)
+            query_sql = f"/** 导出数据 **/ select {select} from `{database}`.`{table}`{where} order by {key_columns} limit {limit}"
+            held = limit * row_bytes
+            governor.acquire(held)
+            try:
+                with timer('read_sql'):
+                    chunk = retry_call(read_page, query_sql, params, desc=f'{database}.{table} 读取')
+                    chunk = compact_dataframe(chunk)
+                if len(chunk) == 0:
+                    return
+                # chunk_call 可能修改数据(比如置空id)，先记录本页最后的键; numpy类型转换为python类型作为查询参数
+                last_key = tuple(value.item() if hasattr(value, 'item') else value
+                                 for value in (chunk[name].iloc[-1] for name in key_names))
+                for name in key_names:
+                    if name not in key:
+                        chunk.pop(name)
+                # 按实际大小修正占用及每行的预估大小
+                actual = get_dataframe_bytes(chunk)
+                governor.reserve(actual)
+                governor.release(held)
+                held = actual
+                row_bytes = actual // len(chunk) + 1
+                chunk_call(chunk)
+            finally:
+                governor.release(held)
+            if len(chunk) < limit:
+                return
+
     def from_table_to_call(self, database, table, chunk_call, chunksize=10000):
         """
         从数据表导出到csv文件
@@ -235,6 +608,7 @@ class Mysql:
         count = self.execute_query(count_query).scalar()
         # print(f'共 {count} 条记录，开始读取数据...')
         chunks = self.get_dataframe_chunks_from_table(database, table, chunksize=chunksize)
+        chunks = get_memory_governor().govern(chunks, self.estimate_chunk_bytes(database, table, chunksize))
         # 显示进度
         chunks = tqdm(chunks, total=count / chunksize, desc=f'{table} 表from_table_to_call数据处理进度')
         for index, item in enumerate(chunks):
@@ -246,7 +620,7 @@ class Mysql:
         :param table: 数据库表名
         :return:
         """
-        chunks = self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize)
+        chunks = get_memory_governor().govern(self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize))
         for index, item in enumerate(chunks):
             chunk_call(item)
 
@@ -259,7 +633,7 @@ class Mysql:
         # print(f'【执行查询条目数】: \r\n {count_sql}')
         count = self.execute_query(count_sql).scalar()
         # print(f'【条目数】共 {count} 条记录，开始读取数据...')
-        chunks = self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize)
+        chunks = get_memory_governor().govern(self.get_dataframe_chunks_from_sql(query_sql, chunksize=chunksize))
         # 显示进度
         chunks = tqdm(chunks, total=count / chunksize, desc=f'【from_sql_to_call数据处理进度】')
         for index, item in enumerate(chunks):
@@ -269,7 +643,7 @@ class Mysql:
 
     def from_csv_to_table(self, csv_file: str, database: str, table: str, is_truncate_data: bool,
                           chunk_wrapper: Callable = None,
-                          dtype=None):
+                          dtype=None, parse_dates=None, parallel_workers=None):
         """
         从csv文件批量导入到数据表
         :param csv_file: csv文件
@@ -278,6 +652,8 @@ class Mysql:
         :param is_truncate_data: 是否清空数据
         :param chunk_wrapper: df对象包装过滤器 function(df, database, table) -> df
         :param dtype: 指定类型 例如： {'a': np.int16, 'b': np.float64}
+        :param parse_dates: 需要解析为日期时间的字段列表
+        :param parallel_workers: 并行解析写入的线程数, 默认超过 [global] parallel_csv_threshold_mb(256M) 的文件使用4个线程
         :return:
         """
         # with self.engine.connect() as conn:
@@ -285,12 +661,27 @@ class Mysql:
         try:
             if is_truncate_data:
                 self.execute_update(f'truncate table `{database}`.`{table}`')
+            if parallel_workers is None:
+                threshold = get_config().getint('global', 'parallel_csv_threshold_mb', fallback=256) * 1024 * 1024
+                parallel_workers = 4 if os.path.getsize(csv_file) >= threshold else 1
+            if parallel_workers > 1:
+                # 大文件按字节区间切分，多线程解析并通过多个连接写入
+                from base._ingest import ParallelCsvIngest
+                ParallelCsvIngest(self, workers=parallel_workers).ingest(csv_file, database, table,
+                                                                         chunk_wrapper=chunk_wrapper, dtype=dtype,
+                                                                         parse_dates=parse_dates)
+                return
             csv = Csv()
-            chunks = csv.get_chunks_from_csv(csv_file, dtype=dtype)
+            chunks = csv.get_chunks_from_csv(csv_file, dtype=dtype, parse_dates=parse_dates)
+            chunks = get_memory_governor().govern(chunks)
             for index, item in enumerate(chunks):
                 if chunk_wrapper:
-                    item = chunk_wrapper(item, database, table)
-                item.to_sql(table, schema=database, con=self.get_engine(), if_exists='append', index=False)
+                    with timer('chunk_wrapper'):
+                        item = chunk_wrapper(item, database, table)
+                # 每批在一个事务中写入，失败时整批重试
+                with timer('to_sql'):
+                    retry_call(item.to_sql, table, schema=database, con=self.get_engine(), if_exists='append',
+                               index=False, desc=f'{database}.{table} 写入')
         except BaseException as e:
             raise ImportError(f'to_sql:【{database}.{table}】 {repr(e)}')
 
@@ -299,8 +690,8 @@ class Mysql:
         列出指定数据库下所有的用户表
         """
         with self.get_engine().connect() as conn:
-            conn.execute(text(f'use `{database}`'))
-            rs = conn.execute(text(f'show tables;'))
+            conn.execute(sa.text(f'use `{database}`'))
+            rs = conn.execute(sa.text(f'show tables;'))
             tables = list(map(lambda x: x[0], rs))
             return tables
 
@@ -309,7 +700,7 @@ class Mysql:
         列出指定连接的所有数据库
         """
         with self.default_engine.connect() as conn:
-            rs = conn.execute(text(f'show databases;'))
+            rs = conn.execute(sa.text(f'show databases;'))
             databases = list(map(lambda x: x[0], rs))
             return databases
 
@@ -318,8 +709,8 @@ class Mysql:
         列出指定数据库下，没有索引的表
         """
         with self.get_engine().connect() as conn:
-            conn.execute(text(f'use `{database}`;'))
-            rs = conn.execute(text(f'show tables;'))
+            conn.execute(sa.text(f'use `{database}`;'))
+            rs = conn.execute(sa.text(f'show tables;'))
             tables = list(map(lambda x: x[0], rs))
             sql = f"""SELECT
                             table_schema,
@@ -334,7 +725,7 @@ class Mysql:
                             table_schema,
                             table_name;
                     """
-            table_with_indexs = conn.execute(text(sql))
+            table_with_indexs = conn.execute(sa.text(sql))
             index_tables = list(map(lambda x: x[1], table_with_indexs))
             diff = set(tables).difference(set(index_tables))
             return diff
@@ -345,8 +736,8 @@ class Mysql:
         """
         drop_sqls = []
         with self.get_engine().connect() as conn:
-            conn.execute(text(f'use `{database}`;'))
-            rs = conn.execute(text(f'show tables;'))
+            conn.execute(sa.text(f'use `{database}`;'))
+            rs = conn.execute(sa.text(f'show tables;'))
             for r in rs:
                 tablename = r[0]
                 index_drop_sql = f"""SELECT
@@ -373,7 +764,7 @@ class Mysql:
                                     ORDER BY
                                         TABLE_NAME ASC,
                                         INDEX_NAME ASC;"""
-                rows = conn.execute(text(index_drop_sql))
+                rows = conn.execute(sa.text(index_drop_sql))
                 for row in rows:
                     drop_sqls.append(row[1])
         return drop_sqls
@@ -381,8 +772,8 @@ class Mysql:
     def get_index_alert_sqls(self, database) -> list[str]:
         index_alert_sqls = []
         with self.get_engine().connect() as conn:
-            conn.execute(text(f'use `{database}`;'))
-            rs = conn.execute(text(f'show tables;'))
+            conn.execute(sa.text(f'use `{database}`;'))
+            rs = conn.execute(sa.text(f'show tables;'))
             for r in rs:
                 tablename = r[0]
                 index_alert_sql = f"""SELECT
@@ -430,7 +821,7 @@ class Mysql:
                             ORDER BY
                                 TABLE_NAME ASC,
                                 INDEX_NAME ASC;"""
-                rows = conn.execute(text(index_alert_sql))
+                rows = conn.execute(sa.text(index_alert_sql))
                 for row in rows:
                     index_alert_sqls.append(row[1])
         return index_alert_sqls
@@ -489,7 +880,7 @@ class Mysql:
                                         ORDER BY
                                             TABLE_NAME ASC,
                                             INDEX_NAME ASC;"""
-            rows = conn.execute(text(index_alert_sql))
+            rows = conn.execute(sa.text(index_alert_sql))
             for row in rows:
                 index_alert_sqls.append(row[1])
         return index_alert_sqls
@@ -525,7 +916,7 @@ class Mysql:
                                     ORDER BY
                                         TABLE_NAME ASC,
                                         INDEX_NAME ASC;"""
-            rows = conn.execute(text(index_drop_sql))
+            rows = conn.execute(sa.text(index_drop_sql))
             for row in rows:
                 drop_sqls.append(row[1])
         return drop_sqls
@@ -565,7 +956,7 @@ class Mysql:
                         WHERE
                             TABLE_TYPE = "BASE TABLE" and TABLE_SCHEMA = '{database}';"""
         with self.get_engine().connect() as conn:
-            rs = conn.execute(text(get_alert_sql))
+            rs = conn.execute(sa.text(get_alert_sql))
             for r in rs:
                 alert_sqls.append(r[0])
         return alert_sqls
@@ -582,7 +973,7 @@ class Mysql:
         else:
             show_create_table_sql = f'show create table {table}'
         with self.get_engine().connect() as conn:
-            rs = conn.execute(text(show_create_table_sql))
+            rs = conn.execute(sa.text(show_create_table_sql))
             return rs.one()[1]
         return None
 
@@ -594,7 +985,7 @@ class Mysql:
         """
         show_create_database_sql = f'show create database {database}'
         with self.get_engine().connect() as conn:
-            rs = conn.execute(text(show_create_database_sql))
+            rs = conn.execute(sa.text(show_create_database_sql))
             return rs.one()[1]
         return None
 
@@ -609,6 +1000,31 @@ class Mysql:
         result = self.execute_query(show_column_sql)
         return result.fetchall()
 
+    def get_table_csv_dtype(self, database, table):
+        """
+        根据表字段元数据生成读取csv时的类型，避免pandas逐列推断类型
+        整数使用可空的Int64, 字符串/json/decimal使用string(decimal避免转成float丢失精度), 日期时间按ISO格式解析
+        :param database: 数据库名
+        :param table: 表名
+        :return: (dtype, parse_dates) 例如: ({'id': 'Int64', 'name': 'string'}, ['create_time'])
+        """
+        column_sql = f"""SELECT COLUMN_NAME, DATA_TYPE, COLUMN_TYPE FROM information_schema.COLUMNS
+                         WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}'"""
+        dtype = {}
+        parse_dates = []
+        for column, data_type, column_type in self.execute_query(column_sql).fetchall():
+            data_type = str(data_type).lower()
+            if data_type in ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint', 'year'):
+                dtype[column] = 'UInt64' if data_type == 'bigint' and 'unsigned' in str(column_type) else 'Int64'
+            elif data_type in ('float', 'double', 'real'):
+                dtype[column] = 'float64'
+            elif data_type in ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'json', 'enum',
+                               'set', 'decimal', 'time'):
+                dtype[column] = 'string'
+            elif data_type in ('date', 'datetime', 'timestamp'):
+                parse_dates.append(column)
+        return dtype, parse_dates
+
     def exists_table_column(self, database, table, column):
         """
         判断表是否存在某个字段
@@ -621,6 +1037,305 @@ class Mysql:
         count = self.execute_query(show_column_sql).scalar()
         return True if count and count > 0 else False
 
+    def get_table_column_names(self, database, table) -> list[str]:
+        """
+        获取表的字段名列表, 按字段顺序排列
+        :param database: 数据库名
+        :param table: 表名
+        :return:
+        """
+        column_sql = f"""SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                         WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}'
+                         ORDER BY ORDINAL_POSITION"""
+        return [row[0] for row in self.execute_query(column_sql).fetchall()]
+
+    def get_table_primary_key(self, database, table) -> list[str]:
+        """
+        获取表的主键字段列表
+        :param database: 数据库名
+        :param table: 表名
+        :return: 主键字段列表, 没有主键返回空列表
+        """
+        pk_sql = f"""SELECT COLUMN_NAME FROM information_schema.STATISTICS
+                     WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}' AND INDEX_NAME = 'PRIMARY'
+                     ORDER BY SEQ_IN_INDEX"""
+        return [row[0] for row in self.execute_query(pk_sql).fetchall()]
+
+    def get_table_paging_key(self, database, table) -> list[str]:
+        """
+        按键分页读取使用的字段: 主键，没有主键时使用第一个非空唯一索引
+        :param database: 数据库名
+        :param table: 表名
+        :return: 字段列表, 没有可用的键返回空列表
+        """
+        unique_keys = self.get_table_unique_keys(database, table)
+        return unique_keys[0] if unique_keys else []
+
+    def get_table_unique_keys(self, database, table) -> list[list[str]]:
+        """
+        获取表可以识别重复行的唯一索引(包括主键), 允许NULL的字段、前缀索引及函数索引不能准确识别重复行，不返回
+        :param database: 数据库名
+        :param table: 表名
+        :return: 唯一索引的字段列表, 主键在最前面
+        """
+        unique_sql = f"""SELECT s.INDEX_NAME, s.COLUMN_NAME, s.SUB_PART, c.IS_NULLABLE
+                         FROM information_schema.STATISTICS s
+                         LEFT JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = s.TABLE_SCHEMA
+                           AND c.TABLE_NAME = s.TABLE_NAME AND c.COLUMN_NAME = s.COLUMN_NAME
+                         WHERE s.TABLE_SCHEMA = '{database}' AND s.TABLE_NAME = '{table}' AND s.NON_UNIQUE = 0
+                         ORDER BY s.INDEX_NAME != 'PRIMARY', s.INDEX_NAME, s.SEQ_IN_INDEX"""
+        indexes = {}
+        invalid_indexes = set()
+        for index_name, column, sub_part, is_nullable in self.execute_query(unique_sql).fetchall():
+            indexes.setdefault(index_name, []).append(column)
+            if column is None or sub_part is not None or is_nullable != 'NO':
+                invalid_indexes.add(index_name)
+        return [columns for index_name, columns in indexes.items() if index_name not in invalid_indexes]
+
+    def get_server_id(self) -> str:
+        """
+        获取mysql服务实例的唯一标识，用于判断两个连接是否指向同一个实例
+        :return:
+        """
+        if self._server_id is None:
+            try:
+                self._server_id = self.execute_query('select @@server_uuid').scalar()
+            except BaseException:
+                # MariaDB等没有server_uuid的实例
+                self._server_id = self.execute_query("select concat(@@hostname, ':', @@port)").scalar()
+        return self._server_id
+
+    def is_same_server(self, other) -> bool:
+        """
+        判断是否与另一个连接指向同一个mysql实例
+        :param other: Mysql对象
+        :return: True: 同一个实例 False: 不同实例
+        """
+        if self.host == other.host and str(self.port) == str(other.port):
+            return True
+        return self.get_server_id() == other.get_server_id()
+
+    def insert_select_by_pk_range(self, source_database, source_table, target_database, target_table,
+                                  columns, select_columns, condition=None, chunksize=50000, upsert_keys=None) -> int:
+        """
+        同实例下按主键范围分批执行 INSERT ... SELECT, 数据不经过python
+        :param source_database: 源数据库
+        :param source_table: 源表
+        :param target_database: 目标数据库
+        :param target_table: 目标表
+        :param columns: 目标表写入字段列表
+        :param select_columns: 与columns一一对应的查询表达式
+        :param condition: 源表过滤条件
+        :param chunksize: 每批写入数量
+        :param upsert_keys: 按 INSERT ... ON DUPLICATE KEY UPDATE 写入时，重复时不更新的字段(业务键及主键)
+        :return: 写入的行数(upsert时更新的行计为2)
+        """
+        if not condition:
+            condition = '1=1'
+        insert_sql = (f"INSERT INTO `{target_database}`.`{target_table}` "
+                      f"({', '.join(f'`{column}`' for column in columns)}) "
+                      f"SELECT {', '.join(select_columns)} FROM `{source_database}`.`{source_table}`")
+        upsert_clause = f' {get_upsert_clause(columns, upsert_keys)}' if upsert_keys else ''
+        pks = self.get_table_primary_key(source_database, source_table)
+        # 没有主键或者是联合主键，则一次性写入
+        if len(pks) != 1:
+            return retry_call(self.execute_update, f'{insert_sql} where {condition}{upsert_clause}',
+                              desc=f'{target_table} 写入')
+
+        pk = pks[0]
+        rows = 0
+        parameters = {}
+        while True:
+            where = condition if 'last_key' not in parameters else f'{condition} and `{pk}` > :last_key'
+            # 找出本批次的主键上界
+            upper_sql = (f"SELECT `{pk}` FROM `{source_database}`.`{source_table}` where {where} "
+                         f"ORDER BY `{pk}` LIMIT 1 OFFSET {chunksize - 1}")
+            upper_key = retry_call(lambda: self.execute_query(upper_sql, parameters=parameters).scalar(),
+                                   desc=f'{source_table} 读取')
+            if upper_key is None:
+                # 最后一批
+                return rows + retry_call(self.execute_update, f'{insert_sql} where {where}{upsert_clause}',
+                                         parameters=parameters, desc=f'{target_table} 写入')
+            rows += retry_call(self.execute_update,
+                               f'{insert_sql} where {where} and `{pk}` <= :upper_key{upsert_clause}',
+                               parameters={**parameters, 'upper_key': upper_key}, desc=f'{target_table} 写入')
+            parameters = {'last_key': upper_key}
+
+    def list_tables_with_column(self, databases, column) -> list[tuple]:
+        """
+        一次查询列出多个数据库中包含指定字段的所有表
+        :param databases: 数据库列表
+        :param column: 字段名
+        :return: [(database, table, 估算行数)] 按估算行数从大到小排列
+        """
+        if not databases:
+            return []
+        schemas = ', '.join(f"'{database}'" for database in databases)
+        tables_sql = f"""SELECT c.TABLE_SCHEMA, c.TABLE_NAME, IFNULL(t.TABLE_ROWS, 0)
+                         FROM information_schema.COLUMNS c
+                         JOIN information_schema.TABLES t
+                           ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+                         WHERE c.TABLE_SCHEMA IN ({schemas}) AND c.COLUMN_NAME = '{column}'
+                           AND t.TABLE_TYPE = 'BASE TABLE'
+                         ORDER BY 3 DESC"""
+        rows = self.execute_query(tables_sql).fetchall()
+        return [(row[0], row[1], int(row[2])) for row in rows]
+
+    def get_tables_size(self, databases) -> dict:
+        """
+        批量获取表的数据量(数据+索引字节数)
+        :param databases: 数据库列表
+        :return: {(database, table): 字节数}
+        """
+        if not databases:
+            return {}
+        schemas = ', '.join(f"'{database}'" for database in databases)
+        size_sql = f"""SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0)
+                       FROM information_schema.TABLES
+                       WHERE TABLE_SCHEMA IN ({schemas}) AND TABLE_TYPE = 'BASE TABLE'"""
+        rows = self.execute_query(size_sql).fetchall()
+        return {(row[0], row[1]): int(row[2]) for row in rows}
+
+    def estimate_chunk_bytes(self, database, table, chunksize) -> int:
+        """
+        按表的平均行长度预估一批数据读取到DataFrame后占用的内存
+        :param database: 数据库名
+        :param table: 表名
+        :param chunksize: 行数
+        :return: 字节数
+        """
+        avg_row_length = self.execute_query(f"""SELECT IFNULL(AVG_ROW_LENGTH, 0) FROM information_schema.TABLES
+                                                WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}'""").scalar()
+        # python对象的开销，DataFrame通常是存储大小的数倍
+        return int(avg_row_length or 0) * 4 * chunksize
+
+    def get_table_rows_estimate(self, database, table) -> int:
+        """
+        按表统计信息预估的行数(InnoDB的TABLE_ROWS是估算值，不需要扫描全表)
+        :param database: 数据库名
+        :param table: 表名
+        :return: 行数
+        """
+        rows = self.execute_query(f"""SELECT IFNULL(TABLE_ROWS, 0) FROM information_schema.TABLES
+                                      WHERE TABLE_SCHEMA = '{database}' AND TABLE_NAME = '{table}'""").scalar()
+        return int(rows or 0)
+
+    def get_table_schema_hash(self, database, table) -> str:
+        """
+        表结构的哈希值, 忽略自增值
+        :param database: 数据库名
+        :param table: 表名
+        :return: md5
+        """
+        create_sql = self.get_table_create_sql(table, database)
+        create_sql = re.sub(r' AUTO_INCREMENT=\d+', '', create_sql)
+        return hashlib.md5(create_sql.encode('utf-8')).hexdigest()
+
+    def get_schema_hashes(self, database) -> dict:
+        """
+        批量计算数据库中每个表结构的哈希值(字段、生成列、索引、外键、CHECK约束、分区、表选项), 不需要逐表 show create table
+        :param database: 数据库名
+        :return: {table: md5}
+        """
+        # (查询, 是否可选) 可选的查询在旧版本mysql上没有对应的系统表(比如 5.7 没有 CHECK_CONSTRAINTS)
+        queries = [
+            (f"""SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA, COLLATION_NAME,
+                        COLUMN_COMMENT, GENERATION_EXPRESSION
+                 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = '{database}'
+                 ORDER BY TABLE_NAME, ORDINAL_POSITION""", False),
+            (f"""SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME, SUB_PART, INDEX_TYPE
+                 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = '{database}'
+                 ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX""", False),
+            (f"""SELECT TABLE_NAME, CONSTRAINT_NAME, REFERENCED_TABLE_NAME, UPDATE_RULE, DELETE_RULE
+                 FROM information_schema.REFERENTIAL_CONSTRAINTS WHERE CONSTRAINT_SCHEMA = '{database}'
+                 ORDER BY TABLE_NAME, CONSTRAINT_NAME""", False),
+            (f"""SELECT TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION, COLUMN_NAME, REFERENCED_TABLE_SCHEMA,
+                        REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+                 FROM information_schema.KEY_COLUMN_USAGE
+                 WHERE TABLE_SCHEMA = '{database}' AND REFERENCED_TABLE_NAME IS NOT NULL
+                 ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION""", False),
+            (f"""SELECT tc.TABLE_NAME, tc.CONSTRAINT_NAME, cc.CHECK_CLAUSE
+                 FROM information_schema.TABLE_CONSTRAINTS tc
+                 JOIN information_schema.CHECK_CONSTRAINTS cc
+                   ON cc.CONSTRAINT_SCHEMA = tc.CONSTRAINT_SCHEMA AND cc.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+                 WHERE tc.TABLE_SCHEMA = '{database}' AND tc.CONSTRAINT_TYPE = 'CHECK'
+                 ORDER BY tc.TABLE_NAME, tc.CONSTRAINT_NAME""", True),
+            (f"""SELECT TABLE_NAME, PARTITION_NAME, SUBPARTITION_NAME, PARTITION_METHOD, SUBPARTITION_METHOD,
+                        PARTITION_EXPRESSION, SUBPARTITION_EXPRESSION, PARTITION_DESCRIPTION
+                 FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = '{database}' AND PARTITION_NAME IS NOT NULL
+                 ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION""", False),
+            (f"""SELECT TABLE_NAME, ENGINE, TABLE_COLLATION, CREATE_OPTIONS, TABLE_COMMENT
+                 FROM information_schema.TABLES WHERE TABLE_SCHEMA = '{database}' AND TABLE_TYPE = 'BASE TABLE'
+                 ORDER BY TABLE_NAME""", False),
+        ]
+        digests = {}
+        for index, (query, optional) in enumerate(queries):
+            try:
+                rows = self.execute_query(query).fetchall()
+            except BaseException as e:
+                if not optional:
+                    raise
+                logger.debug(f'【{database}】表结构指纹跳过不支持的查询: {repr(e)}')
+                continue
+            for row in rows:
+                digest = digests.setdefault(row[0], hashlib.md5())
+                # 带上查询序号，不同来源的数据不会拼接出相同的内容
+                digest.update(f'{index}:{tuple(row[1:])!r}'.encode('utf-8'))
+        return {table: digest.hexdigest() for table, digest in digests.items()}
+
+    def get_table_fingerprint(self, database, table, condition=None) -> dict:
+        """
+        表数据的指纹, 用于判断表数据是否发生变化
+        有更新时间字段时使用 行数 + 最大更新时间，否则使用 行数 + CHECKSUM TABLE(整表)
+        :param database: 数据库名
+        :param table: 表名
+        :param condition: 过滤条件 例如: ent_code = 'xxx'
+        :return: dict
+        """
+        where = f' WHERE {condition}' if condition else ''
+        columns = self.get_table_column_names(database, table)
+        update_column = next((column for column in UPDATE_TIME_COLUMNS if column in columns), None)
+        if update_column:
+            row = self.execute_query(f"SELECT COUNT(0), MAX(`{update_column}`) "
+                                     f"FROM `{database}`.`{table}`{where}").one()
+            rows, version = row[0], f'{update_column}:{row[1]}'
+        else:
+            rows = self.execute_query(f"SELECT COUNT(0) FROM `{database}`.`{table}`{where}").scalar()
+            checksum = self.execute_query(f"CHECKSUM TABLE `{database}`.`{table}`").one()[1]
+            version = f'checksum:{checksum}'
+        return {
+            'rows': int(rows),
+            'version': version,
+            'schema': self.get_table_schema_hash(database, table),
+            'condition': condition,
+        }
+
+    def get_table_checksum(self, database, table, columns=None, condition=None) -> tuple:
+        """
+        表数据的校验值, 用于比较两个实例上的表数据是否一致
+        不指定字段及条件时使用 CHECKSUM TABLE，否则对字段计算每行CRC32的聚合值
+        :param database: 数据库名
+        :param table: 表名
+        :param columns: 参与计算的字段列表, 空列表时只统计行数
+        :param condition: 过滤条件 例如: ent_code = 'xxx'
+        :return: (行数, 校验值)
+        """
+        where = f' WHERE {condition}' if condition else ''
+        if columns is None and not condition:
+            rows = self.execute_query(f"SELECT COUNT(0) FROM `{database}`.`{table}`").scalar()
+            checksum = self.execute_query(f"CHECKSUM TABLE `{database}`.`{table}`").one()[1]
+            return int(rows), str(checksum)
+        if columns is None:
+            columns = self.get_table_column_names(database, table)
+        if not columns:
+            return int(self.execute_query(f"SELECT COUNT(0) FROM `{database}`.`{table}`{where}").scalar()), ''
+        # CONCAT_WS会忽略NULL，拼接ISNULL区分NULL和空字符串
+        values = ', '.join([f'`{column}`' for column in columns] + [f'ISNULL(`{column}`)' for column in columns])
+        crc = f"CRC32(CONCAT_WS('#', {values}))"
+        # 异或相同的行会相互抵消，同时比较求和
+        row = self.execute_query(f"SELECT COUNT(0), BIT_XOR({crc}), SUM({crc}) FROM `{database}`.`{table}`{where}").one()
+        return int(row[0]), f'{row[1]}:{row[2]}'
+
     def exists_table(self, database, table):
         """
         是否存在指定表
@@ -642,14 +1357,52 @@ class Mysql:
             has_database = self.get_engine().dialect.has_schema(conn, database)
             return has_database
 
-    def import_sql_file(self, sql_file, database):
+    def dump_table_to(self, target, database, table, where=None, target_database=None, replace=False):
         """
-        导入sql文件
-        :param sql_file:
-        :param database:
+        使用 mysqldump 导出表数据并直接通过管道写入目标库的 mysql 客户端，数据不经过python
+        :param target: 目标Mysql对象
+        :param database: 源数据库
+        :param table: 表名
+        :param where: 过滤条件 例如: ent_code IN ('a', 'b')
+        :param target_database: 目标数据库, 默认与源数据库同名
+        :param replace: 使用 REPLACE 代替 INSERT 写入, 与目标表已有行重复时覆盖
         :return:
         """
+        # 有只读实例时从只读实例导出
+        read_url = self.get_read_engine().url
+        dump_command = [get_mysql_client_file('mysqldump'), f'--host={read_url.host}', f'--port={read_url.port}',
+                        f'--user={self.user}', *get_mysqldump_options()]
+        if where:
+            dump_command.append(f'--where={where}')
+        if replace:
+            dump_command.append('--replace')
+        dump_command += [database, table]
+        import_command = [get_mysql_client_file('mysql'), f'--host={target.host}', f'--port={target.port}', f'--user={target.user}',
+                          '--max_allowed_packet=67108864', '-D', target_database or database]
+
+        # 密码通过环境变量传递，避免出现在进程列表里
+        with tempfile.TemporaryFile() as dump_err, tempfile.TemporaryFile() as import_err:
+            dump = Popen(dump_command, stdout=PIPE, stderr=dump_err, env={**os.environ, 'MYSQL_PWD': self.password})
+            mysql = Popen(import_command, stdin=dump.stdout, stderr=import_err,
+                          env={**os.environ, 'MYSQL_PWD': target.password})
+            # 关闭父进程持有的管道，保证mysql客户端退出时mysqldump能收到SIGPIPE
+            dump.stdout.close()
+            import_code = mysql.wait()
+            dump_code = dump.wait()
+            if dump_code != 0 or import_code != 0:
+                dump_err.seek(0)
+                import_err.seek(0)
+                raise ImportError(f'dump:【{database}.{table}】 mysqldump({dump_code}): '
+                                  f'{dump_err.read().decode(errors="ignore").strip()} '
+                                  f'mysql({import_code}): {import_err.read().decode(errors="ignore").strip()}')
+
+    def import_sql_file(self, sql_file, database, workers=4):
+        """
+        导入sql文件, 按语句拆分后不同表的语句使用多个连接并行执行
+        :param sql_file: sql文件
+        :param database: 默认数据库
+        :param workers: 并发连接数
+        :return: 执行的语句数量
+        """
         logger.info(f'【{database}】导入sql文件 {sql_file}')
-        import_shell = f'{mysql_file} -v --host={self.host} --user={self.user} --password={self.password} --port={self.port} --max_allowed_packet=67108864 --net_buffer_length=16384 -D {database}< {sql_file}'
-        execute_command(import_shell)
-        pass
+        return SqlFileImporter(self, workers=workers).import_file(sql_file, database)
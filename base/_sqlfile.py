@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import concurrent
+import os
+import re
+from concurrent.futures import wait, FIRST_COMPLETED, ALL_COMPLETED
+from threading import BoundedSemaphore
+from typing import Iterator, TYPE_CHECKING
+
+from base._utils import logger, tqdm
+
+if TYPE_CHECKING:
+    from base._sink import Mysql
+
+_QUOTES = '\'"`'
+_DELIMITER_LINE = re.compile(r'^\s*DELIMITER\s+(\S+)\s*$', re.IGNORECASE)
+# 可以按表并行执行的语句
+_TABLE_STATEMENT = re.compile(
+    r'^(?:/\*!\d*\s*)?(?:CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)?|DROP\s+TABLE(?:\s+IF\s+EXISTS)?|ALTER\s+TABLE|'
+    r'TRUNCATE(?:\s+TABLE)?|INSERT(?:\s+(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE))*(?:\s+INTO)?|'
+    r'REPLACE(?:\s+(?:LOW_PRIORITY|DELAYED))*(?:\s+INTO)?)\s+'
+    r'((?:`[^`]+`|\w+)(?:\s*\.\s*(?:`[^`]+`|\w+))?)', re.IGNORECASE | re.DOTALL)
+# 每个连接都需要执行的会话设置
+_SESSION_STATEMENT = re.compile(r'^(?:/\*!\d*\s*)?SET\s', re.IGNORECASE)
+# mysqldump 在表后及文件末尾恢复之前保存的会话设置(@OLD_*、@saved_*)，连接池中的连接不需要恢复
+_RESTORE_STATEMENT = re.compile(r'^(?:/\*!\d*\s*)?SET\s.*=\s*@(?:OLD_|saved_)', re.IGNORECASE | re.DOTALL)
+# 多连接执行时没有意义的语句
+_SKIP_STATEMENT = re.compile(r'^(?:/\*!\d*\s*)?(?:LOCK\s+TABLES|UNLOCK\s+TABLES)\b', re.IGNORECASE)
+_USE_STATEMENT = re.compile(r'^USE\s+`?([^`\s;]+)`?', re.IGNORECASE)
+
+
+def split_sql_statements(lines) -> Iterator[tuple]:
+    """
+    把sql文本拆分为语句, 支持 DELIMITER、引号(包括反斜杠转义)及注释, 注释会被去掉(/*! */ 可执行注释保留)
+    :param lines: 按行迭代的文本(bytes或者str), 例如打开的文件
+    :return: (语句, 到当前语句结束时读取的字节数) 迭代器
+             bytes按 surrogateescape 解码，没有 --hex-blob 导出的二进制字段中非utf-8的字节可以用 encode_statement 还原
+    """
+    delimiter = ';'
+    # 不包含引号、注释及分隔符的普通字符, 批量追加
+    plain = re.compile(r'[^\'"`#/\-;]+')
+    buffer = []
+    quote = None
+    in_comment = False
+    read_bytes = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            read_bytes += len(line)
+            line = line.decode('utf-8', 'surrogateescape')
+        else:
+            read_bytes += len(line.encode('utf-8', 'surrogateescape'))
+        # DELIMITER 是客户端命令，只能出现在语句开始处
+        match = _DELIMITER_LINE.match(line)
+        if match and not quote and not in_comment and not ''.join(buffer).strip():
+            delimiter = match.group(1)
+            plain = re.compile(r'[^\'"`#/\-' + re.escape(delimiter[0]) + r']+')
+            buffer = []
+            continue
+        index = 0
+        length = len(line)
+        while index < length:
+            if in_comment:
+                end = line.find('*/', index)
+                if end < 0:
+                    index = length
+                    break
+                in_comment = False
+                index = end + 2
+                continue
+            if quote:
+                char = line[index]
+                if char == '\\' and quote != '`':
+                    buffer.append(line[index:index + 2])
+                    index += 2
+                    continue
+                buffer.append(char)
+                if char == quote:
+                    quote = None
+                index += 1
+                continue
+            char = line[index]
+            if char in _QUOTES:
+                quote = char
+                buffer.append(char)
+                index += 1
+            elif line.startswith(delimiter, index):
+                statement = ''.join(buffer).strip()
+                buffer = []
+                index += len(delimiter)
+                if statement:
+                    yield statement, read_bytes
+            elif char == '#' or (line.startswith('--', index) and (index + 2 >= length or line[index + 2].isspace())):
+                # 行注释
+                buffer.append('\n')
+                break
+            elif line.startswith('/*', index) and not line.startswith('/*!', index):
+                in_comment = True
+                index += 2
+            else:
+                match = plain.match(line, index)
+                if match:
+                    buffer.append(match.group(0))
+                    index = match.end()
+                else:
+                    buffer.append(char)
+                    index += 1
+    statement = ''.join(buffer).strip()
+    if statement:
+        yield statement, read_bytes
+
+
+def encode_statement(statement) -> bytes:
+    """
+    语句还原为文件中的原始字节(与 mysql 命令行一样原样发送，二进制字段的字节不会被改变)
+    :param statement: split_sql_statements 拆分的语句
+    :return: bytes
+    """
+    return statement.encode('utf-8', 'surrogateescape')
+
+
+def get_statement_table(statement):
+    """
+    语句操作的表, 用于把同一个表的语句分到同一组按顺序执行
+    :param statement: sql语句
+    :return: 表名(包含数据库时为 数据库.表), 不是单表语句返回None
+    """
+    match = _TABLE_STATEMENT.match(statement)
+    if not match:
+        return None
+    return re.sub(r'[`\s]', '', match.group(1)).lower()
+
+
+class SqlFileImporter:
+    """
+    sql文件导入
+    按语句拆分文件，同一个表的建表、写入语句按原顺序在同一个连接中执行，不同表的语句分组后在有界的连接池中并行执行。
+    SET 会话设置在每个连接上重放，其他语句(建库、视图、存储过程、触发器等)作为屏障，等待之前的语句全部完成后单独执行
+    """
+
+    def __init__(self, mysql: Mysql, workers=4, group_bytes=64 * 1024 * 1024):
+        """
+        :param mysql: 目标库
+        :param workers: 并发连接数
+        :param group_bytes: 单个分组的最大字节数, 大表的写入语句拆分为多个分组(按顺序执行)，避免全部读入内存
+        """
+        self.mysql = mysql
+        self.workers = max(1, workers)
+        self.group_bytes = group_bytes
+
+    def _execute(self, database, session_sqls, statements, previous=None):
+        """
+        在一个连接中按顺序执行一组语句并提交
+        :param previous: 同一个表的上一个分组, 等待其完成后再执行
+        :return: 执行的语句数量
+        """
+        if previous is not None:
+            previous.result()
+        conn = self.mysql.get_engine().raw_connection()
+        try:
+            cursor = conn.cursor()
+            if database:
+                cursor.execute(encode_statement(f'USE `{database}`'))
+            for sql in session_sqls:
+                cursor.execute(encode_statement(sql))
+            for statement in statements:
+                try:
+                    # 不传参数，语句中的 % 不会被当作占位符
+                    cursor.execute(encode_statement(statement))
+                except BaseException as e:
+                    raise ImportError(f'{repr(e)} 语句: {statement[:200]!r}') from e
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return len(statements)
+
+    def import_file(self, sql_file, database=None) -> int:
+        """
+        导入sql文件
+        :param sql_file: sql文件
+        :param database: 默认数据库
+        :return: 执行的语句数量
+        """
+        total_bytes = os.path.getsize(sql_file)
+        sql_bar = tqdm(total=total_bytes, unit='B', unit_scale=True, desc=f'导入 {os.path.basename(sql_file)}')
+        session_sqls = []
+        # 每个表最后提交的分组, 同一个表的分组按顺序执行
+        table_futures = {}
+        futures = set()
+        # 最多同时在内存中的分组数量
+        slots = BoundedSemaphore(self.workers * 2)
+        # 分组开始时的会话设置快照, 之后读到的设置不会影响已经开始的分组
+        current = {'table': None, 'session': [], 'statements': [], 'bytes': 0}
+        executed = 0
+        read_bytes = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+            def collect(block=False):
+                nonlocal executed
+                if not futures:
+                    return
+                done, _ = wait(list(futures), return_when=ALL_COMPLETED if block else FIRST_COMPLETED)
+                for future in done:
+                    futures.discard(future)
+                    executed += future.result()
+
+            def flush():
+                if not current['statements']:
+                    return
+                slots.acquire()
+                table = current['table']
+                future = pool.submit(self._execute, database, current['session'], current['statements'],
+                                     table_futures.get(table))
+                future.add_done_callback(lambda _: slots.release())
+                table_futures[table] = future
+                futures.add(future)
+                current.update(table=None, session=[], statements=[], bytes=0)
+
+            try:
+                with open(sql_file, 'rb') as f:
+                    for statement, position in split_sql_statements(f):
+                        sql_bar.update(position - read_bytes)
+                        read_bytes = position
+                        sql_bar.set_postfix(statements=executed, refresh=False)
+                        if _SKIP_STATEMENT.match(statement):
+                            continue
+                        if _SESSION_STATEMENT.match(statement):
+                            # mysqldump 每个表前后重复相同的设置，只保留一次
+                            if not _RESTORE_STATEMENT.match(statement) and statement not in session_sqls:
+                                # 之后的语句使用新的设置, 当前分组先提交
+                                flush()
+                                session_sqls.append(statement)
+                            continue
+                        table = get_statement_table(statement)
+                        if table is None:
+                            # 屏障语句: 等待之前的分组全部完成后单独执行
+                            flush()
+                            collect(block=True)
+                            table_futures.clear()
+                            use = _USE_STATEMENT.match(statement)
+                            if use:
+                                database = use.group(1)
+                            else:
+                                executed += self._execute(database, session_sqls, [statement])
+                            continue
+                        if table != current['table'] or current['bytes'] >= self.group_bytes:
+                            flush()
+                            current.update(table=table, session=list(session_sqls))
+                        current['statements'].append(statement)
+                        current['bytes'] += len(statement)
+                        # 及时检查已完成的分组，出错时尽早停止
+                        if futures and any(future.done() for future in futures):
+                            collect()
+                flush()
+                collect(block=True)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                sql_bar.update(total_bytes - read_bytes)
+                sql_bar.set_postfix(statements=executed)
+                sql_bar.close()
+        logger.info(f'【{sql_file}】导入完成，共执行 {executed} 条语句')
+        return executed
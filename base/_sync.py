@@ -1,15 +1,34 @@
+from __future__ import annotations
+
 import concurrent
 import os
+import shutil
 from concurrent.futures import as_completed
+from typing import TYPE_CHECKING
 
-from pandas import DataFrame
 from pymysql import DatabaseError, MySQLError
-from tqdm import tqdm
 
+from base._ddl import DdlCache, read_bundle_schema
 from base._export import ExportInterface
 from base._import import ImportInterface
-from base._sink import Mysql
-from base._utils import logger
+from base._index import IndexRestorer
+from base._memory import get_memory_governor
+from base._profile import profiled, timer
+from base._retry import retry_call
+from base._sink import Mysql, Csv, parse_sql_constant, get_pushdown_columns, and_conditions, get_upsert_method
+from base._upsert import select_business_key, delete_absent_rows
+from base._utils import logger, tqdm, replace_bit_bytes, get_config
+from base._verify import TableVerifier
+from base._writer import TableWriter
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+class SyncCancelledError(Exception):
+    """
+    同步已取消(比如分布式任务的租约已丢失，表已被其他进程接手)
+    """
 
 
 class BaseSync(ExportInterface, ImportInterface):
@@ -17,11 +36,40 @@ class BaseSync(ExportInterface, ImportInterface):
     同步基类
     """
 
-    def __init__(self, source: Mysql, target: Mysql, databases: list, max_workers=8):
+    def __init__(self, source: Mysql, target: Mysql, databases: list, max_workers=8, index_workers=2,
+                 native_dump=None, table_writers=2, raw_lane=True):
         self.source = source
         self.target = target
         self.databases = databases
         self.max_workers = max_workers
+        # 源和目标是不同实例时使用 mysqldump | mysql 管道同步, 默认读取 config.ini 中 [sync] native_dump，默认关闭
+        if native_dump is None:
+            native_dump = get_config().getboolean('sync', 'native_dump', fallback=False)
+        self.native_dump = native_dump
+        # 本次同步跳过的平台表 [(database, table, 行数)]
+        self.skipped_tables = []
+        # 本次同步失败的表 [(database, table, 错误信息)]
+        self.failed_tables = []
+        # 单表最多的并发写入连接数
+        self.table_writers = table_writers
+        # 字段转换都是常量的表不经过pandas，直接读写原始行
+        self.raw_lane = raw_lane
+        # 源表数据量 {(database, table): 字节数}
+        self._table_sizes = {}
+        # 按表结构指纹缓存建表语句，并生成 sqls/create/{database}.sql
+        self.ddl_cache = DdlCache(source)
+        # 索引延迟到数据同步完成后，由独立线程池重建
+        self.index_restorer = IndexRestorer(target, max_workers=index_workers)
+        # 设置后停止写入当前同步的表(threading.Event), 分布式同步在租约丢失时设置
+        self.cancel_event = None
+
+    def get_target_database(self, database):
+        """
+        源库对应的目标库名，默认同名。源和目标是同一个实例时(比如在同一实例上搭建租户沙箱)需要重写
+        :param database: 源数据库
+        :return: 目标数据库
+        """
+        return database
 
     def __create_database_if_not_exists(self, database):
         """
@@ -30,9 +78,11 @@ class BaseSync(ExportInterface, ImportInterface):
         :return:
         """
         try:
-            if not self.target.exists_database(database):
+            target_database = self.get_target_database(database)
+            if not self.target.exists_database(target_database):
                 db_create_sql = self.source.get_database_create_sql(database)
-                db_create_sql = db_create_sql.replace('CREATE DATABASE', 'CREATE DATABASE IF NOT EXISTS')
+                db_create_sql = db_create_sql.replace(f'CREATE DATABASE `{database}`',
+                                                      f'CREATE DATABASE IF NOT EXISTS `{target_database}`')
                 self.target.execute_update(db_create_sql)
         except BaseException as e:
             raise DatabaseError(f'【{database}】错误: {repr(e)}')
@@ -45,53 +95,288 @@ class BaseSync(ExportInterface, ImportInterface):
         :return:
         """
         try:
-            # 如果文件存在则使用sql文件创建
-            create_tables_sql_file = os.path.join('sqls', 'create', f'{database}.sql')
-            if os.path.exists(create_tables_sql_file):
-                self.target.import_sql_file(create_tables_sql_file, database)
-            else:
-                # 重建目标表
-                table_create_sqls = []
-                for table in tables:
-                    if not self.table_ddl_match_filter(database, table):
-                        continue
-                    if not self.target.exists_table(database, table):
-                        create_sql = self.source.get_table_create_sql(table, database)
-                        create_sql = create_sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS')
-                        create_sql = create_sql.replace('utf8mb4_0900_ai_ci', 'utf8mb4_general_ci')
-                        create_sql = create_sql.replace('ROW_FORMAT=COMPACT', '')
-                        table_create_sqls.append(create_sql)
-                if len(table_create_sqls) > 0:
-                    self.target.execute_updates(table_create_sqls, database, f'【{database}】创建目标表...')
+            target_database = self.get_target_database(database)
+            # 如果存在手工维护的sql文件则使用sql文件创建
+            create_tables_sql_file = self.ddl_cache.get_bundle_file(database)
+            if read_bundle_schema(create_tables_sql_file) is False:
+                self.target.import_sql_file(create_tables_sql_file, target_database)
+                return
+            tables = [table for table in tables if self.table_ddl_match_filter(database, table)]
+            # 目标表都已存在时不需要建表
+            target_tables = set(self.target.list_tables(target_database))
+            if all(table in target_tables for table in tables):
+                return
+            # 按缓存的建表语句生成sql文件(只有结构变化的表重新读取)，一次创建所有缺少的表
+            create_tables_sql_file = self.ddl_cache.build_bundle(database, tables)
+            self.target.import_sql_file(create_tables_sql_file, target_database)
         except BaseException as e:
             raise MySQLError(f'create error: 【{database}】 {repr(e)}')
 
-    def return_before_handle_data(self, database, table):
+    def return_before_handle_data(self, database, table, incoming_rows=None, target_rows=None):
         """
-        数据前置处理器
+        数据前置处理器, 按写入量与目标表数据量决定是否删除索引
         :param database:
         :param table:
-        :return:
+        :param incoming_rows: 预估写入的行数, None时总是删除索引
+        :param target_rows: 目标表写入前的行数, 默认按表统计信息预估
+        :return: 索引恢复语句
         """
-        # 记录索引
-        index_alert_sqls = self.target.get_table_index_alert_sqls(database, table)
-        # 导入前删除索引
-        index_drop_sqls = self.target.get_table_index_drop_sql(database, table)
-        if index_drop_sqls:
-            for index_drop in index_drop_sqls:
-                self.target.execute_update(index_drop, database=database)
-        return index_alert_sqls
+        return self.index_restorer.prepare(self.get_target_database(database), table, incoming_rows, target_rows)
 
     def after_handle_data(self, database, table, before_return_result):
-        # 导入后恢复索引
-        if before_return_result:
-            for index_alert in before_return_result:
-                self.target.execute_update(index_alert, database)
-        pass
+        """
+        数据后置处理器, 登记索引恢复语句，待所有表数据同步完成后统一重建
+        :param database:
+        :param table:
+        :param before_return_result: 前置处理器的返回结果
+        :return:
+        """
+        self.index_restorer.add(self.get_target_database(database), table, before_return_result)
 
+    def _get_insert_select_columns(self, database, table):
+        """
+        获取同实例 INSERT ... SELECT 的写入字段及对应的查询表达式
+        :param database: 数据库
+        :param table: 表
+        :return: (写入字段列表, 查询表达式列表)
+        """
+        overrides = self.column_overrides(database, table, True) or {}
+        columns = self.source.get_table_column_names(database, table)
+        select_columns = [f'{overrides[column]} AS `{column}`' if column in overrides else f'`{column}`'
+                          for column in columns]
+        return columns, select_columns
+
+    def get_staging_database(self, database):
+        """
+        有字段覆盖的表使用 mysqldump 同步时，目标实例上的暂存库
+        :param database: 目标数据库
+        :return: 暂存库名
+        """
+        return f'{database}__dump'
+
+    def _dump_table(self, database, table, where, upsert_keys, staging):
+        """
+        使用 mysqldump | mysql 管道同步表数据
+        :param database: 源数据库
+        :param table: 表
+        :param where: 源表过滤条件
+        :param upsert_keys: upsert 写入时重复不更新的字段
+        :param staging: 有字段覆盖，先原样写入暂存表，再在目标实例上按覆盖规则 INSERT ... SELECT
+        :return:
+        """
+        target_database = self.get_target_database(database)
+        if not staging:
+            self.source.dump_table_to(self.target, database, table, where=where, target_database=target_database,
+                                      replace=bool(upsert_keys))
+            return
+        staging_database = self.get_staging_database(target_database)
+        self.target.execute_update(f'CREATE DATABASE IF NOT EXISTS `{staging_database}`')
+        self.target.execute_update(f'DROP TABLE IF EXISTS `{staging_database}`.`{table}`')
+        self.target.execute_update(f'CREATE TABLE `{staging_database}`.`{table}` LIKE `{target_database}`.`{table}`')
+        try:
+            self.source.dump_table_to(self.target, database, table, where=where, target_database=staging_database)
+            self._check_cancelled(database, table)
+            rows = self.target.insert_select_by_pk_range(staging_database, table, target_database, table,
+                                                         *self._get_insert_select_columns(database, table),
+                                                         upsert_keys=upsert_keys)
+            logger.info(f'\r\t【{database}.{table}】mysqldump暂存后写入 {rows} 条')
+        finally:
+            self.target.execute_update(f'DROP TABLE IF EXISTS `{staging_database}`.`{table}`')
+
+    def _get_raw_lane_columns(self, database, table):
+        """
+        不经过pandas同步时的读取字段、写入字段及常量值, 字段覆盖规则中有非常量表达式时返回None
+        :param database: 数据库
+        :param table: 表
+        :return: (读取字段列表, 写入字段列表, 追加到每行末尾的常量tuple) 或 None
+        """
+        overrides = self.column_overrides(database, table, True) or {}
+        columns = self.source.get_table_column_names(database, table)
+        select_columns = [column for column in columns if column not in overrides]
+        constant_columns = []
+        constants = []
+        for column in columns:
+            if column not in overrides:
+                continue
+            is_constant, value = parse_sql_constant(overrides[column])
+            if not is_constant:
+                return None
+            constant_columns.append(column)
+            constants.append(value)
+        # 覆盖的字段放在写入字段的末尾，每行只需要拼接一次常量
+        return select_columns, select_columns + constant_columns, tuple(constants)
+
+    def _check_cancelled(self, database, table):
+        """
+        同步已取消时抛出异常，停止读取及写入
+        :param database: 数据库
+        :param table: 表
+        :return:
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise SyncCancelledError(f'【{database}.{table}】同步已取消')
+
+    def get_business_key(self, database, table):
+        """
+        upsert 同步的业务键, 默认使用目标表第一个不包含被覆盖字段的唯一索引(主键优先)
+        子类可以重写声明业务键: 目标表上必须有对应的唯一索引，且不能包含 chunk_wrapper 会修改的字段
+        :param database: 数据库
+        :param table: 表
+        :return: 字段列表, 没有可用的业务键返回None(回退为先删除再写入)
+        """
+        overrides = self.column_overrides(database, table, True) or {}
+        unique_keys = self.target.get_table_unique_keys(self.get_target_database(database), table)
+        return select_business_key(unique_keys, overrides)
+
+    def get_table_writers(self, database, table):
+        """
+        单表并发写入的连接数, 默认源表每256M数据一个连接，最多 table_writers 个
+        :param database: 数据库
+        :param table: 表
+        :return: 连接数
+        """
+        size = self._table_sizes.get((database, table), 0)
+        return max(1, min(self.table_writers, 1 + size // (256 * 1024 * 1024)))
+
+    def _is_platform_table_unchanged(self, database, table):
+        """
+        比较源和目标平台表的数据校验值，判断是否无需同步
+        没有字段覆盖时比较 CHECKSUM TABLE，否则只比较未被覆盖的字段
+        :param database: 数据库
+        :param table: 表
+        :return: (是否一致, 源表行数)
+        """
+        # chunk_wrapper 的处理无法用sql描述或者源表有行过滤条件时，无法判断目标数据是否等价
+        if not self.is_sql_expressible(database, table, True) or self.row_predicate(database, table, True):
+            return False, 0
+        target_database = self.get_target_database(database)
+        columns = self.source.get_table_column_names(database, table)
+        overrides = self.column_overrides(database, table, True) or {}
+        compare_columns = None
+        if set(overrides).intersection(columns):
+            compare_columns = [column for column in columns if column not in overrides]
+        try:
+            source_checksum = self.source.get_table_checksum(database, table, compare_columns)
+            target_checksum = self.target.get_table_checksum(target_database, table, compare_columns)
+        except BaseException as e:
+            # 目标表结构不一致等情况，视为需要同步
+            logger.warning(f'【{database}.{table}】校验值比较失败: {repr(e)}')
+            return False, 0
+        return source_checksum == target_checksum, source_checksum[0]
+
+    def _estimate_incoming_rows(self, database, table, condition=None):
+        """
+        预估本次同步写入目标表的行数
+        :param database: 数据库
+        :param table: 表
+        :param condition: 源表过滤条件
+        :return: 行数
+        """
+        if not condition:
+            return self.source.get_table_rows_estimate(database, table)
+        return self.source.execute_query(f'select count(0) from `{database}`.`{table}` where {condition}').scalar()
+
+    def _verify_target_rows(self, database, table, exists_ent_code_column, ent_codes, rows):
+        """
+        目标表数据已清空后重新写入时，校验目标表最终的数据量与写入数量一致
+        :param database: 数据库
+        :param table: 表
+        :param exists_ent_code_column: 是否是租户表
+        :param ent_codes: 账套编号列表
+        :param rows: 写入数量
+        :return:
+        """
+        target_database = self.get_target_database(database)
+        count_sql = f'select count(0) from `{target_database}`.`{table}`'
+        if exists_ent_code_column:
+            ent_codes_in = ', '.join(f"'{ent_code}'" for ent_code in ent_codes)
+            count_sql = f'{count_sql} where ent_code IN ({ent_codes_in})'
+        count = self.target.execute_query(count_sql).scalar()
+        if count != rows:
+            raise ValueError(f'【{database}.{table}】目标表数据量 {count} 与写入数量 {rows} 不一致')
+
+    def _delete_absent_rows(self, database, table, business_key, exists_ent_code_column, ent_codes, predicate=None):
+        """
+        upsert 写入完成后，按业务键分批反连接删除目标表中源已不存在(或者不再满足行过滤条件)的行
+        :param database: 数据库
+        :param table: 表
+        :param business_key: 业务键字段列表
+        :param exists_ent_code_column: 是否是租户表
+        :param ent_codes: 账套编号列表
+        :param predicate: 源表行过滤条件
+        :return:
+        """
+        target_database = self.get_target_database(database)
+        if not exists_ent_code_column:
+            self._check_cancelled(database, table)
+            deleted = delete_absent_rows(self.source, self.target, database, table, business_key,
+                                         target_database=target_database, source_condition=predicate)
+            logger.info(f'\r\t【{database}.{table}】删除源中已不存在的数据 {deleted} 条')
+            return
+        for ent_code in ent_codes:
+            self._check_cancelled(database, table)
+            condition = f"ent_code = '{ent_code}'"
+            deleted = delete_absent_rows(self.source, self.target, database, table, business_key,
+                                         target_database=target_database,
+                                         source_condition=and_conditions(condition, predicate),
+                                         target_condition=condition)
+            logger.info(f'\r\t【{database}.{table}】【{ent_code}】删除源中已不存在的数据 {deleted} 条')
+
+    def _get_verify_columns(self, database, table):
+        """
+        参与校验值计算的字段: 源和目标共有的字段，排除被转换的字段
+        :param database: 数据库
+        :param table: 表
+        :return: 字段列表, chunk_wrapper 的处理无法用sql描述时返回None(只比较行数)
+        """
+        if not self.is_sql_expressible(database, table, True):
+            return None
+        overrides = self.column_overrides(database, table, True) or {}
+        target_columns = set(self.target.get_table_column_names(self.get_target_database(database), table))
+        return [column for column in self.source.get_table_column_names(database, table)
+                if column in target_columns and column not in overrides]
+
+    def verify_parallel(self, ent_codes, checksum=True, sync_platform_data=True, sync_tenant_data=True) -> list[dict]:
+        """
+        并行校验源和目标的数据: 平台表比较全表，租户表按账套比较行数及未被转换字段的校验值
+        :param ent_codes: 账套列表
+        :param checksum: 是否比较校验值, False时只比较行数
+        :param sync_platform_data: 是否校验平台表
+        :param sync_tenant_data: 是否校验租户表
+        :return: 不一致或者校验失败的结果列表
+        """
+        tenant_tables = set((database, table) for database, table, _ in
+                            self.source.list_tables_with_column(self.databases, 'ent_code'))
+        debug_table = self.single_table_for_debug()
+        tasks = []
+        for database in self.databases:
+            target_database = self.get_target_database(database)
+            for table in self.source.list_tables(database=database):
+                if debug_table and table != debug_table:
+                    continue
+                if self.table_data_match_filter and not self.table_data_match_filter(database, table):
+                    continue
+                is_tenant_table = (database, table) in tenant_tables
+                if (is_tenant_table and not sync_tenant_data) or (not is_tenant_table and not sync_platform_data):
+                    continue
+                predicate = self.row_predicate(database, table, True)
+                columns = self._get_verify_columns(database, table) if checksum else None
+                task = dict(database=database, table=table, target_database=target_database, columns=columns)
+                if not is_tenant_table:
+                    tasks.append({**task, 'source_condition': predicate})
+                    continue
+                for ent_code in ent_codes:
+                    condition = f"ent_code = '{ent_code}'"
+                    tasks.append({**task, 'ent_code': ent_code, 'source_condition': and_conditions(condition, predicate),
+                                  'target_condition': condition})
+
+        verifier = TableVerifier(self.source, self.target, max_workers=self.max_workers)
+        return verifier.verify_parallel(tasks, desc=f'实例【{self.get_name()}】的数据校验进度')
+
+    @profiled
     def _sync_database_table(self, database, table, ent_codes, test_data=False, delete_data=False,
                              sync_platform_data=True,
-                             sync_tenant_data=True):
+                             sync_tenant_data=True, tee_dumps_folder=None, upsert=False, skip_unchanged=False):
         """
         同步源库下的表数据到目标库下
         :param database: 数据库
@@ -101,6 +386,10 @@ class BaseSync(ExportInterface, ImportInterface):
         :param delete_data: 是否删除原有的租户数据或者平台数据
         :param sync_platform_data: 是否同步平台表数据
         :param sync_tenant_data: 是否同步租户数据
+        :param tee_dumps_folder: 同时把读取到的数据按导出格式写入该目录下的csv
+        :param upsert: 按业务键 INSERT ... ON DUPLICATE KEY UPDATE 写入，删除数据时只删除源中已不存在的行，
+                       没有业务键的表回退为先删除再写入
+        :param skip_unchanged: 平台表源和目标的行数及校验值一致时跳过同步(不再清空重写)
         :return:
         """
         # 调试模式，单独只导入某一个表
@@ -125,57 +414,201 @@ class BaseSync(ExportInterface, ImportInterface):
         if not sync_tenant_data and exists_ent_code_column:
             return
 
-        # 前置处理器获取目标表的索引
-        index_alert_sqls = self.return_before_handle_data(database, table)
+        target_database = self.get_target_database(database)
+
+        # 平台表数据未变化时不再清空重写
+        if skip_unchanged and not exists_ent_code_column and not test_data and not tee_dumps_folder:
+            unchanged, rows = self._is_platform_table_unchanged(database, table)
+            if unchanged:
+                logger.info(f'\r\t【{database}.{table}】数据一致，跳过同步')
+                self.skipped_tables.append((database, table, rows))
+                return
+
+        insert_select = None
+        native_dump = False
+        dump_staging = False
+        raw_lane = None
+        # 同时写csv时数据必须经过python
+        if not test_data and not tee_dumps_folder and self.is_sql_expressible(database, table, True):
+            if self.source.is_same_server(self.target):
+                # 同一个实例且转换规则都可以用sql表达时，直接在服务端 INSERT ... SELECT，数据不经过python
+                insert_select = self._get_insert_select_columns(database, table)
+            elif self.native_dump:
+                # mysqldump 无法转换字段，有字段覆盖的表先原样写入目标实例的暂存表，再在目标实例上按覆盖规则 INSERT ... SELECT
+                columns = self.source.get_table_column_names(database, table)
+                overrides = self.column_overrides(database, table, True) or {}
+                native_dump = True
+                dump_staging = bool(set(overrides).intersection(columns))
+            if not insert_select and not native_dump and self.raw_lane:
+                # 转换规则都是常量时，原始行直接写入，不经过pandas
+                raw_lane = self._get_raw_lane_columns(database, table)
+
+        # upsert 写入时与已有行重复不更新业务键及主键(主键可能是目标库自增生成的)
+        upsert_keys = None
+        business_key = self.get_business_key(database, table) if upsert and not test_data else None
+        if business_key:
+            upsert_keys = business_key + [column for column in
+                                          self.target.get_table_primary_key(target_database, table)
+                                          if column not in business_key]
+        elif upsert and not test_data:
+            logger.info(f'\r\t【{database}.{table}】没有可用的业务键，先删除再写入')
+
+        # 行过滤条件及常量覆盖的字段下推到源查询中
+        predicate = self.row_predicate(database, table, True)
+        pushdown_columns = None
+        if not insert_select and not native_dump and not raw_lane:
+            columns = self.source.get_table_column_names(database, table)
+            pushdown_columns = get_pushdown_columns(columns, self.column_overrides(database, table, True) or {})
+
+        # 前置处理器按写入量决定是否删除目标表的索引
+        if test_data:
+            incoming_rows = 10
+        elif exists_ent_code_column:
+            ent_codes_in = ', '.join(f"'{ent_code}'" for ent_code in ent_codes)
+            incoming_rows = self._estimate_incoming_rows(database, table,
+                                                         and_conditions(f'ent_code IN ({ent_codes_in})', predicate))
+        else:
+            incoming_rows = self._estimate_incoming_rows(database, table, predicate)
+        # 平台表会先清空
+        target_rows = 0 if delete_data and not exists_ent_code_column and not test_data else None
+        # upsert 依赖业务键的唯一索引识别重复行，不删除索引
+        index_alert_sqls = None if upsert_keys else self.return_before_handle_data(database, table, incoming_rows,
+                                                                                    target_rows)
+
+        tee_csv_file = None
+        if tee_dumps_folder:
+            tee_csv_file = os.path.join(tee_dumps_folder, database, f'{table}.csv')
+            if os.path.exists(tee_csv_file):
+                os.remove(tee_csv_file)
+        csv = Csv()
+
+        upsert_method = get_upsert_method(upsert_keys) if upsert_keys else None
+
+        # 写入线程: 每批在一个事务中写入，失败时整批重试
+        def write_chunk(chunk: DataFrame):
+            self._check_cancelled(database, table)
+            with timer('to_sql'):
+                retry_call(chunk.to_sql, table, schema=target_database, con=self.target.get_engine(),
+                           if_exists='append', index=False, method=upsert_method, desc=f'{database}.{table} 写入')
+            return len(chunk)
+
+        # 只有经过python写入时才需要多个写入连接
+        writers = 1 if insert_select or native_dump or test_data else self.get_table_writers(database, table)
+        if raw_lane:
+            select_columns, insert_columns, constants = raw_lane
+            row_bytes = self.source.estimate_chunk_bytes(database, table, 1)
+
+            # 原始行拼接覆盖字段的常量后写入
+            def write_rows(rows):
+                self._check_cancelled(database, table)
+                if constants:
+                    rows = [row + constants for row in rows]
+                with timer('insert_rows'):
+                    return retry_call(self.target.insert_rows, target_database, table, insert_columns, rows,
+                                      upsert_keys=upsert_keys, desc=f'{database}.{table} 写入')
+
+            writer = TableWriter(write_rows, workers=writers, desc=f'{database}.{table}')
+
+            def from_rows_to_target_table(rows):
+                self._check_cancelled(database, table)
+                writer.submit(rows, nbytes=len(rows) * row_bytes)
+        else:
+            writer = TableWriter(write_chunk, workers=writers, desc=f'{database}.{table}')
 
         # 读取到数据分批写入到目标表
         def from_chunk_to_target_table(chunk: DataFrame):
-            chunk = self.chunk_wrapper(chunk, database, table, True)
+            self._check_cancelled(database, table)
+            # 同一次读取的数据, 先按导出格式(未经过chunk_wrapper)追加到csv
+            if tee_csv_file and len(chunk) > 0:
+                with timer('to_csv'):
+                    csv.append_dataframe_to_csv(replace_bit_bytes(chunk) if exists_ent_code_column else chunk,
+                                                tee_csv_file)
+            with timer('chunk_wrapper'):
+                chunk = self.chunk_wrapper(chunk, database, table, True)
             if len(chunk) > 0:
-                chunk.to_sql(table, schema=database, con=self.target.get_engine(), if_exists='append',
-                             index=False)
-            pass
+                writer.submit(chunk)
 
-        # 测试的话，只同步前10条记录
-        if test_data:
-            query_sql = f"/** 导出数据 **/ select * from `{database}`.`{table}` limit 10"
-            self.source.from_sql_to_call_no_processor(query_sql, from_chunk_to_target_table, database=database)
-        else:
-            # 不包含ent_code字段，则导出全表， 否则导出ent_code条件内数据
-            if not exists_ent_code_column:
-                if delete_data:
-                    self.target.execute_update(f'truncate table `{database}`.`{table}`', database=database)
-                self.source.from_table_to_call_no_processor(database, table, from_chunk_to_target_table)
+        try:
+            # 测试的话，只同步前10条记录
+            if test_data:
+                query_sql = f"/** 导出数据 **/ select * from `{database}`.`{table}` limit 10"
+                self.source.from_sql_to_call_no_processor(query_sql, from_chunk_to_target_table, database=database)
             else:
-                for ent_code in ent_codes:
-                    if delete_data:
-                        self.target.execute_update(f"delete from `{database}`.`{table}` where ent_code = '{ent_code}'",
-                                                   database=database)
-                    query_sql = f"/** 导出数据 **/ select * from `{database}`.`{table}` where ent_code = '{ent_code}'"
-                    self.source.from_sql_to_call_no_processor(query_sql, from_chunk_to_target_table, database=database)
-
-        self.after_handle_data(database, table, index_alert_sqls)
-        pass
+                # 不包含ent_code字段，则导出全表， 否则导出ent_code条件内数据
+                if not exists_ent_code_column:
+                    self._check_cancelled(database, table)
+                    if delete_data and not upsert_keys:
+                        self.target.execute_update(f'truncate table `{target_database}`.`{table}`',
+                                                   database=target_database)
+                    if insert_select:
+                        rows = self.target.insert_select_by_pk_range(database, table, target_database, table,
+                                                                     *insert_select, condition=predicate,
+                                                                     upsert_keys=upsert_keys)
+                        logger.info(f'\r\t【{database}.{table}】同实例INSERT ... SELECT写入 {rows} 条')
+                    elif native_dump:
+                        self._dump_table(database, table, predicate, upsert_keys, dump_staging)
+                    elif raw_lane:
+                        self.source.from_table_to_rows_call(database, table, select_columns, from_rows_to_target_table,
+                                                            condition=predicate)
+                    else:
+                        self.source.from_table_to_call_by_key(database, table, from_chunk_to_target_table,
+                                                              condition=predicate, columns=pushdown_columns)
+                else:
+                    if delete_data and not upsert_keys:
+                        for ent_code in ent_codes:
+                            self._check_cancelled(database, table)
+                            self.target.execute_update(
+                                f"delete from `{target_database}`.`{table}` where ent_code = '{ent_code}'",
+                                database=target_database)
+                    if native_dump:
+                        self._check_cancelled(database, table)
+                        ent_codes_in = ', '.join(f"'{ent_code}'" for ent_code in ent_codes)
+                        self._dump_table(database, table, and_conditions(f'ent_code IN ({ent_codes_in})', predicate),
+                                         upsert_keys, dump_staging)
+                    else:
+                        for ent_code in ent_codes:
+                            self._check_cancelled(database, table)
+                            condition = and_conditions(f"ent_code = '{ent_code}'", predicate)
+                            if insert_select:
+                                rows = self.target.insert_select_by_pk_range(database, table, target_database, table,
+                                                                             *insert_select, condition=condition,
+                                                                             upsert_keys=upsert_keys)
+                                logger.info(f'\r\t【{database}.{table}】【{ent_code}】同实例INSERT ... SELECT写入 {rows} 条')
+                            elif raw_lane:
+                                self.source.from_table_to_rows_call(database, table, select_columns,
+                                                                    from_rows_to_target_table, condition=condition)
+                            else:
+                                self.source.from_table_to_call_by_key(database, table, from_chunk_to_target_table,
+                                                                      condition=condition, columns=pushdown_columns)
+            # 等待所有写入完成，写入出错或者数量不一致时抛出异常
+            rows = writer.close()
+            if upsert_keys and delete_data:
+                self._delete_absent_rows(database, table, business_key, exists_ent_code_column, ent_codes, predicate)
+            if writer.submitted_rows and delete_data and not test_data:
+                self._verify_target_rows(database, table, exists_ent_code_column, ent_codes, rows)
+        finally:
+            writer.close(raise_error=False)
+            # 即使同步失败也要登记索引恢复，避免目标表索引丢失
+            self.after_handle_data(database, table, index_alert_sqls)
 
-    def sync_parallel(self, ent_codes, test_data=False, delete_data=False, drop_database=False, sync_platform_data=True,
-                      sync_tenant_data=True):
+    def prepare_sync(self, drop_database=False, tee_dumps_folder=None) -> dict:
         """
-        并行同步实例下的多个数据库表数据
-        :param ent_codes: 账套列表
-        :param test_data: 测试模式 只同步前10条记录
-        :param delete_data: 是否删除原有的租户数据或者平台数据
+        同步前的准备工作: 创建目标库和表，重置导出快照目录
         :param drop_database: 是否删除数据库
-        :param sync_platform_data: 是否同步平台表数据
-        :param sync_tenant_data: 是否同步租户数据
-        :return:
+        :param tee_dumps_folder: 导出快照目录
+        :return: 源库的表 {database: [table]}
         """
-        tbl_count = 0
+        # 同一个实例下不能同步到源库本身
+        if self.source.is_same_server(self.target):
+            for database in self.databases:
+                if self.get_target_database(database) == database:
+                    raise ValueError(f'【{database}】源库和目标库是同一个实例下的同一个库，请重写 get_target_database 指定目标库')
+
         db_map = {}
         for database in self.databases:
             # 列出源库的所有数据表
             tables = self.source.list_tables(database=database)
             logger.info(f'{database} -> {tables}')
-            tbl_count += len(tables)
             db_map[f'{database}'] = tables
 
         for database in db_map.keys():
@@ -183,10 +616,46 @@ class BaseSync(ExportInterface, ImportInterface):
             if drop_database:
                 # 先重建目标数据库结构
                 logger.info(f'【{database}】删除重建。。。')
-                self.target.execute_update(f'drop database if exists {database}')
+                self.target.execute_update(f'drop database if exists {self.get_target_database(database)}')
             # 如果库或者表不存在则创建
             self.__create_database_if_not_exists(database)
             self.__create_database_tables_if_not_exists(database, db_map[database])
+            # 重置导出快照的数据库目录
+            if tee_dumps_folder:
+                database_folder = os.path.join(tee_dumps_folder, database)
+                if os.path.exists(database_folder):
+                    shutil.rmtree(database_folder)
+                os.makedirs(database_folder)
+        return db_map
+
+    def reset_sync_state(self):
+        """
+        重置本次同步的统计信息，并读取源表数据量用于决定单表的写入连接数
+        :return:
+        """
+        self.skipped_tables = []
+        self.failed_tables = []
+        self._table_sizes = self.source.get_tables_size(self.databases)
+
+    def sync_parallel(self, ent_codes, test_data=False, delete_data=False, drop_database=False, sync_platform_data=True,
+                      sync_tenant_data=True, tee_dumps_folder=None, verify=False, upsert=False, skip_unchanged=False):
+        """
+        并行同步实例下的多个数据库表数据
+        :param ent_codes: 账套列表
+        :param test_data: 测试模式 只同步前10条记录
+        :param delete_data: 是否删除原有的租户数据或者平台数据
+        :param drop_database: 是否删除数据库
+        :param sync_platform_data: 是否同步平台表数据
+        :param sync_tenant_data: 是否同步租户数据
+        :param tee_dumps_folder: 同步的同时把读取到的数据按导出格式写入该目录(只读一次源库，同时得到同步结果和导出快照)
+        :param verify: 同步完成后是否校验源和目标的行数及校验值
+        :param upsert: 按业务键 upsert 写入，删除数据时只删除源中已不存在的行，代替先删除再写入
+        :param skip_unchanged: 平台表源和目标的行数及校验值一致时跳过同步(不再清空重写)
+        :return: 校验不一致的结果列表(不校验时为空列表)
+        """
+        db_map = self.prepare_sync(drop_database=drop_database, tee_dumps_folder=tee_dumps_folder)
+        self.reset_sync_state()
+        tbl_count = sum(len(tables) for tables in db_map.values())
 
         # 同步数据
         import_bar = tqdm(total=tbl_count, desc=f'实例【{self.get_name()}】的多线程数据同步处理进度')
@@ -197,10 +666,13 @@ class BaseSync(ExportInterface, ImportInterface):
             def sync_database(database, table):
                 try:
                     # 开始同步数据
-                    self._sync_database_table(database, table, ent_codes, test_data=test_data,delete_data=delete_data,
-                                              sync_platform_data=sync_platform_data, sync_tenant_data=sync_tenant_data)
+                    self._sync_database_table(database, table, ent_codes, test_data=test_data, delete_data=delete_data,
+                                              sync_platform_data=sync_platform_data, sync_tenant_data=sync_tenant_data,
+                                              tee_dumps_folder=tee_dumps_folder, upsert=upsert,
+                                              skip_unchanged=skip_unchanged)
                 except BaseException as e:
                     logger.error(f'\r\t【{database}.{table} 表同步失败】{repr(e)}')
+                    self.failed_tables.append((database, table, repr(e)))
                 finally:
                     import_bar.update(1)
 
@@ -214,3 +686,23 @@ class BaseSync(ExportInterface, ImportInterface):
             pool.shutdown(True)
             # for future in as_completed(futures):  # 并发等待执行完成
             #     pass
+
+        # 数据同步完成后，统一重建索引
+        self.index_restorer.restore_parallel(desc=f'实例【{self.get_name()}】的索引重建进度')
+
+        get_memory_governor().report(desc=f'实例【{self.get_name()}】同步')
+
+        if self.skipped_tables:
+            logger.info(f'【实例 {self.get_name()} 数据一致跳过 {len(self.skipped_tables)} 个平台表，'
+                        f'共 {sum(rows for _, _, rows in self.skipped_tables)} 条】')
+
+        if self.failed_tables:
+            logger.error(f'【实例 {self.get_name()} 同步失败 {len(self.failed_tables)} 个表】')
+            for database, table, error in self.failed_tables:
+                logger.error(f'    {database}.{table}: {error}')
+
+        # 测试模式只同步了部分数据，不校验
+        if not verify or test_data:
+            return []
+        return self.verify_parallel(ent_codes, sync_platform_data=sync_platform_data,
+                                    sync_tenant_data=sync_tenant_data)
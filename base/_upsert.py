@@ -0,0 +1,113 @@
+from base._retry import retry_call
+from base._sink import Mysql, and_conditions
+
+
+def select_business_key(unique_keys, excluded_columns=()):
+    """
+    从唯一索引中选择 upsert 的业务键: 第一个不包含被转换字段的唯一索引(主键优先)
+    被转换的字段(例如置空后自增的id)在源和目标的值不同，不能用来识别同一行
+    :param unique_keys: 唯一索引的字段列表 [[字段]]
+    :param excluded_columns: 被转换的字段
+    :return: 字段列表, 没有可用的唯一索引返回None
+    """
+    for columns in unique_keys:
+        if columns and not set(columns).intersection(excluded_columns):
+            return list(columns)
+    return None
+
+
+def get_absent_keys_sql(database, table, key, keys, condition=None) -> tuple[str, dict]:
+    """
+    查询候选业务键中在表里不存在的序号, 比较在服务端进行，使用字段自身的排序规则(大小写、尾部空格、重音等)
+    :param database: 数据库
+    :param table: 表名
+    :param key: 业务键字段列表
+    :param keys: 候选业务键 [tuple]
+    :param condition: 表的过滤条件
+    :return: (sql, 参数) 查询结果为不存在的候选业务键序号
+    """
+    parameters = {}
+    rows = []
+    for row_index, values in enumerate(keys):
+        row_columns = [f'{row_index} AS `i`'] if row_index == 0 else [str(row_index)]
+        for column_index, value in enumerate(values):
+            name = f'k{row_index}_{column_index}'
+            parameters[name] = value
+            row_columns.append(f':{name} AS `c{column_index}`' if row_index == 0 else f':{name}')
+        rows.append(f"SELECT {', '.join(row_columns)}")
+    # 字段与参数比较时使用字段的排序规则
+    matches = ' and '.join(f'`s`.`{column}` = `k`.`c{index}`' for index, column in enumerate(key))
+    absent_sql = (f"select `k`.`i` from ({' UNION ALL '.join(rows)}) `k` where not exists "
+                  f"(select 1 from `{database}`.`{table}` `s` where {and_conditions(condition, matches)})")
+    return absent_sql, parameters
+
+
+def _key_in_condition(key, keys, prefix='k'):
+    """
+    业务键的 IN 条件及参数 例如: (`a`, `b`) IN ((:k0_0, :k0_1), (:k1_0, :k1_1))
+    """
+    parameters = {}
+    tuples = []
+    for row_index, values in enumerate(keys):
+        names = []
+        for column_index, value in enumerate(values):
+            name = f'{prefix}{row_index}_{column_index}'
+            parameters[name] = value
+            names.append(f':{name}')
+        tuples.append(f"({', '.join(names)})")
+    key_columns = ', '.join(f'`{column}`' for column in key)
+    return f"({key_columns}) IN ({', '.join(tuples)})", parameters
+
+
+def delete_absent_rows(source: Mysql, target: Mysql, database, table, key, target_database=None,
+                       source_condition=None, target_condition=None, chunksize=5000) -> int:
+    """
+    按业务键分批反连接，删除目标表中源表已不存在的行
+    按业务键顺序分页读取目标表的业务键，每页在源库上查询源表中没有匹配的业务键(按源表字段的排序规则比较)，只删除这些行
+    源和目标可以是不同的实例，每批只在内存中保留一页业务键
+    :param source: 源库
+    :param target: 目标库
+    :param database: 源数据库
+    :param table: 表名
+    :param key: 业务键字段列表
+    :param target_database: 目标数据库, 默认与源数据库同名
+    :param source_condition: 源表过滤条件(账套及行过滤条件)
+    :param target_condition: 目标表过滤条件(账套)
+    :param chunksize: 每批的业务键数量
+    :return: 删除的行数
+    """
+    target_database = target_database or database
+    key_columns = ', '.join(f'`{column}`' for column in key)
+    last_names = [f'last_{index}' for index in range(len(key))]
+    deleted = 0
+    last_key = None
+    while True:
+        # 业务键有唯一索引，按业务键分页不需要 OFFSET
+        where = target_condition
+        parameters = {}
+        if last_key is not None:
+            where = and_conditions(where, f"({key_columns}) > ({', '.join(f':{name}' for name in last_names)})")
+            parameters = dict(zip(last_names, last_key))
+        page_sql = (f"select {key_columns} from `{target_database}`.`{table}` where {where or '1=1'} "
+                    f"order by {key_columns} limit {chunksize}")
+        target_keys = [tuple(row) for row in retry_call(
+            lambda: target.execute_query(page_sql, parameters=parameters).fetchall(),
+            desc=f'{target_database}.{table} 读取业务键')]
+        if not target_keys:
+            return deleted
+
+        absent_sql, absent_parameters = get_absent_keys_sql(database, table, key, target_keys, source_condition)
+        absent_indexes = retry_call(lambda: source.execute_query(absent_sql, parameters=absent_parameters).fetchall(),
+                                    desc=f'{database}.{table} 读取业务键')
+        # 按目标表的原始值删除
+        absent_keys = [target_keys[row[0]] for row in absent_indexes]
+        if absent_keys:
+            in_condition, in_parameters = _key_in_condition(key, absent_keys)
+            delete_sql = (f"delete from `{target_database}`.`{table}` "
+                          f"where {and_conditions(target_condition, in_condition)}")
+            deleted += retry_call(target.execute_update, delete_sql, parameters=in_parameters,
+                                  desc=f'{target_database}.{table} 删除')
+
+        if len(target_keys) < chunksize:
+            return deleted
+        last_key = target_keys[-1]
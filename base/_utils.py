@@ -1,13 +1,19 @@
+from __future__ import annotations
+
+import functools
+import importlib
+import importlib.util
 import json
 import logging
 import os
 import time
 from configparser import ConfigParser
 from subprocess import Popen, PIPE, STDOUT
+from threading import Lock
+from typing import TYPE_CHECKING
 
-import pandas as pd
-from pandas import DataFrame
-from tqdm import tqdm
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
@@ -17,6 +23,41 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger()
 
 
+class LazyModule:
+    """
+    延迟导入的模块代理, 首次访问属性时才真正导入模块, 避免 pandas/sqlalchemy 等拖慢启动
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, item):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, item)
+
+
+def lazy_import(name) -> LazyModule:
+    """
+    延迟导入模块
+    :param name: 模块名 例如: pandas
+    :return: 模块代理对象
+    """
+    return LazyModule(name)
+
+
+pd = lazy_import('pandas')
+
+
+def tqdm(*args, **kwargs):
+    """
+    延迟导入的 tqdm 进度条
+    """
+    from tqdm import tqdm as _tqdm
+    return _tqdm(*args, **kwargs)
+
+
 class BColors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -114,20 +155,170 @@ def execute_command(cmd):
     return process, exitcode
 
 
+def replace_bit_bytes(df: DataFrame) -> DataFrame:
+    """
+    替换bit类型的 b'\x00' 值为0
+    只处理二进制字段，全部是单字节的字段(bit类型)整列转换，否则逐个取第一个字节
+    :param df: DataFrame
+    :return: 替换后的DataFrame
+    """
+    for column in df.columns:
+        series = df[column]
+        is_arrow_binary = isinstance(series.dtype, pd.ArrowDtype) and series.dtype.kind == 'O' and \
+            series.dtype.pyarrow_dtype in ('binary', 'large_binary')
+        if not is_arrow_binary and series.dtype != object:
+            continue
+        values = series.dropna()
+        if len(values) == 0 or (not is_arrow_binary and type(values.iloc[0]) is not bytes):
+            continue
+        bits = _single_bytes_to_ints(values)
+        if bits is None:
+            df[column] = series.map(lambda x: x[0] if type(x) is bytes else x)
+        else:
+            result = pd.Series(pd.NA, index=series.index, dtype='UInt8')
+            result[values.index] = bits
+            df[column] = result
+    return df
+
+
+def _single_bytes_to_ints(values):
+    """
+    单字节的二进制值整列转换为整数
+    :param values: 不包含空值的二进制Series
+    :return: numpy数组, 不全是单字节或者值不是bytes时返回None
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        return None
+    import numpy as np
+    import pyarrow
+    import pyarrow.compute as pc
+    try:
+        if isinstance(values.dtype, pd.ArrowDtype):
+            array = pyarrow.chunked_array(values.array._pa_array).combine_chunks()
+        else:
+            array = pyarrow.array(values.tolist(), type=pyarrow.binary())
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        return None
+    if not pc.all(pc.equal(pc.binary_length(array), 1)).as_py():
+        return None
+    array = pc.cast(array, pyarrow.binary(1))
+    return np.frombuffer(array.buffers()[1], dtype=np.uint8)[array.offset:array.offset + len(array)]
+
+
 def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
 
 
-config = ConfigParser()
 parent_dir = os.path.dirname(os.path.dirname(__file__))
-config.read(os.path.join(parent_dir, 'config.ini'))
+_config = None
+_config_lock = Lock()
+
 
-# 导出的csv临时目录
-dumps_folder = config.get('global', 'dumps_folder')
+def get_config() -> ConfigParser:
+    """
+    读取根目录下的 config.ini, 首次使用时才加载
+    :return: ConfigParser
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            parser = ConfigParser()
+            parser.read(os.path.join(parent_dir, 'config.ini'))
+            _config = parser
+    return _config
+
+
+def __getattr__(name):
+    # config 和 dumps_folder 延迟到首次使用时读取
+    if name == 'config':
+        return get_config()
+    if name == 'dumps_folder':
+        # 导出的csv临时目录
+        return get_config().get('global', 'dumps_folder', fallback='dumps')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+@functools.lru_cache(maxsize=None)
+def get_dtype_backend():
+    """
+    读取数据时DataFrame使用的类型后端, config.ini 中 [global] dtype_backend 配置
+    默认安装了pyarrow时使用 pyarrow(字符串等字段内存占用更小), 否则使用 numpy
+    :return: pyarrow/numpy_nullable/numpy
+    """
+    backend = get_config().get('global', 'dtype_backend', fallback=None)
+    if backend is None:
+        backend = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'numpy'
+    return backend
+
+
+def dtype_backend_kwargs() -> dict:
+    """
+    pandas读取函数的 dtype_backend 参数
+    """
+    backend = get_dtype_backend()
+    return {} if backend == 'numpy' else {'dtype_backend': backend}
+
+
+# 根据表字段生成的类型对应的pyarrow类型
+_arrow_dtypes = {'Int64': 'int64[pyarrow]', 'UInt64': 'uint64[pyarrow]', 'float64': 'double[pyarrow]',
+                 'string': 'string[pyarrow]'}
+
+
+def to_backend_dtype(dtype):
+    """
+    使用pyarrow类型后端时，把字段类型字典中的类型替换为对应的pyarrow类型
+    :param dtype: 字段类型 例如： {'a': 'Int64', 'b': 'string'}
+    :return: 字段类型
+    """
+    if get_dtype_backend() != 'pyarrow' or not isinstance(dtype, dict):
+        return dtype
+    return {column: _arrow_dtypes.get(value, value) if isinstance(value, str) else value
+            for column, value in dtype.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def get_dictionary_columns() -> tuple:
+    """
+    使用字典编码的低基数字段, config.ini 中 [global] dictionary_columns 配置，默认 ent_code
+    """
+    columns = get_config().get('global', 'dictionary_columns', fallback='ent_code')
+    return tuple(column.strip() for column in columns.split(',') if column.strip())
+
+
+def compact_dataframe(df: DataFrame) -> DataFrame:
+    """
+    使用pyarrow类型后端时，低基数的字符串字段(比如每行都相同的ent_code)转换为字典编码
+    :param df: DataFrame
+    :return: DataFrame
+    """
+    if get_dtype_backend() != 'pyarrow':
+        return df
+    import pyarrow
+    for column in get_dictionary_columns():
+        if column in df.columns and pd.api.types.is_string_dtype(df[column].dtype):
+            df[column] = df[column].astype(pd.ArrowDtype(pyarrow.dictionary(pyarrow.int32(), pyarrow.string())))
+    return df
+
+
+def null_column(df: DataFrame, column):
+    """
+    把字段的值全部置为空, 保持字段原来的类型(不转换为object)
+    :param df: DataFrame
+    :param column: 字段名
+    :return: DataFrame
+    """
+    if column in df.columns:
+        try:
+            df[column] = pd.Series(pd.NA, index=df.index, dtype=df[column].dtype)
+        except (TypeError, ValueError):
+            # numpy整数等不能为空的类型
+            df[column] = None
+    return df
 
 
 def format_json(text):
-    if isinstance(text, float):
+    # 空值: csv按string类型读取时为pd.NA, 否则为float的nan
+    if text is None or isinstance(text, float) or text is pd.NA:
         return None
     else:
         text = str(text).replace('\'', '\"')
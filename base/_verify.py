@@ -0,0 +1,122 @@
+import concurrent
+from concurrent.futures import as_completed
+from threading import BoundedSemaphore, Lock
+
+from base._retry import retry_call
+from base._sink import Mysql
+from base._utils import logger, tqdm, get_config
+
+
+class TableVerifier:
+    """
+    迁移后的数据校验: 按表(租户表按账套)比较源和目标的行数及字段校验值, 校验值在服务端计算
+    每个实例同时执行的校验查询数量有上限，源和目标是同一个实例时共享上限
+    """
+
+    def __init__(self, source: Mysql, target: Mysql, max_workers=8, host_limit=None):
+        """
+        :param source: 源库
+        :param target: 目标库
+        :param max_workers: 同时校验的表数量
+        :param host_limit: 每个实例同时执行的校验查询数量, 默认读取 config.ini 中 [verify] host_limit，默认4
+        """
+        self.source = source
+        self.target = target
+        self.max_workers = max_workers
+        if host_limit is None:
+            host_limit = get_config().getint('verify', 'host_limit', fallback=4)
+        self.host_limit = max(1, host_limit)
+        self._semaphores = {}
+        self._lock = Lock()
+
+    def _get_semaphore(self, mysql: Mysql) -> BoundedSemaphore:
+        """
+        实例的查询并发上限
+        """
+        key = (mysql.host, str(mysql.port))
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = BoundedSemaphore(self.host_limit)
+            return self._semaphores[key]
+
+    def _checksum(self, mysql: Mysql, database, table, columns, condition, desc):
+        """
+        在实例的并发上限内计算行数及校验值
+        """
+        with self._get_semaphore(mysql):
+            return retry_call(mysql.get_table_checksum, database, table, columns, condition=condition, desc=desc)
+
+    def verify_table(self, database, table, target_database=None, source_condition=None, target_condition=None,
+                     columns=None) -> dict:
+        """
+        校验单个表
+        :param database: 源数据库
+        :param table: 表名
+        :param target_database: 目标数据库, 默认与源数据库同名
+        :param source_condition: 源表过滤条件
+        :param target_condition: 目标表过滤条件
+        :param columns: 参与校验值计算的字段, 为空时只比较行数
+        :return: 校验结果 dict(source_rows, target_rows, rows_match, checksum_match)
+        """
+        target_database = target_database or database
+        count_only = not columns
+        source_rows, source_checksum = self._checksum(self.source, database, table, columns or [], source_condition,
+                                                      f'{database}.{table} 源校验')
+        target_rows, target_checksum = self._checksum(self.target, target_database, table, columns or [],
+                                                      target_condition, f'{target_database}.{table} 目标校验')
+        return {
+            'source_rows': source_rows,
+            'target_rows': target_rows,
+            'rows_match': source_rows == target_rows,
+            'checksum_match': None if count_only else source_checksum == target_checksum,
+        }
+
+    def verify_parallel(self, tasks, desc=None) -> list[dict]:
+        """
+        并行校验多个表
+        :param tasks: 校验任务列表, 每个任务是 verify_table 的参数dict, 可以附带 ent_code 用于报告
+        :param desc: 进度条描述
+        :return: 不一致或者校验失败的结果列表
+        """
+        mismatches = []
+        verify_bar = tqdm(total=len(tasks), desc=desc or '数据校验进度')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            for task in tasks:
+                params = {key: value for key, value in task.items() if key != 'ent_code'}
+                futures[pool.submit(self.verify_table, **params)] = task
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    result = future.result()
+                    if not result['rows_match'] or result['checksum_match'] is False:
+                        mismatches.append({**task, **result})
+                except BaseException as e:
+                    mismatches.append({**task, 'error': repr(e)})
+                verify_bar.update(1)
+
+        self.report(mismatches, total=len(tasks))
+        return mismatches
+
+    @staticmethod
+    def report(mismatches, total):
+        """
+        输出校验报告
+        :param mismatches: 不一致的结果列表
+        :param total: 校验的任务数量
+        :return:
+        """
+        if not mismatches:
+            logger.info(f'【数据校验通过】共 {total} 项')
+            return
+        logger.error(f'【数据校验不一致 {len(mismatches)}/{total} 项】')
+        for item in sorted(mismatches, key=lambda x: (x['database'], x['table'], x.get('ent_code') or '')):
+            name = f"{item['database']}.{item['table']}"
+            if item.get('ent_code'):
+                name = f"{name}【{item['ent_code']}】"
+            if 'error' in item:
+                logger.error(f'    {name}: 校验失败 {item["error"]}')
+            elif not item['rows_match']:
+                logger.error(f'    {name}: 行数 源 {item["source_rows"]} / 目标 {item["target_rows"]}')
+            else:
+                logger.error(f'    {name}: 行数 {item["source_rows"]} 一致，校验值不一致')
@@ -0,0 +1,113 @@
+import queue
+from threading import Thread, Lock
+from typing import Callable
+
+from base._memory import get_memory_governor, get_dataframe_bytes
+from base._profile import current_profile, activate_profile
+from base._utils import logger
+
+# 写入线程结束标记
+_STOP = object()
+
+
+class TableWriter:
+    """
+    单表多连接写入器
+    读取线程把数据块放入有界队列，多个写入线程(各自使用独立的连接)并发消费写入同一个表。
+    记录提交的数据量和写入成功的数据量，关闭时校验两者一致
+    """
+
+    def __init__(self, write_func: Callable, workers=1, desc=None):
+        """
+        :param write_func: 写入函数 function(chunk) -> 写入的行数, 需要在一个事务中写入整个数据块
+        :param workers: 写入线程数, 1时在调用线程中直接写入
+        :param desc: 日志描述
+        """
+        self.write_func = write_func
+        self.workers = max(1, workers)
+        self.desc = desc
+        self.submitted_rows = 0
+        self.written_rows = 0
+        self._lock = Lock()
+        self._error = None
+        self._queue = None
+        self._threads = []
+        # 写入线程的耗时记录到当前表的性能分析中
+        self._profile = current_profile()
+        if self.workers > 1:
+            # 队列有界，写入跟不上时阻塞读取，避免数据块堆积在内存中
+            self._queue = queue.Queue(maxsize=self.workers * 2)
+            for index in range(self.workers):
+                thread = Thread(target=self._run, name=f'writer-{desc}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(raise_error=exc_type is None)
+
+    def _write(self, chunk):
+        rows = self.write_func(chunk)
+        with self._lock:
+            self.written_rows += rows or 0
+
+    def _run(self):
+        activate_profile(self._profile)
+        governor = get_memory_governor()
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            chunk, nbytes = item
+            try:
+                # 已经出错时只消费队列，不再写入
+                if self._error is None:
+                    self._write(chunk)
+            except BaseException as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                governor.release(nbytes)
+
+    def submit(self, chunk, nbytes=None):
+        """
+        提交一个数据块
+        :param chunk: DataFrame 或者行列表
+        :param nbytes: 数据块占用的内存, 默认按DataFrame计算
+        :return:
+        """
+        if self._error is not None:
+            raise self._error
+        self.submitted_rows += len(chunk)
+        if self._queue is None:
+            self._write(chunk)
+        else:
+            # 队列中的数据块计入内存预算，写入完成后释放
+            if nbytes is None:
+                nbytes = get_dataframe_bytes(chunk)
+            get_memory_governor().reserve(nbytes)
+            self._queue.put((chunk, nbytes))
+
+    def close(self, raise_error=True):
+        """
+        等待所有数据块写入完成
+        :param raise_error: 写入出错或者写入数量与提交数量不一致时是否抛出异常
+        :return: 写入的行数
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if not raise_error:
+            return self.written_rows
+        if self._error is not None:
+            raise self._error
+        if self.written_rows != self.submitted_rows:
+            raise ValueError(f'【{self.desc}】写入数量 {self.written_rows} 与提交数量 {self.submitted_rows} 不一致')
+        if self.workers > 1:
+            logger.info(f'\r\t【{self.desc}】{self.workers} 个连接并发写入 {self.written_rows} 条')
+        return self.written_rows
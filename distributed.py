@@ -0,0 +1,50 @@
+import argparse
+import multiprocessing
+
+from base import logger, JobQueue, SyncCoordinator, SyncWorker
+import main
+
+
+def run_worker(run_id):
+    """
+    单个执行进程, 每个进程创建自己的数据库连接
+    """
+    worker = SyncWorker(JobQueue(), main.create_rds_list(), run_id, main.ent_codes,
+                        test_data=main.test_data,
+                        delete_data=main.delete_data,
+                        sync_platform_data=main.sync_platform_data,
+                        sync_tenant_data=main.sync_tenant_data,
+                        upsert=main.upsert,
+                        skip_unchanged=main.skip_unchanged)
+    worker.run()
+
+
+if __name__ == '__main__':
+    # 分布式同步, 任务队列在 config.ini 的 [distributed] queue_url 中配置(多台主机时使用共享的mysql库)
+    # 协调者: python distributed.py coordinator --run-id 20240101
+    # 执行者: python distributed.py worker --run-id 20240101 --processes 4  (可以在多台主机上同时启动)
+    parser = argparse.ArgumentParser(description='分布式同步')
+    parser.add_argument('role', choices=['coordinator', 'worker'], help='coordinator: 规划任务并等待完成  worker: 执行任务')
+    parser.add_argument('--run-id', default='default', help='运行标识, 协调者和执行者需要一致')
+    parser.add_argument('--processes', type=int, default=1, help='本机启动的执行进程数')
+    parser.add_argument('--no-wait', action='store_true', help='协调者只规划任务，不等待完成')
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        rds_list = main.create_rds_list()
+        coordinator = SyncCoordinator(JobQueue(), rds_list, args.run_id)
+        coordinator.plan(drop_database=main.drop_database)
+        if not args.no_wait:
+            coordinator.wait()
+            # 所有任务完成后统一校验
+            if main.verify and not main.test_data:
+                for rds in rds_list:
+                    rds.verify_parallel(main.ent_codes, sync_platform_data=main.sync_platform_data,
+                                        sync_tenant_data=main.sync_tenant_data)
+    else:
+        processes = [multiprocessing.Process(target=run_worker, args=(args.run_id,)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        logger.info('【执行进程全部退出】')
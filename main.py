@@ -3,28 +3,42 @@ from platform02 import Platform02
 from rds01 import Rds01
 from rds02 import Rds02
 
-if __name__ == '__main__':
-    # 指定账套
-    # ent_codes = ['638334323', '736482969', '333367878', 'cefeeed1-d198-4214-b1a2-9277e9f78655', '30edefb6-51af-447d-82cd-07cff070e2a2', '4f1ec7fd-74c8-4105-85c0-2cdd44307374']
-    ent_codes = ['189eb2c3-caf9-48ff-84d7-574cbfd1d1fa']
+# 指定账套
+# ent_codes = ['638334323', '736482969', '333367878', 'cefeeed1-d198-4214-b1a2-9277e9f78655', '30edefb6-51af-447d-82cd-07cff070e2a2', '4f1ec7fd-74c8-4105-85c0-2cdd44307374']
+ent_codes = ['189eb2c3-caf9-48ff-84d7-574cbfd1d1fa']
+
+# 测试模式只同步前10条记录
+test_data = False
+# 是否删除原来的租户数据或者平台数据
+delete_data = True
+# 是否同步前删除数据库
+drop_database = False
+# 是否同步平台表数据
+sync_platform_data = False
+# 是否同步租户数据
+sync_tenant_data = True
+# 同步完成后校验源和目标的行数及校验值
+verify = True
+# 按业务键 upsert 写入，只删除源中已不存在的数据(代替先删除再写入), 没有业务键的表仍然先删除再写入
+upsert = False
+# 平台表源和目标的行数及校验值一致时跳过同步(不再清空重写)，需要全量刷新时保持False
+skip_unchanged = False
 
-    # 测试模式只同步前10条记录
-    test_data = False
-    # 是否删除原来的租户数据或者平台数据
-    delete_data = True
-    # 是否同步前删除数据库
-    drop_database = False
-    # 是否同步平台表数据
-    sync_platform_data = False
-    # 是否同步租户数据
-    sync_tenant_data = True
 
+def create_rds_list():
+    """
+    需要同步的实例, 分布式同步(distributed.py)也使用同样的实例配置
+    """
     rds01 = Rds01(databases=['cloud_sale', 'crm', 'customer_supply', 'data_authority', 'development', 'billing',
                              'form_template', 'freeze', 'hr', 'hrmis', 'mrp', 'price_center', 'cloud_finance',
                              'purchase', 'supplier', 'system_setting'])
     rds02 = Rds02(databases=['manufacture', 'storehouse', 'qc'])
     platform02 = Platform02(databases=['platform_rbac', 'platform_dictionary'])
-    rds_list = [rds01, rds02, platform02]
+    return [rds01, rds02, platform02]
+
+
+if __name__ == '__main__':
+    rds_list = create_rds_list()
     for rds in rds_list:
         logger.info(f'【开始同步 {rds.get_name()}】准备数据。。。')
         rds.sync_parallel(ent_codes,
@@ -32,4 +46,7 @@ if __name__ == '__main__':
                           delete_data=delete_data,
                           drop_database=drop_database,
                           sync_platform_data=sync_platform_data,
-                          sync_tenant_data=sync_tenant_data)
+                          sync_tenant_data=sync_tenant_data,
+                          verify=verify,
+                          upsert=upsert,
+                          skip_unchanged=skip_unchanged)
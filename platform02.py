@@ -14,9 +14,12 @@ class Platform02(BaseExport, BaseImport, BaseSync):
         self.rds_port = config.get('rds02_mysql', 'port')
         self.rds_user = config.get('rds02_mysql', 'user')
         self.rds_pass = config.get('rds02_mysql', 'pass')
+        # 只读实例(可选) 例如: replicas = 10.0.0.2:3306, 10.0.0.3:3306
+        self.rds_replicas = config.get('rds02_mysql', 'replicas', fallback='')
 
         # rds02 连接
-        source_rds02 = Mysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass)
+        source_rds02 = ReplicatedMysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass,
+                                       replicas=self.rds_replicas)
 
         # rds02 数据库
         databases_rds02 = databases
@@ -51,15 +54,43 @@ class Platform02(BaseExport, BaseImport, BaseSync):
 
         # 除了ent表，其他表将id置为空，因为ent表的id在bom中用上了，可能bom重构后就不需要了
         if not table == 'ent':
-            if 'id' in df.columns:
-                df['id'] = None
+            null_column(df, 'id')
         if is_db_tbl('platform_rbac', 'ent'):
-            df['name'] = df['name'].apply(lambda x: f'uat.{x}')
+            df['name'] = 'uat.' + df['name']
         if is_db_tbl('platform_rbac', 'account'):
             df['password'] = '56b291d6ed9b9cb8e2d3dc09cb6377b9'
             df['salt'] = '123456'
         return df
 
+    def column_overrides(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 中可以用sql表达式描述的字段转换
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: dict {字段名: sql表达式}
+        """
+        overrides = {}
+        # 除了ent表，其他表将id置为空
+        if not table == 'ent':
+            overrides['id'] = 'NULL'
+        if database == 'platform_rbac' and table == 'ent':
+            overrides['name'] = "CONCAT('uat.', `name`)"
+        if database == 'platform_rbac' and table == 'account':
+            overrides['password'] = "'56b291d6ed9b9cb8e2d3dc09cb6377b9'"
+            overrides['salt'] = "'123456'"
+        return overrides
+
+    def is_sql_expressible(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 的处理都可以由 column_overrides 描述
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: True
+        """
+        return True
+
     def table_data_match_filter(self, database, table):
         def is_db_tbl(db, tbl):
             return database == db and table == tbl
@@ -14,9 +14,12 @@ class Rds01(BaseExport, BaseImport, BaseSync):
         self.rds_port = config.get('rds01_mysql', 'port')
         self.rds_user = config.get('rds01_mysql', 'user')
         self.rds_pass = config.get('rds01_mysql', 'pass')
+        # 只读实例(可选) 例如: replicas = 10.0.0.2:3306, 10.0.0.3:3306
+        self.rds_replicas = config.get('rds01_mysql', 'replicas', fallback='')
 
         # rds01 连接
-        source_rds01 = Mysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass)
+        source_rds01 = ReplicatedMysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass,
+                                       replicas=self.rds_replicas)
 
         # rds01 数据库
         databases_rds01 = databases
@@ -45,16 +48,18 @@ class Rds01(BaseExport, BaseImport, BaseSync):
     def single_table_for_debug(self):
         return debug_table
 
-    def return_before_handle_data(self, database, table):
+    def return_before_handle_data(self, database, table, incoming_rows=None, target_rows=None):
         """
         前置处理器，不做索引删除和恢复
         :param database:
         :param table:
+        :param incoming_rows: 预估写入的行数
+        :param target_rows: 目标表写入前的行数
         :return:
         """
         if database == 'workflow':
             return None
-        return super().return_before_handle_data(database, table)
+        return super().return_before_handle_data(database, table, incoming_rows, target_rows)
 
     def get_columns_dtype(self, database, table):
         """
@@ -91,11 +96,10 @@ class Rds01(BaseExport, BaseImport, BaseSync):
 
         # 除了ent表，其他表将id置为空，因为ent表的id在bom中用上了，可能bom重构后就不需要了
         if not table == 'ent':
-            if 'id' in df.columns:
-                df['id'] = None
+            null_column(df, 'id')
         if is_sync:
             if is_db_tbl('rbac_new', 'ent'):
-                df['name'] = df['name'].apply(lambda x: f'uat.{x}')
+                df['name'] = 'uat.' + df['name']
             return df
         else:
             if is_db_tbl('cloud_sale', 'balance_todo'):
@@ -127,6 +131,39 @@ class Rds01(BaseExport, BaseImport, BaseSync):
                 df['customer_material_code'] = df['customer_material_code'].fillna('')
             return df
 
+    def column_overrides(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 中可以用sql表达式描述的字段转换
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: dict {字段名: sql表达式}
+        """
+        overrides = {}
+        # 除了ent表，其他表将id置为空
+        if not table == 'ent':
+            overrides['id'] = 'NULL'
+        if is_sync and database == 'rbac_new' and table == 'ent':
+            overrides['name'] = "CONCAT('uat.', `name`)"
+        return overrides
+
+    def is_sql_expressible(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 对当前表的处理是否可以完全由 column_overrides 描述
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: True: 可以在服务端用sql完成转换  False: 必须经过 chunk_wrapper 处理
+        """
+        if is_sync:
+            return True
+        # 导入模式下这些表有 fillna/format_json 等python处理
+        return (database, table) not in [('cloud_sale', 'balance_todo'), ('crm', 'customer'),
+                                         ('unicom', 'purchase_coordination_file_type'),
+                                         ('form_template', 'element_config'),
+                                         ('form_template', 'form_template_detail'),
+                                         ('cloud_sale', 'sale_proposal')]
+
     def table_ddl_match_filter(self, database, table):
         """
         匹配表过滤器，如果返回true则处理表结构，否则跳过当前表继续下一个
@@ -14,9 +14,12 @@ class Rds02(BaseExport, BaseImport, BaseSync):
         self.rds_port = config.get('rds02_mysql', 'port')
         self.rds_user = config.get('rds02_mysql', 'user')
         self.rds_pass = config.get('rds02_mysql', 'pass')
+        # 只读实例(可选) 例如: replicas = 10.0.0.2:3306, 10.0.0.3:3306
+        self.rds_replicas = config.get('rds02_mysql', 'replicas', fallback='')
 
         # rds02 连接
-        source_rds02 = Mysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass)
+        source_rds02 = ReplicatedMysql(self.rds_host, self.rds_port, self.rds_user, self.rds_pass,
+                                       replicas=self.rds_replicas)
 
         # rds02 数据库
         databases_rds02 = databases
@@ -51,11 +54,10 @@ class Rds02(BaseExport, BaseImport, BaseSync):
 
         # 除了ent表，其他表将id置为空，因为ent表的id在bom中用上了，可能bom重构后就不需要了
         if not table == 'ent':
-            if 'id' in df.columns:
-                df['id'] = None
+            null_column(df, 'id')
         if is_sync:
             if is_db_tbl('platform_rbac', 'ent'):
-                df['name'] = df['name'].apply(lambda x: f'uat.{x}')
+                df['name'] = 'uat.' + df['name']
             return df
         else:
             if is_db_tbl('manufacture', 'customer'):
@@ -67,6 +69,35 @@ class Rds02(BaseExport, BaseImport, BaseSync):
                 pass
             return df
 
+    def column_overrides(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 中可以用sql表达式描述的字段转换
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: dict {字段名: sql表达式}
+        """
+        overrides = {}
+        # 除了ent表，其他表将id置为空
+        if not table == 'ent':
+            overrides['id'] = 'NULL'
+        if is_sync and database == 'platform_rbac' and table == 'ent':
+            overrides['name'] = "CONCAT('uat.', `name`)"
+        return overrides
+
+    def is_sql_expressible(self, database, table, is_sync=False):
+        """
+        chunk_wrapper 对当前表的处理是否可以完全由 column_overrides 描述
+        :param database: 数据库
+        :param table: 表名
+        :param is_sync: 是否是同步数据模式
+        :return: True: 可以在服务端用sql完成转换  False: 必须经过 chunk_wrapper 处理
+        """
+        if is_sync:
+            return True
+        # 导入模式下该表有 fillna 处理
+        return not (database == 'manufacture' and table == 'customer')
+
     def table_data_match_filter(self, database, table):
         def is_db_tbl(db, tbl):
             return database == db and table == tbl
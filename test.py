@@ -1,4 +1,7 @@
 import os
+import subprocess
+import sys
+import time
 import unittest
 
 from base import *
@@ -74,3 +77,568 @@ class TestTable(unittest.TestCase):
         chunks = csv.get_chunks_from_csv(csv_file)
         for index, item in enumerate(chunks):
             print(item)
+
+    # 启动耗时基准，轻量入口只用到 Mysql/config 时不能加载 pandas/sqlalchemy 等重量级依赖
+    def test_startup_time(self):
+        code = ('import sys, base; from base import Mysql, config; '
+                'assert "pandas" not in sys.modules and "sqlalchemy" not in sys.modules')
+        costs = []
+        for _ in range(3):
+            s_time = time.time()
+            subprocess.run([sys.executable, '-c', code], check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            costs.append(time.time() - s_time)
+        costs.sort()
+        logger.info(f'启动耗时: {costs[1]:.3f}秒')
+        self.assertLess(costs[1], 1.0)
+
+    # 测试大csv按记录边界切分，引号内的换行不能被切开
+    def test_split_csv_ranges(self):
+        import mmap
+        import tempfile
+        from base._ingest import ParallelCsvIngest
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('id,name\n')
+            for i in range(1000):
+                f.write(f'{i},"a\n""b"",{i}"\n')
+        try:
+            ingest = ParallelCsvIngest(None, block_size=1000)
+            with open(f.name, 'rb') as csv_file, mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                columns, ranges = ingest.split_ranges(mm)
+                frames = [ingest._parse_range(mm, start, end, columns, dtype={'name': 'string'})
+                          for start, end in ranges]
+            self.assertEqual(columns, ['id', 'name'])
+            self.assertGreater(len(ranges), 1)
+            self.assertEqual(sum(len(frame) for frame in frames), 1000)
+            self.assertTrue(all(frame['name'].str.startswith('a\n"b",').all() for frame in frames))
+        finally:
+            os.remove(f.name)
+
+    # 测试多MB的csv并行导入，每个区间大于pyarrow的读取块，引号内有换行
+    def test_ingest_multiline_csv(self):
+        import tempfile
+        from types import SimpleNamespace
+        import sqlalchemy as sa
+        from base._ingest import ParallelCsvIngest
+        with tempfile.TemporaryDirectory() as folder:
+            csv_file = os.path.join(folder, 'big.csv')
+            with open(csv_file, 'w', encoding='utf-8') as f:
+                f.write('id,remark\n')
+                for i in range(30000):
+                    f.write(f'{i},"第一行{i}\n第二行 ""{"x" * 80}"",\n"\n')
+            self.assertGreater(os.path.getsize(csv_file), 3 * 1024 * 1024)
+            # 多个线程写入同一个sqlite文件时等待锁释放
+            engine = sa.create_engine(f'sqlite:///{folder}/ingest.db', connect_args={'timeout': 30})
+            with engine.begin() as conn:
+                conn.execute(sa.text('create table t (id integer, remark text)'))
+            ingest = ParallelCsvIngest(SimpleNamespace(get_engine=lambda: engine), workers=2,
+                                       block_size=1536 * 1024, chunksize=5000)
+            self.assertEqual(ingest.ingest(csv_file, 'main', 't', dtype={'remark': 'string'}), 30000)
+            with engine.connect() as conn:
+                self.assertEqual(conn.execute(sa.text('select count(*) from t')).scalar(), 30000)
+                remark = conn.execute(sa.text('select remark from t where id = 29999')).scalar()
+            engine.dispose()
+        self.assertEqual(remark, f'第一行29999\n第二行 "{"x" * 80}",\n')
+
+    # 测试有字段覆盖的表使用mysqldump同步: 先原样写入暂存表，再在目标实例上按覆盖规则写入目标表
+    def test_native_dump_staging(self):
+        from types import SimpleNamespace
+        calls = []
+        source = SimpleNamespace(dump_table_to=lambda target, database, table, where=None, target_database=None,
+                                 replace=False: calls.append(('dump', target_database, where, replace)))
+        target = SimpleNamespace(execute_update=lambda sql: calls.append(sql),
+                                 insert_select_by_pk_range=lambda *args, upsert_keys=None: calls.append(
+                                     ('insert_select', *args, upsert_keys)) or 2)
+        sync = SimpleNamespace(source=source, target=target, get_target_database=lambda database: f'{database}_uat',
+                               _check_cancelled=lambda database, table: None,
+                               _get_insert_select_columns=lambda database, table: (['id', 'name'],
+                                                                                   ['NULL AS `id`', '`name`']))
+        sync.get_staging_database = lambda database: BaseSync.get_staging_database(sync, database)
+        BaseSync._dump_table(sync, 'db', 't', "ent_code IN ('e1')", ['name', 'id'], True)
+        self.assertEqual(calls, ['CREATE DATABASE IF NOT EXISTS `db_uat__dump`',
+                                 'DROP TABLE IF EXISTS `db_uat__dump`.`t`',
+                                 'CREATE TABLE `db_uat__dump`.`t` LIKE `db_uat`.`t`',
+                                 ('dump', 'db_uat__dump', "ent_code IN ('e1')", False),
+                                 ('insert_select', 'db_uat__dump', 't', 'db_uat', 't', ['id', 'name'],
+                                  ['NULL AS `id`', '`name`'], ['name', 'id']),
+                                 'DROP TABLE IF EXISTS `db_uat__dump`.`t`'])
+        calls.clear()
+        BaseSync._dump_table(sync, 'db', 't', None, ['name', 'id'], False)
+        self.assertEqual(calls, [('dump', 'db_uat', None, True)])
+
+    # 测试联合主键的表按键分页读取, 分页键被常量覆盖时额外读取分页键
+    def test_read_by_composite_key(self):
+        import tempfile
+        import sqlalchemy as sa
+
+        class SqliteMysql(Mysql):
+            def __init__(self, engine):
+                self.engine = engine
+
+            def get_table_unique_keys(self, database, table):
+                return [['ent_code', 'code']]
+
+            def estimate_chunk_bytes(self, database, table, chunksize):
+                return 100 * chunksize
+
+        with tempfile.TemporaryDirectory() as folder:
+            engine = sa.create_engine(f'sqlite:///{folder}/read.db')
+            with engine.begin() as conn:
+                conn.execute(sa.text('create table t (ent_code text, code text, name text, primary key (ent_code, code))'))
+                conn.execute(sa.text('insert into t values (:e, :c, :n)'),
+                             [{'e': f'e{i % 3}', 'c': f'c{i:03d}', 'n': f'n{i}'} for i in range(100)])
+            chunks = []
+            SqliteMysql(engine).from_table_to_call_by_key('main', 't', chunks.append, condition="ent_code != 'e2'",
+                                                          chunksize=7, columns=['`ent_code`', "NULL AS `code`", '`name`'])
+            engine.dispose()
+        self.assertEqual([list(chunk.columns) for chunk in chunks[:1]], [['ent_code', 'code', 'name']])
+        names = [name for chunk in chunks for name in chunk['name']]
+        self.assertEqual(sorted(names), sorted(f'n{i}' for i in range(100) if i % 3 != 2))
+        self.assertEqual(len(names), len(set(names)))
+
+    # 测试mysql临时错误的识别, 包括sqlalchemy包装及异常链
+    def test_transient_error(self):
+        import pymysql
+        import sqlalchemy
+        from base._retry import is_transient_error
+        lost = pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+        self.assertTrue(is_transient_error(lost))
+        self.assertTrue(is_transient_error(sqlalchemy.exc.OperationalError('insert', {}, lost)))
+        try:
+            try:
+                raise sqlalchemy.exc.OperationalError('insert', {}, pymysql.err.OperationalError(1213, 'Deadlock'))
+            except BaseException as e:
+                raise ImportError(f'to_sql: {repr(e)}') from e
+        except ImportError as e:
+            self.assertTrue(is_transient_error(e))
+        self.assertFalse(is_transient_error(pymysql.err.IntegrityError(1062, 'Duplicate entry')))
+        self.assertFalse(is_transient_error(ValueError('x')))
+
+    # 测试单表多连接写入的数量统计及异常传递
+    def test_table_writer(self):
+        import pandas as pd
+        from base._writer import TableWriter
+        written = []
+        with TableWriter(lambda chunk: written.append(len(chunk)) or len(chunk), workers=3, desc='t') as writer:
+            for i in range(20):
+                writer.submit(pd.DataFrame({'id': range(i)}))
+        self.assertEqual(writer.written_rows, sum(range(20)))
+        self.assertEqual(sorted(written), [i for i in range(20)])
+
+        def fail(chunk):
+            raise ValueError('write error')
+        writer = TableWriter(fail, workers=2, desc='t')
+        with self.assertRaises(ValueError):
+            for i in range(10):
+                writer.submit(pd.DataFrame({'id': [i]}))
+            writer.close()
+
+    # 测试内存预算: 数据块处理完成后释放，预算不足时阻塞读取
+    def test_memory_governor(self):
+        import threading
+        import pandas as pd
+        from base._memory import MemoryGovernor, get_dataframe_bytes
+        chunks = [pd.DataFrame({'name': ['x' * 100] * 1000}) for _ in range(3)]
+        size = get_dataframe_bytes(chunks[0])
+        governor = MemoryGovernor(size * 2)
+        for chunk in governor.govern(chunks):
+            self.assertEqual(governor.used, size)
+        self.assertEqual(governor.used, 0)
+        self.assertEqual(governor.peak, size)
+
+        governor.acquire(size * 2)
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: governor.acquire(size) or acquired.set())
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        governor.release(size * 2)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    # 测试bit字段的 b'\x00' 整列转换为0/1, 其他字段保持不变
+    def test_replace_bit_bytes(self):
+        import pandas as pd
+        from base._utils import replace_bit_bytes, null_column
+        df = pd.DataFrame({'bit': [b'\x01', None, b'\x00'], 'name': ['a', 'b', None], 'id': [1, 2, 3]})
+        df = replace_bit_bytes(df)
+        self.assertEqual(df['bit'].tolist(), [1, pd.NA, 0])
+        self.assertEqual(df['name'].tolist()[:2], ['a', 'b'])
+        null_column(df, 'name')
+        self.assertTrue(df['name'].isna().all())
+
+    # 测试索引处理策略: 小批量写入大表保留索引，目标表为空或者大批量写入时删除重建
+    def test_index_strategy(self):
+        from base._index import should_rebuild_indexes
+        self.assertFalse(should_rebuild_indexes(10000, 50000000, 5, insert_penalty=5))
+        self.assertTrue(should_rebuild_indexes(10000, 0, 5, insert_penalty=5))
+        self.assertTrue(should_rebuild_indexes(1000000, 2000000, 5, insert_penalty=5))
+        self.assertFalse(should_rebuild_indexes(1000000, 0, 0, insert_penalty=5))
+
+    # 测试数据校验: 行数或校验值不一致的表出现在报告中，源和目标同一实例时共享并发上限
+    def test_table_verifier(self):
+        from types import SimpleNamespace
+        from base._verify import TableVerifier
+        data = {('db', 't1'): (10, 'a'), ('db', 't2'): (10, 'a'), ('uat_db', 't1'): (10, 'a'),
+                ('uat_db', 't2'): (9, 'b')}
+        source = SimpleNamespace(host='h', port=3306, get_table_checksum=lambda d, t, c, condition=None: data[(d, t)])
+        target = SimpleNamespace(host='h', port='3306', get_table_checksum=source.get_table_checksum)
+        verifier = TableVerifier(source, target, max_workers=2, host_limit=1)
+        self.assertIs(verifier._get_semaphore(source), verifier._get_semaphore(target))
+        mismatches = verifier.verify_parallel([
+            dict(database='db', table='t1', target_database='uat_db', columns=['name']),
+            dict(database='db', table='t2', target_database='uat_db', columns=['name'], ent_code='x'),
+        ])
+        self.assertEqual([(item['table'], item['ent_code'], item['target_rows']) for item in mismatches],
+                         [('t2', 'x', 9)])
+
+    # 测试只读实例路由: 轮询可用的只读实例，延迟超限的实例跳过，全部不可用时回退到主实例
+    def test_replica_routing(self):
+        from base._replica import ReplicatedMysql
+        source = ReplicatedMysql('primary', '3306', 'user', 'pass', replicas='r1, r2:3307', max_lag=30)
+        source.get_replica_lag = lambda replica: 1
+        self.assertEqual(sorted(source.get_read_engine().url.host for _ in range(2)), ['r1', 'r2'])
+        source._lags = {}
+        source.get_replica_lag = lambda replica: 100 if replica.host == 'r1' else None
+        self.assertEqual(source.get_read_engine().url.host, 'primary')
+        self.assertEqual(source.get_engine().url.host, 'primary')
+
+    # 测试只读实例读取时连接中断: 重试时不再使用失败的只读实例，回退到主实例
+    def test_replica_read_failover(self):
+        import tempfile
+        import pymysql
+        import sqlalchemy as sa
+        from base._replica import ReplicatedMysql
+
+        def lost_connection():
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+
+        source = ReplicatedMysql('primary', '3306', 'user', 'pass', replicas='r1', max_lag=0)
+        source.replicas[0].engine = sa.create_engine('sqlite://', creator=lost_connection)
+        source.get_table_unique_keys = lambda database, table: [['id']]
+        source.estimate_chunk_bytes = lambda database, table, chunksize: 100 * chunksize
+        with tempfile.TemporaryDirectory() as folder:
+            source.engine = sa.create_engine(f'sqlite:///{folder}/read.db')
+            with source.engine.begin() as conn:
+                conn.execute(sa.text('create table t (id integer primary key, name text)'))
+                conn.execute(sa.text("insert into t values (1, 'a'), (2, 'b'), (3, 'c')"))
+            chunks = []
+            with self.assertLogs(logger, 'WARNING'):
+                source.from_table_to_call_by_key('main', 't', chunks.append, chunksize=2)
+            self.assertIs(source.get_read_engine(), source.engine)
+            source.engine.dispose()
+        self.assertEqual([list(chunk['name']) for chunk in chunks], [['a', 'b'], ['c']])
+
+    # 测试任务队列: 同一个任务只能被一个执行者领取，租约过期后可以被其他执行者重新领取
+    def test_job_queue(self):
+        import tempfile
+        from base._distributed import JobQueue
+        with tempfile.TemporaryDirectory() as folder:
+            queue = JobQueue(f'sqlite:///{folder}/queue.db', lease_seconds=0.2, max_attempts=2)
+            self.assertEqual(queue.enqueue('run', 'rds01', [('db', 't1'), ('db', 't2')]), 2)
+            self.assertEqual(queue.enqueue('run', 'rds01', [('db', 't1')]), 0)
+            job1 = queue.claim('run', 'w1')
+            job2 = queue.claim('run', 'w2')
+            self.assertEqual((job1['table'], job2['table']), ('t1', 't2'))
+            self.assertIsNone(queue.claim('run', 'w3'))
+            self.assertTrue(queue.complete(job2, 'w2'))
+            self.assertTrue(queue.save_index_sqls(job1, 'w1', 'db', ['ADD INDEX a']))
+            self.assertTrue(queue.save_index_sqls(job1, 'w1', 'db', []))
+            time.sleep(0.3)
+            job = queue.claim('run', 'w3')
+            self.assertEqual((job['table'], job['attempts']), ('t1', 2))
+            # 接手的任务带有之前执行者删除索引前保存的恢复语句
+            self.assertEqual(job['index_sqls'], {'database': 'db', 'sqls': ['ADD INDEX a']})
+            self.assertFalse(queue.heartbeat(job1, 'w1'))
+            self.assertFalse(queue.save_index_sqls(job1, 'w1', 'db', []))
+            self.assertTrue(queue.complete(job, 'w3', error='error'))
+            self.assertEqual(queue.stats('run'), {'done': 1, 'failed': 1})
+            queue.engine.dispose()
+
+    # 测试分布式执行者在任务标记完成前重建本表删除的索引，失败的任务不重复恢复索引
+    def test_sync_worker_indexes(self):
+        import tempfile
+        from types import SimpleNamespace
+        from base._distributed import JobQueue, SyncWorker
+        from base._index import IndexRestorer
+        with tempfile.TemporaryDirectory() as folder:
+            queue = JobQueue(f'sqlite:///{folder}/queue.db', lease_seconds=5, max_attempts=2)
+            queue.enqueue('run', 'rds01', [('db', 't1')])
+            executed = []
+            target = SimpleNamespace(get_table_index_drop_sql=lambda database, table: ['DROP INDEX a'],
+                                     get_table_index_alert_sqls=lambda database, table: ['ADD INDEX a'],
+                                     execute_update=lambda sql, database=None: executed.append(
+                                         (sql, queue.stats('run'))))
+            instance = SimpleNamespace(get_name=lambda: 'rds01', reset_sync_state=lambda: None, target=target,
+                                       index_restorer=IndexRestorer(target), get_target_database=lambda d: d,
+                                       _check_cancelled=lambda database, table: None)
+
+            def sync_table(database, table, ent_codes):
+                instance.index_restorer.add(database, table, instance.index_restorer.prepare(database, table))
+                if table == 't2':
+                    raise ValueError(table)
+
+            instance._sync_database_table = sync_table
+            self.assertEqual(SyncWorker(queue, [instance], 'run', [], worker='w1').run(), 1)
+            self.assertEqual(executed, [('DROP INDEX a', {'running': 1}), ('ADD INDEX a', {'running': 1})])
+            self.assertEqual(queue.stats('run'), {'done': 1})
+            # 失败重试的任务只由任务记录恢复语句，最后一次失败时由本进程重建索引
+            executed.clear()
+            queue.enqueue('run', 'rds01', [('db', 't2')])
+            self.assertEqual(SyncWorker(queue, [instance], 'run', [], worker='w1').run(), 2)
+            self.assertEqual([sql for sql, _ in executed], ['DROP INDEX a', 'DROP INDEX a', 'ADD INDEX a'])
+            self.assertEqual(instance.index_restorer.pending_count(), 0)
+            self.assertEqual(queue.stats('run'), {'done': 1, 'failed': 1})
+            queue.engine.dispose()
+
+    # 测试建表语句缓存: 只有结构变化的表重新读取建表语句，手工维护的sql文件不会被覆盖
+    def test_ddl_cache(self):
+        import tempfile
+        from types import SimpleNamespace
+        from base._ddl import DdlCache, read_bundle_schema
+        hashes = {'a': '1', 'b': '2'}
+        calls = []
+        source = SimpleNamespace(get_schema_hashes=lambda database: dict(hashes),
+                                 get_table_create_sql=lambda table, database: calls.append(table) or
+                                 f'CREATE TABLE `{table}` (`id` int)')
+        with tempfile.TemporaryDirectory() as folder:
+            cache = DdlCache(source, folder=folder)
+            bundle_file = cache.build_bundle('db', ['a', 'b'])
+            schema = read_bundle_schema(bundle_file)
+            with open(bundle_file, encoding='utf-8') as f:
+                self.assertIn('CREATE TABLE IF NOT EXISTS `a`', f.read())
+            hashes['b'] = '3'
+            cache.build_bundle('db', ['a', 'b'])
+            self.assertEqual(calls, ['a', 'b', 'b'])
+            self.assertNotEqual(read_bundle_schema(bundle_file), schema)
+            with open(bundle_file, 'w', encoding='utf-8') as f:
+                f.write('CREATE TABLE `a` (`id` int);')
+            self.assertIs(read_bundle_schema(cache.build_bundle('db', ['a'])), False)
+
+    # 测试sql文件拆分: 引号和注释中的分号不拆分，支持 DELIMITER，按表分组
+    def test_split_sql_statements(self):
+        from base._sqlfile import split_sql_statements, get_statement_table
+        lines = ["/*!40101 SET NAMES utf8mb4 */;\n", "-- comment;\n", "CREATE TABLE `a` (`id` int, # c;\n",
+                 "`name` varchar(10) COMMENT 'x;y');\n", "INSERT INTO `a` VALUES (1,'it\\'s;'),(2,\"50%\");\n",
+                 "DELIMITER $$\n", "CREATE TRIGGER t BEFORE INSERT ON a FOR EACH ROW BEGIN SET NEW.id = 1; END$$\n",
+                 "DELIMITER ;\n", "/*!40000 ALTER TABLE db.`a` ENABLE KEYS */;\n"]
+        statements = [statement for statement, _ in split_sql_statements(lines)]
+        self.assertEqual(len(statements), 5)
+        self.assertEqual(statements[2], "INSERT INTO `a` VALUES (1,'it\\'s;'),(2,\"50%\")")
+        self.assertTrue(statements[3].endswith('SET NEW.id = 1; END'))
+        self.assertEqual([get_statement_table(statement) for statement in statements],
+                         [None, 'a', 'a', None, 'db.a'])
+
+    # 测试sql文件导入: mysqldump 文件末尾恢复的会话设置不会用在最后一个表上
+    def test_sql_file_session_settings(self):
+        import tempfile
+        from types import SimpleNamespace
+        from base._sqlfile import SqlFileImporter
+        connections = []
+
+        class Cursor:
+            def __init__(self, executed):
+                self.execute = lambda sql: executed.append(sql.decode('utf-8'))
+
+            def close(self):
+                pass
+
+        def raw_connection():
+            executed = []
+            connections.append(executed)
+            return SimpleNamespace(cursor=lambda: Cursor(executed), commit=lambda: None, close=lambda: None)
+
+        mysql = SimpleNamespace(get_engine=lambda: SimpleNamespace(raw_connection=raw_connection))
+        dump = """/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!50503 SET NAMES utf8mb4 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
+DROP TABLE IF EXISTS `a`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `a` (`id` int NOT NULL AUTO_INCREMENT, `t` timestamp NULL, PRIMARY KEY (`id`));
+/*!40101 SET character_set_client = @saved_cs_client */;
+INSERT INTO `a` VALUES (0,'2024-01-01 00:00:00');
+/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+"""
+        with tempfile.TemporaryDirectory() as folder:
+            sql_file = os.path.join(folder, 'dump.sql')
+            with open(sql_file, 'w', encoding='utf-8') as f:
+                f.write(dump)
+            self.assertEqual(SqlFileImporter(mysql, workers=2).import_file(sql_file, 'db'), 3)
+        executed = [sql for sqls in connections for sql in sqls]
+        self.assertFalse([sql for sql in executed if '=@OLD_' in sql or '= @saved_' in sql])
+        insert_connection = next(sqls for sqls in connections if any(sql.startswith('INSERT') for sql in sqls))
+        self.assertIn("/*!40103 SET TIME_ZONE='+00:00' */", insert_connection)
+        self.assertIn("/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */", insert_connection)
+
+    # 测试导入mysqldump导出的文件: 没有 --hex-blob 的二进制字段按原始字节发送，触发器、锁表及注释的处理
+    def test_sql_file_mysqldump(self):
+        import tempfile
+        from types import SimpleNamespace
+        from base._sqlfile import SqlFileImporter
+        executed = []
+
+        def raw_connection():
+            cursor = SimpleNamespace(execute=executed.append, close=lambda: None)
+            return SimpleNamespace(cursor=lambda: cursor, commit=lambda: None, close=lambda: None)
+
+        mysql = SimpleNamespace(get_engine=lambda: SimpleNamespace(raw_connection=raw_connection))
+        dump = b"""-- MySQL dump 10.13  Distrib 8.0.36, for Linux (x86_64)
+--
+-- Host: 127.0.0.1    Database: db
+-- ------------------------------------------------------
+-- Server version\t8.0.36
+
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET @OLD_CHARACTER_SET_RESULTS=@@CHARACTER_SET_RESULTS */;
+/*!40101 SET @OLD_COLLATION_CONNECTION=@@COLLATION_CONNECTION */;
+/*!50503 SET NAMES utf8mb4 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
+/*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
+
+--
+-- Table structure for table `attachment`
+--
+
+DROP TABLE IF EXISTS `attachment`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `attachment` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `name` varchar(64) NOT NULL COMMENT '\xe5\x90\x8d\xe7\xa7\xb0; -- \xe4\xb8\x8d\xe6\x98\xaf\xe6\xb3\xa8\xe9\x87\x8a',
+  `content` blob,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `attachment`
+--
+
+LOCK TABLES `attachment` WRITE;
+/*!40000 ALTER TABLE `attachment` DISABLE KEYS */;
+INSERT INTO `attachment` VALUES (1,'a.png',_binary '\x89PNG\\r\\n\\Z\\n\\0\xff\xfe\xc3\\\\\\''),(2,'it\\'s; ok',NULL);
+/*!40000 ALTER TABLE `attachment` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `user`
+--
+
+DROP TABLE IF EXISTS `user`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `user` (
+  `id` int NOT NULL,
+  `name` varchar(64) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+LOCK TABLES `user` WRITE;
+/*!40000 ALTER TABLE `user` DISABLE KEYS */;
+INSERT INTO `user` VALUES (1,'\xe5\xbc\xa0\xe4\xb8\x89'),(2,'/* a */ -- b');
+/*!40000 ALTER TABLE `user` ENABLE KEYS */;
+UNLOCK TABLES;
+/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = 'ONLY_FULL_GROUP_BY,STRICT_TRANS_TABLES' */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`%`*/ /*!50003 TRIGGER `user_bi` BEFORE INSERT ON `user` FOR EACH ROW BEGIN
+  SET NEW.name = TRIM(NEW.name);
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+
+/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+/*!40101 SET CHARACTER_SET_RESULTS=@OLD_CHARACTER_SET_RESULTS */;
+/*!40101 SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION */;
+/*!40111 SET SQL_NOTES=@OLD_SQL_NOTES */;
+
+-- Dump completed on 2024-01-01 12:00:00
+"""
+        with tempfile.TemporaryDirectory() as folder:
+            sql_file = os.path.join(folder, 'db.sql')
+            with open(sql_file, 'wb') as f:
+                f.write(dump)
+            self.assertEqual(SqlFileImporter(mysql, workers=2).import_file(sql_file, 'db'), 11)
+        statements = [sql for sql in executed if not sql.startswith((b'USE ', b'/*!40101 SET', b'/*!40103 SET',
+                                                                     b'/*!40014 SET', b'/*!40111 SET',
+                                                                     b'/*!50503 SET', b'/*!50003 SET'))]
+        self.assertEqual(len(statements), 11)
+        # 每条语句都是文件中的原始字节
+        self.assertTrue(all(statement in dump for statement in statements))
+        self.assertIn(b"_binary '\x89PNG\\r\\n\\Z\\n\\0\xff\xfe\xc3\\\\\\''", b''.join(statements))
+        self.assertIn(b"COMMENT '\xe5\x90\x8d\xe7\xa7\xb0; -- \xe4\xb8\x8d\xe6\x98\xaf\xe6\xb3\xa8\xe9\x87\x8a'",
+                      b''.join(statements))
+        self.assertTrue(any(statement.endswith(b'TRIM(NEW.name);\nEND */') for statement in statements))
+        self.assertFalse([sql for sql in executed if b'LOCK TABLES' in sql or b'=@OLD_' in sql
+                          or b'= @saved_' in sql])
+
+    # 测试upsert业务键的选择、更新子句及按源表排序规则删除源表已不存在的行
+    def test_upsert_business_key(self):
+        from base._sink import get_upsert_clause
+        import tempfile
+        from types import SimpleNamespace
+        import sqlalchemy as sa
+        from base._upsert import select_business_key, delete_absent_rows
+        unique_keys = [['id'], ['ent_code', 'code']]
+        self.assertEqual(select_business_key(unique_keys), ['id'])
+        self.assertEqual(select_business_key(unique_keys, {'id': 'NULL'}), ['ent_code', 'code'])
+        self.assertIsNone(select_business_key(unique_keys, ['id', 'code']))
+        self.assertEqual(get_upsert_clause(['id', 'code', 'name'], ['code', 'id']),
+                         'ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)')
+        self.assertEqual(get_upsert_clause(['code'], ['code']), 'ON DUPLICATE KEY UPDATE `code` = VALUES(`code`)')
+        # 源表字段不区分大小写，按源表字段的排序规则判断是否存在
+        with tempfile.TemporaryDirectory() as folder:
+            engine = sa.create_engine(f'sqlite:///{folder}/main.db')
+
+            @sa.event.listens_for(engine, 'connect')
+            def attach(dbapi_connection, _):
+                dbapi_connection.execute(f"attach '{folder}/src.db' as src")
+                dbapi_connection.execute(f"attach '{folder}/dst.db' as dst")
+
+            def execute_update(sql, parameters=None):
+                with engine.begin() as conn:
+                    return conn.execute(sa.text(sql), parameters).rowcount
+
+            mysql = SimpleNamespace(execute_query=lambda sql, parameters=None: engine.connect().execute(
+                sa.text(sql), parameters), execute_update=execute_update)
+            with engine.begin() as conn:
+                conn.execute(sa.text('create table src.t (ent_code text, code text collate nocase)'))
+                conn.execute(sa.text('create table dst.t (ent_code text, code text)'))
+                conn.execute(sa.text("insert into src.t values ('e1', 'a01'), ('e1', 'c03'), ('e2', 'b02')"))
+                conn.execute(sa.text("insert into dst.t values ('e1', 'A01'), ('e1', 'b02'), ('e1', 'c03'), ('e2', 'x')"))
+            deleted = delete_absent_rows(mysql, mysql, 'src', 't', ['ent_code', 'code'], target_database='dst',
+                                         source_condition="ent_code = 'e1'", target_condition="ent_code = 'e1'",
+                                         chunksize=2)
+            with engine.connect() as conn:
+                rows = conn.execute(sa.text('select ent_code, code from dst.t order by ent_code, code')).fetchall()
+            engine.dispose()
+        self.assertEqual(deleted, 1)
+        self.assertEqual([tuple(row) for row in rows], [('e1', 'A01'), ('e1', 'c03'), ('e2', 'x')])
+
+    # 测试唯一索引的读取: 允许NULL的字段、前缀索引及函数索引不能识别重复行，主键在最前面
+    def test_table_unique_keys(self):
+        from types import SimpleNamespace
+        rows = [('PRIMARY', 'id', None, 'NO'),
+                ('uk_code', 'ent_code', None, 'NO'), ('uk_code', 'code', None, 'NO'),
+                ('uk_email', 'ent_code', None, 'NO'), ('uk_email', 'email', None, 'YES'),
+                ('uk_name', 'name', 10, 'NO'),
+                ('uk_func', None, None, None)]
+        mysql = SimpleNamespace(execute_query=lambda sql: SimpleNamespace(fetchall=lambda: rows))
+        self.assertEqual(Mysql.get_table_unique_keys(mysql, 'db', 't'), [['id'], ['ent_code', 'code']])